@@ -1,7 +1,8 @@
 from flask import Blueprint, current_app, jsonify, request
 
 from app.infra import job_store
-from app.services.experiment_runner import submit_job, validate_config
+from app.services.cost_estimator import estimate_experiment
+from app.services.experiment_runner import build_expe, submit_job, validate_config
 from app.services.connectivity import check_internet, OFFLINE_STATUS, OFFLINE_ERROR
 
 jobs_bp = Blueprint('jobs', __name__, url_prefix='/api')
@@ -25,10 +26,39 @@ def create_experiment_job():
         import logging
         logging.warning("Experiment launch blocked: no outbound internet connectivity.")
         return jsonify(OFFLINE_ERROR), OFFLINE_STATUS
+    # `maxEstimatedCalls` (optional) rejects a run bigger than intended — e.g.
+    # the wrong validation set times five models — before anything is paid.
+    # It is checked on the pre-run estimate, unlike budget.maxCalls which caps
+    # the calls actually made during the run.
+    if config.get('maxEstimatedCalls'):
+        try:
+            estimate = estimate_experiment(config, build_expe(config))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if estimate['calls'] > config['maxEstimatedCalls']:
+            return jsonify({'error': f"The experiment would make {estimate['calls']} LLM calls, "
+                                     f"more than maxEstimatedCalls ({config['maxEstimatedCalls']})",
+                            'estimate': estimate}), 400
     job = submit_job(current_app._get_current_object(), config)
     return jsonify({'job_id': job['id'], 'status': job['status']}), 202
 
 
+@jobs_bp.route('/jobs/estimate', methods=['POST'])
+def estimate_experiment_job():
+    """Predicted LLM calls, input/output tokens, dollars and wall-clock time
+    of an experiment, from the same config as POST /api/jobs. Nothing is sent
+    to the providers, so it also works offline."""
+    config = request.get_json(silent=True)
+    error = validate_config(config)
+    if error:
+        return jsonify({'error': error}), 400
+    try:
+        expe = build_expe(config)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(estimate_experiment(config, expe)), 200
+
+
 @jobs_bp.route('/jobs/<job_id>', methods=['GET'])
 def get_experiment_job(job_id):
     """Job status + log lines from `offset` onward (pass next_offset back
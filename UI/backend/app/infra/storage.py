@@ -12,6 +12,9 @@ FILES_FOLDER = _BACKEND_DIR / 'files'
 VALIDATION_SETS_FOLDER = FILES_FOLDER / 'validation_sets'
 EVALS_FOLDER = FILES_FOLDER / 'evaluation_results'
 TEMP_FOLDER = FILES_FOLDER / 'temp'
+LLM_CACHE_PATH = FILES_FOLDER / 'cache' / 'llm_responses.sqlite'
+RETRIEVAL_CACHE_PATH = FILES_FOLDER / 'cache' / 'retrieved_chunks.sqlite'
+JOURNALS_FOLDER = FILES_FOLDER / 'journals'
 
 
 def safe_path(folder, filename):
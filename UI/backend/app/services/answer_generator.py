@@ -6,9 +6,10 @@ import logging
 from typing import List, Union
 
 from ragtime.expe import QA, Expe, Question
-from ragtime.generators import AnsGenerator
+from ragtime.generators import AnsGenerator, Stage
 from ragtime.llms import LiteLLM, ReasoningLLM
 from ragtime.prompters import AnsPrompterBase, AnsPrompterWithRetrieverFR
+from ragtime.retrievers import CachedRetriever
 
 from app.infra.event_loop import ensure_event_loop
 from app.utils.class_detector import get_llm_classes, get_retriever_classes
@@ -16,7 +17,7 @@ from app.services.model_meta import reasoning_meta_for
 
 
 class AnswerGeneratorService:
-    def __init__(self, models: Union[str, List[str]], use_retriever: bool = False, retriever_type: str = None, reasoning: bool = None, reasoning_effort: str = None):
+    def __init__(self, models: Union[str, List[str]], use_retriever: bool = False, retriever_type: str = None, reasoning: bool = None, reasoning_effort: str = None, retrieval_cache: dict = None):
         self.models = [models] if isinstance(models, str) else models
         self.llms = []
 
@@ -33,6 +34,9 @@ class AnswerGeneratorService:
                         retriever = None
                     else:
                         retriever = retriever_class()
+                        if retrieval_cache:
+                            # chunks reused across runs: see experiment_runner.retrieval_cache
+                            retriever = CachedRetriever(retriever, **retrieval_cache)
                 else:
                     logging.warning(f"No retriever class found for type: {retriever_type}")
 
@@ -67,11 +71,16 @@ class AnswerGeneratorService:
 
         self.answer_generator = AnsGenerator(llms=self.llms, retriever=retriever)
 
-    def generate_answers(self, expe: Expe) -> Expe:
+    def generate_answers(self, expe: Expe, **generate_kwargs) -> Expe:
         ensure_event_loop()
-        self.answer_generator.generate(expe=expe)
+        self.answer_generator.generate(expe=expe, **generate_kwargs)
         return expe
 
+    def stage(self, max_in_flight: int = None) -> Stage:
+        """Answer generation as a step of a streaming Pipeline."""
+        kwargs = {} if max_in_flight is None else {'max_in_flight': max_in_flight}
+        return Stage(self.answer_generator, name='answers', **kwargs)
+
     def generate_answer_for_question(self, question_data: dict) -> dict:
         expe = Expe()
         qa = QA(question=Question(text=question_data['text']))
@@ -38,6 +38,13 @@ try:
 except Exception:  # pricing must never block model registration
     pass
 
+# OVH AI Endpoints accept 400 requests per minute per API key and model.
+# LiteLLM's catalog knows nothing about OVH, so the limit is registered for
+# each OVH model (see _register_ovh_rate_limits at the bottom): the generators
+# calling the same model (answers, facts, eval) share its budget, while the
+# other models keep their own.
+OVH_RPM = 400
+
 
 def _ovh_params():
     """Common completion kwargs so LiteLLM routes to OVH's endpoint with the
@@ -128,3 +135,17 @@ class OVH_GptOss120B(_OVHBase, ReasoningLLM):
     name: str = "openai/gpt-oss-120b"
     prompter: Prompter = Field(..., description="Prompter instance")
     extra_params: dict = Field(default_factory=_ovh_params)
+
+
+def _register_ovh_rate_limits():
+    """One OVH_RPM budget per OVH model, keyed on the endpoint and the model
+    name sent to LiteLLM."""
+    try:
+        from ragtime.llms.rate_limiter import register_rate_limits
+        for cls in _OVHBase.__subclasses__():
+            register_rate_limits(OVH_API_URL, rpm=OVH_RPM, model=cls.model_fields['name'].default)
+    except Exception:  # rate limiting must never block model registration
+        pass
+
+
+_register_ovh_rate_limits()
@@ -0,0 +1,232 @@
+"""Pre-run estimate of an experiment: LLM calls, tokens, dollars and
+wall-clock time, from the same config as `run_experiment` — nothing is sent
+to the providers.
+
+  - Input tokens come from the prompts the prompters actually build for each
+    question, counted with the model's tokenizer (ragtime.tokens).
+  - Output tokens and latencies come from past results in EVALS_FOLDER
+    (`llm_answer.text` / `llm_answer.duration` per model); models never run
+    before get DEFAULT_OUTPUT_TOKENS / DEFAULT_LATENCY.
+  - Prices come from model_pricing.price_per_m (LiteLLM's map, OVH table).
+
+It is an estimate, not a quote:
+  - the retriever is not called, so answer prompts only include the chunks
+    already in the validation set;
+  - evaluation prompts use the answers of the validation set when there are,
+    a typical answer of the model otherwise;
+  - chunk evaluation counts its worst case (a hallucination call and a
+    missing-facts call per question).
+"""
+import json
+import logging
+import math
+import statistics
+import threading
+
+from ragtime.config import DEFAULT_MAX_IN_FLIGHT
+from ragtime.expe import Answer
+from ragtime.tokens import count_tokens, prompt_target
+
+from app.infra.storage import EVALS_FOLDER
+from app.services.answer_generator import AnswerGeneratorService
+from app.services.evaluation_service import EvaluationService
+from app.services.model_pricing import price_per_m
+
+DEFAULT_OUTPUT_TOKENS = 500
+DEFAULT_LATENCY = 10.0  # seconds
+MAX_HISTORY_FILES = 50  # most recent results scanned for output sizes / latencies
+
+
+# {folder: (signature of its files, history)} - see model_history
+_history_cache = {}
+_history_lock = threading.Lock()
+
+
+def _history_files(folder, max_files):
+    """(path, mtime) of the `max_files` most recent results of `folder`."""
+    files = []
+    for path in folder.glob('*.json'):
+        try:
+            files.append((path, path.stat().st_mtime))
+        except OSError:
+            continue  # deleted meanwhile
+    return sorted(files, key=lambda f: f[1], reverse=True)[:max_files]
+
+
+def _read_history(files):
+    durations, outputs = {}, {}
+    for path, _ in files:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                items = json.load(f).get('items', [])
+        except (OSError, ValueError, AttributeError):
+            continue
+        for qa in items:
+            for ans in (qa.get('answers') or {}).get('items', []):
+                for llm_answer in (ans.get('llm_answer'), (ans.get('eval') or {}).get('llm_answer')):
+                    if not isinstance(llm_answer, dict) or not llm_answer.get('name'):
+                        continue
+                    name = llm_answer['name']
+                    if llm_answer.get('duration'):
+                        durations.setdefault(name, []).append(llm_answer['duration'])
+                    if llm_answer.get('text'):
+                        outputs.setdefault(name, []).append(count_tokens(llm_answer['text']))
+    return {name: {'latency': statistics.median(durations[name]) if name in durations else None,
+                   'output_tokens': int(statistics.median(outputs[name])) if name in outputs else None,
+                   'samples': len(durations.get(name, []))}
+            for name in set(durations) | set(outputs)}
+
+
+def model_history(folder=EVALS_FOLDER, max_files=MAX_HISTORY_FILES):
+    """{model name: {'latency': median s, 'output_tokens': median, 'samples': n}}
+    from the answers and evals of the most recent results.
+    Kept in memory per folder: the results are only read and tokenized again
+    when a file among the most recent ones is added, changed or removed."""
+    files = _history_files(folder, max_files)
+    signature = tuple((path.name, mtime) for path, mtime in files)
+    key = (str(folder), max_files)
+    with _history_lock:
+        cached = _history_cache.get(key)
+    if cached and cached[0] == signature:
+        return cached[1]
+    history = _read_history(files)
+    with _history_lock:
+        _history_cache[key] = (signature, history)
+    return history
+
+
+def _provider(llm):
+    """Provider of an LLM: the `provider` class attribute of the built-in
+    catalog classes (e.g. OVH), LiteLLM's routing of its name otherwise."""
+    provider = getattr(type(llm), 'provider', None)
+    if isinstance(provider, str):
+        return provider
+    try:
+        import litellm
+    except ImportError:  # pragma: no cover
+        return None
+    prefix = llm.name.split('/', 1)[0] if '/' in llm.name else None
+    if prefix in litellm.provider_list:
+        return prefix
+    # None for the models LiteLLM does not know, e.g. the classes of classes.py
+    return (litellm.model_cost.get(llm.name) or {}).get('litellm_provider')
+
+
+class _ModelEstimate:
+    def __init__(self, llm, stage, history):
+        self.llm = llm
+        self.stage = stage
+        past = history.get(llm.name) or {}
+        self.latency = past.get('latency') or DEFAULT_LATENCY
+        self.output_tokens = past.get('output_tokens') or DEFAULT_OUTPUT_TOKENS
+        self.calls = 0
+        self.input_tokens = 0
+
+    def add_call(self, prompt):
+        self.calls += 1
+        self.input_tokens += count_tokens(prompt.system, self.llm.name) + count_tokens(prompt.user, self.llm.name)
+
+    def to_dict(self):
+        output_tokens = self.calls * self.output_tokens
+        price = price_per_m(self.llm.name, _provider(self.llm))
+        cost = None
+        if price:
+            cost = round((self.input_tokens * price['input'] + output_tokens * price['output']) / 1_000_000, 4)
+        return {'stage': self.stage, 'model': self.llm.name, 'calls': self.calls,
+                'input_tokens': self.input_tokens, 'output_tokens': output_tokens,
+                'cost_usd': cost, 'latency_s': round(self.latency, 2)}
+
+
+def _build_prompt(llm, **kwargs):
+    token = prompt_target.set((llm.name, llm._effective_max_tokens()))
+    try:
+        return llm.prompter.get_prompt(**kwargs)
+    finally:
+        prompt_target.reset(token)
+
+
+def estimate_experiment(config, expe, history=None):
+    """Estimate of the run of `config` on `expe` (see build_expe) — returns
+    totals, a line per stage and model, and the stage durations."""
+    history = model_history() if history is None else history
+    concurrency = config.get('stageConcurrency') or {}
+    estimates = []
+    answer_estimates = []
+
+    if not config.get('withCSV'):
+        use_retriever = config.get('useRetriever', False) or 'Albert_LLM' in config['answerGenerationModels']
+        service = AnswerGeneratorService(config['answerGenerationModels'], use_retriever=use_retriever,
+                                         retriever_type=None, reasoning=config.get('reasoning'),
+                                         reasoning_effort=config.get('reasoningEffort'))
+        answer_estimates = [_ModelEstimate(llm, 'answers', history) for llm in service.llms]
+        for qa in expe:
+            for est in answer_estimates:
+                est.add_call(_build_prompt(est.llm, question=qa.question, chunks=qa.chunks))
+        estimates += answer_estimates
+
+    if config.get('evaluateAnswers') or config.get('evaluateChunks'):
+        evaluator = EvaluationService(config['evaluationModel'])
+        if config.get('evaluateAnswers'):
+            est = _ModelEstimate(evaluator._answers_generator().llms[0], 'evals', history)
+            for qa in expe:
+                if not qa.facts or not len(qa.facts):
+                    continue  # not evaluated
+                answers = [a for a in qa.answers if a.text] if config.get('withCSV') else [
+                    Answer(text='mot ' * e.output_tokens) for e in answer_estimates]
+                for answer in answers:
+                    est.add_call(_build_prompt(est.llm, answer=answer, facts=qa.facts))
+            estimates.append(est)
+        if config.get('evaluateChunks'):
+            est = _ModelEstimate(evaluator._chunks_generator().llms[0], 'chunk_evals', history)
+            for qa in expe:
+                if qa.chunks and len(qa.chunks) and qa.facts and len(qa.facts):
+                    prompt = _build_prompt(est.llm, question=qa.question, facts=qa.facts.items, chunks=qa.chunks)
+                    est.add_call(prompt)
+                    est.add_call(prompt)
+            estimates.append(est)
+
+    # every LLM call of every stage goes through the single Scheduler of the
+    # Pipeline: at most DEFAULT_MAX_IN_FLIGHT calls run at a time across all
+    # the stages, and a stage runs at most `stageConcurrency` questions, each
+    # with all its calls, at a time
+    stages = {}
+    for est in estimates:
+        stages.setdefault(est.stage, []).append(est)
+    durations = {}
+    per_question = {}
+    busy = 0.0  # seconds of calls, all stages together
+    for stage, ests in stages.items():
+        calls = sum(e.calls for e in ests)
+        if not calls:
+            continue
+        calls_per_question = math.ceil(calls / max(len(expe), 1))
+        in_flight = min(DEFAULT_MAX_IN_FLIGHT, (concurrency.get(stage) or DEFAULT_MAX_IN_FLIGHT) * calls_per_question)
+        stage_busy = sum(e.calls * e.latency for e in ests)
+        per_question[stage] = max(e.latency for e in ests)
+        durations[stage] = round(max(stage_busy / in_flight, per_question[stage]), 1)
+        busy += stage_busy
+    # the stages are pipelined: the slowest one sets the pace, the others add
+    # the latency of a single question - unless the calls of all the stages
+    # together saturate the global limit
+    wall_clock = 0.0
+    if durations:
+        slowest_stage = max(durations, key=durations.get)
+        wall_clock = max(durations[slowest_stage] + sum(v for s, v in per_question.items() if s != slowest_stage),
+                         busy / DEFAULT_MAX_IN_FLIGHT)
+
+    lines = [e.to_dict() for e in estimates]
+    costs = [line['cost_usd'] for line in lines]
+    unpriced = sorted({line['model'] for line in lines if line['cost_usd'] is None})
+    if unpriced:
+        logging.info(f"No price known for {unpriced} - left out of the cost estimate")
+    return {
+        'questions': len(expe),
+        'calls': sum(line['calls'] for line in lines),
+        'input_tokens': sum(line['input_tokens'] for line in lines),
+        'output_tokens': sum(line['output_tokens'] for line in lines),
+        'cost_usd': round(sum(c for c in costs if c is not None), 4),
+        'unpriced_models': unpriced,
+        'wall_clock_s': round(wall_clock, 1),
+        'stage_durations_s': durations,
+        'models': lines,
+    }
@@ -3,8 +3,8 @@ no shared singleton state (B3 fix).
 """
 import logging
 
-from ragtime.expe import Answer, Eval, Expe
-from ragtime.generators import EvalGenerator, EvalGeneratorChunks
+from ragtime.expe import QA, Answer, Eval, Expe
+from ragtime.generators import EvalGenerator, EvalGeneratorChunks, Stage
 
 from app.services.llm_factory import build_llm
 from ragtime.prompters import EvalPrompterChunks, EvalPrompterFRV2
@@ -18,27 +18,20 @@ class EvaluationService:
         self.chunk_prompter = EvalPrompterChunks()
         self.model = model_name
 
-    def evaluate_answers(self, expe: Expe) -> Expe:
+    def evaluate_answers(self, expe: Expe, **generate_kwargs) -> Expe:
         ensure_event_loop()
-        # Pass an LLM OBJECT, not a bare string: the package would wrap a
-        # string in a plain LiteLLM, which for a reasoning judge (o4-mini,
-        # gpt-5) means the 2000-token budget is consumed by hidden reasoning
-        # and the verdict text comes back EMPTY -> every fact scored missing.
-        eval_gen = EvalGenerator(llms=[build_llm(self.model, self.answer_prompter)],
-                                 prompter=self.answer_prompter)
-        eval_gen.generate(expe=expe)
+        self._answers_generator().generate(expe=expe, **generate_kwargs)
         return expe
 
-    def evaluate_chunks(self, expe: Expe) -> Expe:
+    def evaluate_chunks(self, expe: Expe, **generate_kwargs) -> Expe:
         ensure_event_loop()
         # Initialize metadata for all answers before evaluation
         self._initialize_metadata(expe)
 
-        chunk_eval_gen = EvalGeneratorChunks(llms=[build_llm(self.model, self.chunk_prompter)],
-                                             prompter=self.chunk_prompter)
+        chunk_eval_gen = self._chunks_generator()
 
         try:
-            chunk_eval_gen.generate(expe=expe)
+            chunk_eval_gen.generate(expe=expe, **generate_kwargs)
         except Exception as e:
             logging.error(f"Error in evaluate_chunks: {str(e)}")
             # If an error occurs during generation, we'll log it and return the expe as is
@@ -46,21 +39,49 @@ class EvaluationService:
 
         return expe
 
+    def answers_stage(self, max_in_flight: int = None) -> Stage:
+        """Answer evaluation as a step of a streaming Pipeline."""
+        kwargs = {} if max_in_flight is None else {'max_in_flight': max_in_flight}
+        return Stage(self._answers_generator(), name='evals', **kwargs)
+
+    def chunks_stage(self, max_in_flight: int = None) -> Stage:
+        """Chunk evaluation as a step of a streaming Pipeline — the metadata
+        of each QA is initialized right before its chunks are evaluated."""
+        kwargs = {} if max_in_flight is None else {'max_in_flight': max_in_flight}
+        return Stage(self._chunks_generator(), name='chunk_evals',
+                     prepare=self._initialize_qa_metadata, **kwargs)
+
+    def _answers_generator(self) -> EvalGenerator:
+        # Pass an LLM OBJECT, not a bare string: the package would wrap a
+        # string in a plain LiteLLM, which for a reasoning judge (o4-mini,
+        # gpt-5) means the 2000-token budget is consumed by hidden reasoning
+        # and the verdict text comes back EMPTY -> every fact scored missing.
+        return EvalGenerator(llms=[build_llm(self.model, self.answer_prompter)],
+                             prompter=self.answer_prompter)
+
+    def _chunks_generator(self) -> EvalGeneratorChunks:
+        return EvalGeneratorChunks(llms=[build_llm(self.model, self.chunk_prompter)],
+                                   prompter=self.chunk_prompter)
+
     def _initialize_metadata(self, expe: Expe):
         for qa in expe:
-            for ans in qa.answers:
-                if not isinstance(ans, Answer):
-                    continue
-                if not hasattr(ans, 'eval') or ans.eval is None:
-                    ans.eval = Eval()
-                if not hasattr(ans.eval, 'meta') or ans.eval.meta is None:
-                    ans.eval.meta = {}
-
-                # Initialize all required metadata fields
-                meta = ans.eval.meta
-                meta.setdefault('missing', [])
-                meta.setdefault('nb_missing', 0)
-                meta.setdefault('ok', [])
-                meta.setdefault('nb_ok', 0)
-                meta.setdefault('hallu', [])
-                meta.setdefault('nb_hallu', 0)
+            self._initialize_qa_metadata(qa)
+
+    @staticmethod
+    def _initialize_qa_metadata(qa: QA):
+        for ans in qa.answers:
+            if not isinstance(ans, Answer):
+                continue
+            if not hasattr(ans, 'eval') or ans.eval is None:
+                ans.eval = Eval()
+            if not hasattr(ans.eval, 'meta') or ans.eval.meta is None:
+                ans.eval.meta = {}
+
+            # Initialize all required metadata fields
+            meta = ans.eval.meta
+            meta.setdefault('missing', [])
+            meta.setdefault('nb_missing', 0)
+            meta.setdefault('ok', [])
+            meta.setdefault('nb_ok', 0)
+            meta.setdefault('hallu', [])
+            meta.setdefault('nb_hallu', 0)
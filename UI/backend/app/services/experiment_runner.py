@@ -12,10 +12,16 @@ import os
 from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
+from ragtime.budget import Budget
+from ragtime.cache import CacheMode, DiskCache
 from ragtime.expe import Expe
+from ragtime.generators import Pipeline
+from ragtime.llms.circuit_breaker import add_circuit_listener, circuit_states, remove_circuit_listener
 
 from app.infra import job_store
-from app.infra.storage import EVALS_FOLDER, VALIDATION_SETS_FOLDER, safe_path
+from app.infra.event_loop import ensure_event_loop
+from app.infra.storage import (EVALS_FOLDER, JOURNALS_FOLDER, LLM_CACHE_PATH, RETRIEVAL_CACHE_PATH,
+                               VALIDATION_SETS_FOLDER, safe_path)
 from app.services.answer_generator import AnswerGeneratorService
 from app.services.evaluation_service import EvaluationService
 
@@ -24,6 +30,8 @@ from app.services.evaluation_service import EvaluationService
 _executor = ThreadPoolExecutor(max_workers=1)
 
 REQUIRED_FIELDS = ['name', 'validationSet', 'evaluationModel', 'answerGenerationModels']
+STAGES = ['answers', 'evals', 'chunk_evals']
+BUDGET_LIMITS = {'maxUsd': 'max_usd', 'maxTokens': 'max_tokens', 'maxCalls': 'max_calls'}
 
 
 def validate_config(config):
@@ -31,6 +39,26 @@ def validate_config(config):
         return 'Configuration must be a JSON object'
     if not all(field in config for field in REQUIRED_FIELDS):
         return 'Missing required fields in configuration'
+    if config.get('llmCache') and config['llmCache'] not in {m.value for m in CacheMode}:
+        return f"Invalid llmCache: expected one of {[m.value for m in CacheMode]}"
+    if config.get('retrievalCache') and config['retrievalCache'] not in {m.value for m in CacheMode}:
+        return f"Invalid retrievalCache: expected one of {[m.value for m in CacheMode]}"
+    ttl = config.get('retrievalCacheTtl')
+    if ttl is not None and (not isinstance(ttl, (int, float)) or isinstance(ttl, bool) or ttl < 0):
+        return 'Invalid retrievalCacheTtl: expected a number of seconds >= 0'
+    concurrency = config.get('stageConcurrency') or {}
+    if not isinstance(concurrency, dict) or any(
+            stage not in STAGES or not isinstance(n, int) or isinstance(n, bool) or n < 0
+            for stage, n in concurrency.items()):
+        return f"Invalid stageConcurrency: expected {{stage: int >= 0}} with stages in {STAGES}"
+    max_calls = config.get('maxEstimatedCalls')
+    if max_calls is not None and (not isinstance(max_calls, int) or isinstance(max_calls, bool) or max_calls < 0):
+        return 'Invalid maxEstimatedCalls: expected an int >= 0'
+    budget = config.get('budget') or {}
+    if not isinstance(budget, dict) or any(
+            key not in BUDGET_LIMITS or not isinstance(v, (int, float)) or isinstance(v, bool) or v < 0
+            for key, v in budget.items()):
+        return f"Invalid budget: expected {{limit: number >= 0}} with limits in {list(BUDGET_LIMITS)}"
     return None
 
 
@@ -62,9 +90,64 @@ def build_expe(config):
     return expe
 
 
+def generate_options(config):
+    """Per-run options forwarded to every package `generate` call.
+
+    `llmCache` ('read_write' | 'read_only' | 'bypass', default 'bypass')
+    reuses LLM responses stored by previous runs for identical prompts — e.g.
+    to re-evaluate the same answers or re-render a report without paying the
+    providers again. Off by default: with temperature > 0, re-running is
+    sometimes the point.
+
+    `budget` ({maxUsd, maxTokens, maxCalls}, all optional) caps the spend of
+    the run: once a limit is reached no new LLM call is made and the results
+    obtained so far are saved. What was spent ends up in the Expe's meta.
+    """
+    cache_mode = CacheMode(config.get('llmCache') or CacheMode.bypass.value)
+    options = {}
+    if cache_mode != CacheMode.bypass:
+        options.update(cache=DiskCache(LLM_CACHE_PATH), cache_mode=cache_mode)
+    budget = {BUDGET_LIMITS[k]: v for k, v in (config.get('budget') or {}).items() if v}
+    if budget:
+        options['budget'] = Budget(**budget)
+    return options
+
+
+def retrieval_cache(config):
+    """The DiskCache options of the retriever, None if retrieved chunks are not cached.
+
+    `retrievalCache` ('read_write' | 'read_only' | 'bypass', default 'bypass')
+    reuses the chunks retrieved by previous runs for the same question with
+    the same retriever, e.g. when comparing LLMs on one validation set.
+    `retrievalCacheTtl` (seconds, default one day, 0 for no limit) is how long
+    chunks are reused: they get stale when the indexed documents change.
+    """
+    mode = CacheMode(config.get('retrievalCache') or CacheMode.bypass.value)
+    if mode == CacheMode.bypass:
+        return None
+    options = {'cache': DiskCache(RETRIEVAL_CACHE_PATH), 'cache_mode': mode}
+    if config.get('retrievalCacheTtl') is not None:
+        options['ttl'] = config['retrievalCacheTtl']
+    return options
+
+
 def run_experiment(config):
-    """Execute the experiment synchronously. Returns the output path."""
+    """Execute the experiment synchronously. Returns the output path.
+
+    The stages (answers -> evals -> chunk_evals) run as one streaming
+    Pipeline: a question is evaluated as soon as its answers are ready
+    instead of waiting for the slowest question of the whole set.
+    `stageConcurrency` ({stage: max questions in flight}, optional) tunes
+    each stage; LLM call limits and the cache are shared by all of them.
+
+    Every result is appended to a journal as soon as it is generated.
+    `resume: true` replays the journal left by a run with the same name
+    that crashed or was killed, and only generates what is missing.
+    """
     expe = build_expe(config)
+    options = generate_options(config)
+    concurrency = config.get('stageConcurrency') or {}
+    stages = []
 
     if not config['withCSV']:
         models = config['answerGenerationModels']
@@ -80,20 +163,30 @@ def run_experiment(config):
         logging.info(f"Generating answers with models: {models}")
         reasoning = config.get('reasoning')
         reasoning_effort = config.get('reasoningEffort')
-        generator = AnswerGeneratorService(models, use_retriever=use_retriever, retriever_type=retriever_type, reasoning=reasoning, reasoning_effort=reasoning_effort)
-        expe = generator.generate_answers(expe)
-
-    if config['evaluateAnswers']:
-        logging.info(f"Evaluating answers with model: {config['evaluationModel']}")
-        evaluator = EvaluationService(config['evaluationModel'])
-        expe = evaluator.evaluate_answers(expe)
+        generator = AnswerGeneratorService(models, use_retriever=use_retriever, retriever_type=retriever_type, reasoning=reasoning, reasoning_effort=reasoning_effort,
+                                           retrieval_cache=retrieval_cache(config))
+        stages.append(generator.stage(concurrency.get('answers')))
 
-    if config['evaluateChunks']:
-        logging.info(f"Evaluating chunks with model: {config['evaluationModel']}")
+    if config['evaluateAnswers'] or config['evaluateChunks']:
         evaluator = EvaluationService(config['evaluationModel'])
-        expe = evaluator.evaluate_chunks(expe)
-
-    return expe.save_to_json(path=EVALS_FOLDER / config['name'])
+        if config['evaluateAnswers']:
+            logging.info(f"Evaluating answers with model: {config['evaluationModel']}")
+            stages.append(evaluator.answers_stage(concurrency.get('evals')))
+        if config['evaluateChunks']:
+            logging.info(f"Evaluating chunks with model: {config['evaluationModel']}")
+            stages.append(evaluator.chunks_stage(concurrency.get('chunk_evals')))
+
+    journal_path = safe_path(JOURNALS_FOLDER, f"{config['name']}.journal.jsonl")
+    resume = bool(config.get('resume'))
+    if not resume:
+        journal_path.unlink(missing_ok=True)
+    if stages:
+        ensure_event_loop()
+        Pipeline(stages, **options).run(expe, journal=journal_path, resume=resume)
+
+    output_path = expe.save_to_json(path=EVALS_FOLDER / config['name'])
+    journal_path.unlink(missing_ok=True)  # the results are safe in the saved Expe
+    return output_path
 
 
 class _JobLogHandler(logging.Handler):
@@ -115,6 +208,13 @@ def _run_job(app, job_id, config):
     # logger "ragtime_logger" — handlers attach to the underlying logger.
     package_logger = logging.getLogger('ragtime_logger')
     package_logger.addHandler(handler)
+
+    # The state changes are already in the job log through the package logger;
+    # the job record keeps the current state of every circuit for the frontend.
+    def on_circuit_change(key, state):
+        job_store.update_job(job_id, circuits=circuit_states())
+
+    add_circuit_listener(on_circuit_change)
     with app.app_context():
         from app.services import key_service
         key_service.ensure_fresh()
@@ -134,6 +234,8 @@ def _run_job(app, job_id, config):
             job_store.update_job(job_id, status='failed', error=str(e),
                                  finished_at=datetime.now().isoformat())
         finally:
+            remove_circuit_listener(on_circuit_change)
+            job_store.update_job(job_id, circuits=circuit_states())
             package_logger.removeHandler(handler)
 
 
@@ -0,0 +1,6 @@
+"""The backend is run from its own folder (wsgi.py), so `app` and `config` are top-level packages."""
+import os
+import sys
+
+os.environ.setdefault('LITELLM_LOCAL_MODEL_COST_MAP', 'True')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,106 @@
+"""Tests for the pre-run estimate of an experiment and the maxEstimatedCalls check of POST /api/jobs.
+
+No network / API keys required: nothing is sent to the providers.
+"""
+import json
+import os
+
+import pytest
+from flask import Flask
+
+from ragtime.expe import Expe, Fact, Facts, QA, Question
+
+import app.api.jobs as jobs
+import app.services.cost_estimator as cost_estimator
+from app.services.cost_estimator import DEFAULT_OUTPUT_TOKENS, estimate_experiment, model_history
+
+CONFIG = {'name': 'test', 'validationSet': 'set.json', 'evaluationModel': 'gpt-4o-mini',
+          'answerGenerationModels': ['gpt-4o-mini', 'my-private-model'], 'evaluateAnswers': True}
+
+
+def _expe():
+    expe = Expe()
+    expe.append(QA(question=Question(text='Quelle est la capitale de la France ?'),
+                   facts=Facts(items=[Fact(text='1. Paris')])))
+    expe.append(QA(question=Question(text='Question sans faits')))
+    return expe
+
+
+def test_estimate_counts_calls_and_tokens_per_stage():
+    history = {'gpt-4o-mini': {'latency': 2.0, 'output_tokens': 100, 'samples': 3}}
+    estimate = estimate_experiment(CONFIG, _expe(), history=history)
+
+    lines = {(line['stage'], line['model']): line for line in estimate['models']}
+    assert set(lines) == {('answers', 'gpt-4o-mini'), ('answers', 'my-private-model'), ('evals', 'gpt-4o-mini')}
+    # an answer per question and model, an eval per answer of the questions with facts
+    assert lines['answers', 'gpt-4o-mini']['calls'] == 2 and lines['evals', 'gpt-4o-mini']['calls'] == 2
+    assert lines['answers', 'gpt-4o-mini']['output_tokens'] == 2 * 100
+    assert lines['answers', 'my-private-model']['output_tokens'] == 2 * DEFAULT_OUTPUT_TOKENS
+    assert all(line['input_tokens'] > 0 for line in lines.values())
+    assert estimate['calls'] == 6 and estimate['input_tokens'] == sum(l['input_tokens'] for l in lines.values())
+    assert set(estimate['stage_durations_s']) == {'answers', 'evals'}
+
+
+def test_unknown_model_price_is_left_out_of_the_cost():
+    estimate = estimate_experiment(CONFIG, _expe(), history={})
+    lines = {(line['stage'], line['model']): line for line in estimate['models']}
+    assert lines['answers', 'my-private-model']['cost_usd'] is None
+    assert estimate['unpriced_models'] == ['my-private-model']
+    assert estimate['cost_usd'] == round(lines['answers', 'gpt-4o-mini']['cost_usd']
+                                         + lines['evals', 'gpt-4o-mini']['cost_usd'], 4) > 0
+
+
+def test_model_history_is_only_read_again_when_a_result_changes(tmp_path, monkeypatch):
+    result = {'items': [{'answers': {'items': [{'llm_answer': {'name': 'm', 'text': 'une réponse', 'duration': 4.0}}]}}]}
+    path = tmp_path / 'result.json'
+    path.write_text(json.dumps(result), encoding='utf-8')
+    counted = []
+    monkeypatch.setattr(cost_estimator, 'count_tokens', lambda text, model=None: counted.append(text) or 7)
+
+    assert model_history(tmp_path) == {'m': {'latency': 4.0, 'output_tokens': 7, 'samples': 1}}
+    assert model_history(tmp_path)['m']['latency'] == 4.0 and len(counted) == 1
+
+    result['items'][0]['answers']['items'][0]['llm_answer']['duration'] = 6.0
+    path.write_text(json.dumps(result), encoding='utf-8')
+    os.utime(path, (path.stat().st_atime, path.stat().st_mtime + 10))
+    assert model_history(tmp_path)['m']['latency'] == 6.0 and len(counted) == 2
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(jobs, 'check_internet', lambda: True)
+    monkeypatch.setattr(jobs, 'build_expe', lambda config: _expe())
+    monkeypatch.setattr(jobs, 'estimate_experiment', lambda config, expe: {'calls': 12})
+    monkeypatch.setattr(jobs, 'submit_job', lambda app, config: {'id': 'job', 'status': 'queued'})
+    app = Flask(__name__)
+    app.register_blueprint(jobs.jobs_bp)
+    return app.test_client()
+
+
+def test_job_making_more_calls_than_max_estimated_calls_is_rejected(client):
+    response = client.post('/api/jobs', json={**CONFIG, 'maxEstimatedCalls': 10})
+    assert response.status_code == 400
+    assert 'maxEstimatedCalls (10)' in response.get_json()['error']
+    assert response.get_json()['estimate'] == {'calls': 12}
+
+    assert client.post('/api/jobs', json={**CONFIG, 'maxEstimatedCalls': 12}).status_code == 202
+    # budget.maxCalls caps the run itself, it is not checked before the run
+    assert client.post('/api/jobs', json={**CONFIG, 'budget': {'maxCalls': 1}}).status_code == 202
+    assert client.post('/api/jobs', json={**CONFIG, 'maxEstimatedCalls': -1}).status_code == 400
+
+
+def test_duration_is_bounded_by_the_global_call_limit():
+    models = [f'model-{i}' for i in range(6)]
+    config = {**CONFIG, 'answerGenerationModels': models, 'evaluateAnswers': False}
+    expe = Expe()
+    for i in range(20):
+        expe.append(QA(question=Question(text=f'Question {i}')))
+    history = {name: {'latency': 3.0, 'output_tokens': 100, 'samples': 1} for name in models}
+    estimate = estimate_experiment(config, expe, history=history)
+    # 120 calls of 3 s, 10 at a time across the stages: not 10 questions x 6 models at a time
+    assert estimate['calls'] == 120
+    assert estimate['stage_durations_s'] == {'answers': 36.0} and estimate['wall_clock_s'] == 36.0
+
+    # fewer questions in flight than the global limit allows
+    estimate = estimate_experiment({**config, 'stageConcurrency': {'answers': 1}}, expe, history=history)
+    assert estimate['stage_durations_s'] == {'answers': 60.0}
@@ -1,4 +1,5 @@
-from ragtime.base import call_api, REQ_GET, REQ_POST
+from ragtime.base import acall_api, call_api, REQ_GET, REQ_POST
+from ragtime.http_client import aclose_async_client, get_session, session_timeout
 from ragtime.llms import LLM
 from ragtime.expe import QA, Prompt, LLMAnswer, Chunk
 from ragtime.config import logger, DEFAULT_TEMPERATURE
@@ -13,6 +14,7 @@ from typing import Dict, Any, ClassVar, List
 from ragtime.retrievers import Retriever
 import asyncio
 import logging
+import time
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -22,6 +24,9 @@ load_dotenv()
 ALBERT_BASE_URL = os.environ.get('ALBERT_BASE_URL')
 ALBERT_MODEL = os.environ.get('ALBERT_MODEL')
 DEFAULT_MAX_TOKENS = 2000
+# seconds after which the list of Albert collections is refreshed - in the background, completions do not wait for it
+ALBERT_COLLECTIONS_TTL = float(os.environ.get('ALBERT_COLLECTIONS_TTL', 300))
+ALBERT_SEARCH_CONCURRENCY = 8  # max searches in flight in search_many
 
 logger = logging.getLogger(__name__)
 SEARCH_USERNAME: str = "..."
@@ -65,7 +70,8 @@ class Search(Retriever):
             params["folder_id"] = qa.question.åmeta["folder_id"]
 
         try:
-            response = requests.post(SEARCH_URL_SEARCH, headers=headers, params=params, json={})
+            response = get_session().post(SEARCH_URL_SEARCH, headers=headers, params=params, json={},
+                                          timeout=session_timeout())
             response.raise_for_status()
             search_results = response.json()
                         
@@ -118,27 +124,63 @@ class Search(Retriever):
         elif (self.token == "") or (datetime.now() - self.token_last_update).total_seconds() > self.TOKEN_DURATION * 3600:
             headers = {"Content-Type": "application/json"}
             data = {"username": SEARCH_USERNAME, "password": SEARCH_PASSWORD}
-            response = requests.post(SEARCH_URL_LOGIN, json=data, headers=headers)
+            response = get_session().post(SEARCH_URL_LOGIN, json=data, headers=headers, timeout=session_timeout())
             response.raise_for_status()
             self._token = response.json()["access_token"]
             self._token_last_update = datetime.now()
 
-class AlbertLLM_GuillaumeTellLLM(LLM):
-    """Albert API LLM implementation"""
-    name: str = ALBERT_MODEL
-    prompter: Prompter = Field(..., description="Prompter instance")
-    albert_model: ClassVar[str] = ALBERT_MODEL
+class _CollectionsCache:
+    """Collections of an Albert account, shared by every Albert LLM using it.
+    Listed at first use, then refreshed in the background once older than `ttl`: the
+    completions keep using the previous list meanwhile instead of listing the collections for each question"""
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self.collections = None
+        self.updated = 0.0
+        self._task = None  # the listing in progress, shared by the callers waiting for it
+
+    async def get(self, fetch):
+        """Returns the collections - fetch() is the coroutine listing them
+        The callers arriving during the first listing await it, and get its exception if it fails"""
+        if self.collections is None:
+            return await asyncio.shield(self._listing(fetch))
+        if time.monotonic() - self.updated > self.ttl:
+            self._listing(fetch, b_background=True)
+        return self.collections
+
+    def _listing(self, fetch, b_background: bool = False) -> asyncio.Task:
+        """The listing in progress in the current event loop, started if there is none"""
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._task.get_loop() is not loop:
+            self._task = loop.create_task(self._refresh(fetch))
+            if b_background:
+                self._task.add_done_callback(self._log_failure)
+        return self._task
+
+    async def _refresh(self, fetch):
+        collections = await fetch()
+        self.collections = collections
+        self.updated = time.monotonic()
+        logger.debug(f"{len(collections)} Albert collection(s) listed")
+        return collections
+
+    @staticmethod
+    def _log_failure(task: asyncio.Task):
+        if not task.cancelled() and task.exception():
+            logger.warning(f"Could not refresh the Albert collections, keep the previous ones: {task.exception()}")
+
+    def invalidate(self):
+        self.collections = None
+
+
+_collections_caches: Dict[str, _CollectionsCache] = {}  # per API key
+
+
+class _AlbertBase:
+    """Calls shared by the Albert LLMs - asynchronous, through the pooled HTTP client of the event loop,
+    so that the calls of the other QAs go on while waiting and the connection to Albert is reused"""
     built_in_retriever: ClassVar[bool] = True
-    max_tokens: int = DEFAULT_MAX_TOKENS
-    temperature: float = DEFAULT_TEMPERATURE
-    api_key: str = Field(default_factory=lambda: os.getenv('ALBERT_API_KEY'))
-    _num_retries: int = 3
-    
-    def __init__(self, **data):
-        """Initialize the Albert LLM client."""
-        super().__init__(**data)
-        if not self.api_key:
-            raise ValueError("ALBERT_API_KEY environment variable is not set")
 
     @property
     def headers(self):
@@ -148,20 +190,24 @@ class AlbertLLM_GuillaumeTellLLM(LLM):
             'Content-Type': 'application/json'
         }
 
-    def get_collections(self):
+    @property
+    def collections_cache(self) -> _CollectionsCache:
+        return _collections_caches.setdefault(self.api_key, _CollectionsCache(ALBERT_COLLECTIONS_TTL))
+
+    async def collection_ids(self) -> list:
+        """Ids of the BGE collections, from the cache shared by the Albert LLMs"""
+        return [coll['id'] for coll in await self.collections_cache.get(self.get_collections)]
+
+    async def get_collections(self):
         """Get available BGE model collections."""
-        response = requests.get(
-            f'{ALBERT_BASE_URL}/v1/collections',
-            headers=self.headers
-        )
-        response.raise_for_status()
+        response = await acall_api(REQ_GET, f'{ALBERT_BASE_URL}/v1/collections', headers=self.headers)
         collections = response.json()['data']
         return [
             coll for coll in collections 
             if coll['model'] == 'BAAI/bge-m3'
         ]
 
-    def search_chunks(self, prompt: str, collection_ids: list, k: int = 5):
+    async def search_chunks(self, prompt: str, collection_ids: list, k: int = 5):
         """Search for relevant chunks."""
         payload = {
             "prompt": prompt,
@@ -170,12 +216,7 @@ class AlbertLLM_GuillaumeTellLLM(LLM):
             "score_threshold": 0
         }
         
-        response = requests.post(
-            f'{ALBERT_BASE_URL}/v1/search',
-            headers=self.headers,
-            json=payload
-        )
-        response.raise_for_status()
+        response = await acall_api(REQ_POST, f'{ALBERT_BASE_URL}/v1/search', headers=self.headers, json=payload)
         
         chunks = []
         for item in response.json()['data']:
@@ -189,7 +230,19 @@ class AlbertLLM_GuillaumeTellLLM(LLM):
             chunks.append(chunk_data)
         return chunks
 
-    def generate_answer(self, prompt: Prompt, context_chunks: list) -> str:
+    async def search_many(self, prompts: List[str], k: int = 5) -> List[list]:
+        """Search the chunks of many questions at once - the searches run concurrently on the pooled
+        connections, at most ALBERT_SEARCH_CONCURRENCY at the same time, and share one collections listing"""
+        collection_ids = await self.collection_ids()
+        sem = asyncio.Semaphore(ALBERT_SEARCH_CONCURRENCY)
+
+        async def _search(prompt: str) -> list:
+            async with sem:
+                return await self.search_chunks(prompt=prompt, collection_ids=collection_ids, k=k)
+
+        return await asyncio.gather(*(_search(prompt) for prompt in prompts))
+
+    async def generate_answer(self, prompt: Prompt, context_chunks: list) -> str:
         """Generate answer using context chunks."""
         context = "\n\n".join([
             f"Chunk (score: {chunk['score']}):\n{chunk['text']}"
@@ -215,12 +268,7 @@ class AlbertLLM_GuillaumeTellLLM(LLM):
             "stream": False
         }
         
-        response = requests.post(
-            f'{ALBERT_BASE_URL}/v1/chat/completions',
-            headers=self.headers,
-            json=payload
-        )
-        response.raise_for_status()
+        response = await acall_api(REQ_POST, f'{ALBERT_BASE_URL}/v1/chat/completions', headers=self.headers, json=payload)
         return response.json()['choices'][0]['message']['content']
 
     async def complete(self, prompt: Prompt) -> LLMAnswer:
@@ -232,24 +280,24 @@ class AlbertLLM_GuillaumeTellLLM(LLM):
 
         while retry < self._num_retries:
             try:
-                # Get collections and their IDs
-                collections = self.get_collections()
-                collection_ids = [coll['id'] for coll in collections]
+                # Get the IDs of the collections - listed once and shared by the Albert LLMs
+                collection_ids = await self.collection_ids()
                 
                 # Search for relevant chunks
-                chunks = self.search_chunks(
+                chunks = await self.search_chunks(
                     prompt=prompt.user,
                     collection_ids=collection_ids
                 )
                 
                 # Generate answer
-                result = self.generate_answer(
+                result = await self.generate_answer(
                     prompt=prompt,
                     context_chunks=chunks
                 )
                 break
             except Exception as e:
                 logger.debug(f"Exception occurred during API call, will retry {retry} of {self._num_retries}\nERROR:\n{e}")
+                self.collections_cache.invalidate()  # in case a collection has been deleted
                 await asyncio.sleep(time_to_wait)
                 retry += 1
                 if retry >= self._num_retries:
@@ -268,12 +316,69 @@ class AlbertLLM_GuillaumeTellLLM(LLM):
             cost=None
         )
 
-class AlbertLLM_Llama3InstructLLM(LLM):
+class AlbertRetriever(_AlbertBase, Retriever):
+    """Retrieves the chunks of the BGE collections of an Albert account
+    `retrieve_many` searches the questions of a batch with `search_many`, concurrently and with one
+    collections listing - hence the default `batch_size`, so that AnsGenerator groups the QAs in flight
+    - top_k: max number of chunks per question
+    Chunks get the meta score, display_name (document name), page_number (empty), document_id and collection_id"""
+    api_key: str = Field(default_factory=lambda: os.getenv('ALBERT_API_KEY'))
+    top_k: int = 5
+    batch_size: int = 16
+
+    def __init__(self, **data):
+        super().__init__(**data)
+        if not self.api_key:
+            raise ValueError("ALBERT_API_KEY environment variable is not set")
+
+    def retrieve(self, qa: QA):
+        """Synchronous version, for callers without an event loop - runs the search in a loop of its own"""
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(self.retrieve_many([qa]))
+        finally:
+            # the pooled client of this loop would otherwise keep its connections open
+            loop.run_until_complete(aclose_async_client())
+            loop.close()
+
+    async def aretrieve(self, qa: QA):
+        await self.retrieve_many([qa])
+
+    async def retrieve_many(self, qas: List[QA]):
+        results = await self.search_many([qa.question.text for qa in qas], k=self.top_k)
+        for qa, chunks in zip(qas, results):
+            qa.chunks.empty()
+            for chunk in chunks:
+                qa.chunks.append(Chunk(text=chunk['text'], meta={
+                    "score": chunk['score'],
+                    "display_name": chunk['document_name'] or '',
+                    "page_number": '',
+                    "document_id": chunk['document_id'],
+                    "collection_id": chunk['collection_id']
+                }))
+        logger.debug(f"Retrieved the chunks of {len(qas)} question(s) from Albert")
+
+class AlbertLLM_GuillaumeTellLLM(_AlbertBase, LLM):
+    """Albert API LLM implementation"""
+    name: str = ALBERT_MODEL
+    prompter: Prompter = Field(..., description="Prompter instance")
+    albert_model: ClassVar[str] = ALBERT_MODEL
+    max_tokens: int = DEFAULT_MAX_TOKENS
+    temperature: float = DEFAULT_TEMPERATURE
+    api_key: str = Field(default_factory=lambda: os.getenv('ALBERT_API_KEY'))
+    _num_retries: int = 3
+    
+    def __init__(self, **data):
+        """Initialize the Albert LLM client."""
+        super().__init__(**data)
+        if not self.api_key:
+            raise ValueError("ALBERT_API_KEY environment variable is not set")
+
+class AlbertLLM_Llama3InstructLLM(_AlbertBase, LLM):
     """Albert API LLM implementation"""
     name: str = "AgentPublic/llama3-instruct-8b"
     prompter: Prompter = Field(..., description="Prompter instance")
     albert_model: ClassVar[str] = "AgentPublic/llama3-instruct-8b"
-    built_in_retriever: ClassVar[bool] = True
     max_tokens: int = DEFAULT_MAX_TOKENS
     temperature: float = DEFAULT_TEMPERATURE
     api_key: str = Field(default_factory=lambda: os.getenv('ALBERT_API_KEY'))
@@ -285,140 +390,11 @@ class AlbertLLM_Llama3InstructLLM(LLM):
         if not self.api_key:
             raise ValueError("ALBERT_API_KEY environment variable is not set")
 
-    @property
-    def headers(self):
-        return {
-            'accept': 'application/json',
-            'Authorization': f'Bearer {self.api_key}',
-            'Content-Type': 'application/json'
-        }
-
-    def get_collections(self):
-        """Get available BGE model collections."""
-        response = requests.get(
-            f'{ALBERT_BASE_URL}/v1/collections',
-            headers=self.headers
-        )
-        response.raise_for_status()
-        collections = response.json()['data']
-        return [
-            coll for coll in collections 
-            if coll['model'] == 'BAAI/bge-m3'
-        ]
-
-    def search_chunks(self, prompt: str, collection_ids: list, k: int = 5):
-        """Search for relevant chunks."""
-        payload = {
-            "prompt": prompt,
-            "collections": collection_ids,
-            "k": k,
-            "score_threshold": 0
-        }
-        
-        response = requests.post(
-            f'{ALBERT_BASE_URL}/v1/search',
-            headers=self.headers,
-            json=payload
-        )
-        response.raise_for_status()
-        
-        chunks = []
-        for item in response.json()['data']:
-            chunk_data = {
-                'text': item['chunk']['content'],  # Using 'text' as the key for compatibility
-                'score': item['score'],
-                'collection_id': item['chunk']['metadata'].get('collection_id'),
-                'document_name': item['chunk']['metadata'].get('document_name'),
-                'document_id': item['chunk']['metadata'].get('document_id')
-            }
-            chunks.append(chunk_data)
-        return chunks
-
-    def generate_answer(self, prompt: Prompt, context_chunks: list) -> str:
-        """Generate answer using context chunks."""
-        context = "\n\n".join([
-            f"Chunk (score: {chunk['score']}):\n{chunk['text']}"
-            for chunk in context_chunks
-        ])
-        
-        messages = [
-            {
-                "role": "system",
-                "content": f"{prompt.system}\n\nContext:\n{context}"
-            },
-            {
-                "role": "user",
-                "content": prompt.user
-            }
-        ]
-        
-        payload = {
-            "messages": messages,
-            "model": self.albert_model,
-            "max_tokens": self.max_tokens,
-            "temperature": self.temperature,
-            "stream": False
-        }
-        
-        response = requests.post(
-            f'{ALBERT_BASE_URL}/v1/chat/completions',
-            headers=self.headers,
-            json=payload
-        )
-        response.raise_for_status()
-        return response.json()['choices'][0]['message']['content']
-
-    async def complete(self, prompt: Prompt) -> LLMAnswer:
-        """Complete implementation for LLM base class."""
-        retry: int = 1
-        time_to_wait: float = 3.0
-        start_ts = datetime.now()
-        chunks = []
-
-        while retry < self._num_retries:
-            try:
-                # Get collections and their IDs
-                collections = self.get_collections()
-                collection_ids = [coll['id'] for coll in collections]
-                
-                # Search for relevant chunks
-                chunks = self.search_chunks(
-                    prompt=prompt.user,
-                    collection_ids=collection_ids
-                )
-                
-                # Generate answer
-                result = self.generate_answer(
-                    prompt=prompt,
-                    context_chunks=chunks
-                )
-                break
-            except Exception as e:
-                logger.debug(f"Exception occurred during API call, will retry {retry} of {self._num_retries}\nERROR:\n{e}")
-                await asyncio.sleep(time_to_wait)
-                retry += 1
-                if retry >= self._num_retries:
-                    raise
-
-        duration = (datetime.now() - start_ts).total_seconds()
-        
-        return LLMAnswer(
-            name=self.name,
-            prompt=prompt,
-            text=result,
-            full_name=self.name,
-            timestamp=start_ts,
-            duration=duration,
-            chunks=chunks,
-            cost=None
-        )
-    
-class AlbertLLM_Llama31InstructLLM(LLM):
+class AlbertLLM_Llama31InstructLLM(_AlbertBase, LLM):
     """Albert API LLM implementation"""
     name: str = "AgentPublic/Llama-3.1-8B-Instruct"
     prompter: Prompter = Field(..., description="Prompter instance")
     albert_model: ClassVar[str] = "AgentPublic/Llama-3.1-8B-Instruct"
-    built_in_retriever: ClassVar[bool] = True
     max_tokens: int = DEFAULT_MAX_TOKENS
     temperature: float = DEFAULT_TEMPERATURE
     api_key: str = Field(default_factory=lambda: os.getenv('ALBERT_API_KEY'))
@@ -429,131 +405,3 @@ class AlbertLLM_Llama31InstructLLM(LLM):
         super().__init__(**data)
         if not self.api_key:
             raise ValueError("ALBERT_API_KEY environment variable is not set")
-
-    @property
-    def headers(self):
-        return {
-            'accept': 'application/json',
-            'Authorization': f'Bearer {self.api_key}',
-            'Content-Type': 'application/json'
-        }
-
-    def get_collections(self):
-        """Get available BGE model collections."""
-        response = requests.get(
-            f'{ALBERT_BASE_URL}/v1/collections',
-            headers=self.headers
-        )
-        response.raise_for_status()
-        collections = response.json()['data']
-        return [
-            coll for coll in collections 
-            if coll['model'] == 'BAAI/bge-m3'
-        ]
-
-    def search_chunks(self, prompt: str, collection_ids: list, k: int = 5):
-        """Search for relevant chunks."""
-        payload = {
-            "prompt": prompt,
-            "collections": collection_ids,
-            "k": k,
-            "score_threshold": 0
-        }
-        
-        response = requests.post(
-            f'{ALBERT_BASE_URL}/v1/search',
-            headers=self.headers,
-            json=payload
-        )
-        response.raise_for_status()
-        
-        chunks = []
-        for item in response.json()['data']:
-            chunk_data = {
-                'text': item['chunk']['content'],  # Using 'text' as the key for compatibility
-                'score': item['score'],
-                'collection_id': item['chunk']['metadata'].get('collection_id'),
-                'document_name': item['chunk']['metadata'].get('document_name'),
-                'document_id': item['chunk']['metadata'].get('document_id')
-            }
-            chunks.append(chunk_data)
-        return chunks
-
-    def generate_answer(self, prompt: Prompt, context_chunks: list) -> str:
-        """Generate answer using context chunks."""
-        context = "\n\n".join([
-            f"Chunk (score: {chunk['score']}):\n{chunk['text']}"
-            for chunk in context_chunks
-        ])
-        
-        messages = [
-            {
-                "role": "system",
-                "content": f"{prompt.system}\n\nContext:\n{context}"
-            },
-            {
-                "role": "user",
-                "content": prompt.user
-            }
-        ]
-        
-        payload = {
-            "messages": messages,
-            "model": self.albert_model,
-            "max_tokens": self.max_tokens,
-            "temperature": self.temperature,
-            "stream": False
-        }
-        
-        response = requests.post(
-            f'{ALBERT_BASE_URL}/v1/chat/completions',
-            headers=self.headers,
-            json=payload
-        )
-        response.raise_for_status()
-        return response.json()['choices'][0]['message']['content']
-
-    async def complete(self, prompt: Prompt) -> LLMAnswer:
-        """Complete implementation for LLM base class."""
-        retry: int = 1
-        time_to_wait: float = 3.0
-        start_ts = datetime.now()
-        chunks = []
-
-        while retry < self._num_retries:
-            try:
-                # Get collections and their IDs
-                collections = self.get_collections()
-                collection_ids = [coll['id'] for coll in collections]
-                
-                # Search for relevant chunks
-                chunks = self.search_chunks(
-                    prompt=prompt.user,
-                    collection_ids=collection_ids
-                )
-                
-                # Generate answer
-                result = self.generate_answer(
-                    prompt=prompt,
-                    context_chunks=chunks
-                )
-                break
-            except Exception as e:
-                logger.debug(f"Exception occurred during API call, will retry {retry} of {self._num_retries}\nERROR:\n{e}")
-                await asyncio.sleep(time_to_wait)
-                retry += 1
-                if retry >= self._num_retries:
-                    raise
-
-        duration = (datetime.now() - start_ts).total_seconds()
-        
-        return LLMAnswer(
-            name=self.name,
-            prompt=prompt,
-            text=result,
-            full_name=self.name,
-            timestamp=start_ts,
-            duration=duration,
-            chunks=chunks,
-            cost=None
-        )
\ No newline at end of file
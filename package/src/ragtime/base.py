@@ -4,6 +4,8 @@ import inspect
 from typing import Callable, Dict, Optional
 import requests
 from requests import Response
+import httpx
+from ragtime.http_client import get_async_client, get_session, session_timeout
 
 
 class RagtimeBase(BaseModel):
@@ -65,12 +67,17 @@ REQ_POST = "post"
 REQ_PUT = "put"
 REQ_DELETE = "delete"
 
-_req_type_func: Dict[str, Callable] = {
-    REQ_GET: requests.get,
-    REQ_POST: requests.post,
-    REQ_PUT: requests.put,
-    REQ_DELETE: requests.delete,
-}
+_req_types: tuple[str, ...] = (REQ_GET, REQ_POST, REQ_PUT, REQ_DELETE)
+# headers whose value is replaced in the error messages, since they are logged
+_SECRET_HEADERS: tuple[str, ...] = ("authorization", "proxy-authorization", "api-key", "x-api-key", "cookie")
+
+
+def _redact(kwargs: dict) -> dict:
+    """The keyword arguments of a call with the values of the secret headers masked, for error messages"""
+    headers = kwargs.get("headers")
+    if not headers:
+        return kwargs
+    return {**kwargs, "headers": {k: "***" if str(k).lower() in _SECRET_HEADERS else v for k, v in dict(headers).items()}}
 
 
 ################
@@ -88,13 +95,12 @@ def call_api(a_req_type: str, a_url: str, **kwargs) -> Response:
         Response
     """
     response: Optional[Response] = None
-    err_msg: str = f"Type: {a_req_type} - Route: {a_url} - Args: {kwargs}"
+    err_msg: str = f"Type: {a_req_type} - Route: {a_url} - Args: {_redact(kwargs)}"
 
     try:
-        if kwargs == {}:
-            response = _req_type_func[a_req_type](url=a_url)
-        else:
-            response = _req_type_func[a_req_type](a_url, **kwargs)
+        # pooled session: the connection to the host is reused by the next calls
+        kwargs.setdefault("timeout", session_timeout())
+        response = get_session().request(a_req_type.upper(), a_url, **kwargs)
         if response is not None:
             err_msg += (
                 "\n"
@@ -107,3 +113,33 @@ def call_api(a_req_type: str, a_url: str, **kwargs) -> Response:
         return response
     else:
         raise Exception(f"API called but returned error - {err_msg}")
+
+
+async def acall_api(a_req_type: str, a_url: str, **kwargs) -> httpx.Response:
+    """
+    Awaitable version of `call_api`, with the pooled async client of the running event loop - see http_client.py
+    Args:
+        a_req_type: type of request (GET, POST, PUT, DELETE)
+        a_url
+        **kwargs: keyword arguments of httpx.AsyncClient.request, e.g. headers, params, json
+    Returns:
+        httpx.Response
+    """
+    response: Optional[httpx.Response] = None
+    err_msg: str = f"Type: {a_req_type} - Route: {a_url} - Args: {_redact(kwargs)}"
+
+    try:
+        if a_req_type not in _req_types:
+            raise ValueError(f"Unknown request type {a_req_type}")
+        response = await get_async_client().request(a_req_type.upper(), a_url, **kwargs)
+        err_msg += (
+            "\n"
+            + f"Response status: {response.status_code} - Response reason:{response.reason_phrase} - Response content: {str(response.content)}"
+        )
+    except Exception:
+        s: str = "before" if response is None else "after"
+        raise Exception(f"Exception raised {s} calling - {err_msg}")
+    if response.status_code < 300:
+        return response
+    else:
+        raise Exception(f"API called but returned error - {err_msg}")
@@ -0,0 +1,168 @@
+"""
+Hard limits on what a generation run may spend.
+
+A Budget is given to `TextGenerator.generate` or to a `Pipeline` and shared by every LLM call of the run.
+Before a call is made, it reserves one call and its max number of tokens - its prompt and `max_tokens` - in the
+budget, and its estimated cost when the price of the model is known: the call is refused if the reservation
+would pass a limit, so the calls in flight can never spend more than the budget together. Once the call
+returns, its reservation is replaced by what it actually cost, or released if it failed.
+After a refusal no new LLM call is made and no new QA is started: the run stops with the results obtained so far.
+Answers reused from the cache cost nothing and are not counted.
+"""
+
+import threading
+from contextvars import ContextVar
+from typing import Optional
+
+from ragtime.base import RagtimeException
+from ragtime.config import logger
+from ragtime.expe import LLMAnswer, Prompt
+from ragtime.tokens import estimate_tokens
+
+
+class BudgetExceeded(RagtimeException):
+    """Raised when an LLM call is not made because the budget of the run is spent"""
+
+    pass
+
+
+class Reservation:
+    """What a call in flight has reserved in a Budget, until it is recorded or released"""
+
+    def __init__(self, calls: int = 0, tokens: int = 0, usd: float = 0.0):
+        self.calls: int = calls
+        self.tokens: int = tokens
+        self.usd: float = usd
+
+    def add(self, other: "Reservation"):
+        """Adds what another call reserved, e.g. a hedged request duplicating the call of this reservation"""
+        self.calls += other.calls
+        self.tokens += other.tokens
+        self.usd += other.usd
+
+
+# Reservation of the LLM call being made in the current task, set by `LLM._complete_or_reuse`
+current_reservation: ContextVar[Optional[Reservation]] = ContextVar("ragtime_reservation", default=None)
+
+
+class Budget:
+    """
+    Limits of a run - None or 0 for no limit
+    - max_usd: max cost in USD, from the `cost` of the LLMAnswers
+    - max_tokens: max number of tokens, prompts and completions
+    - max_calls: max number of LLM calls
+    """
+
+    def __init__(self, max_usd: Optional[float] = None, max_tokens: Optional[int] = None,
+                 max_calls: Optional[int] = None):
+        self.max_usd: Optional[float] = max_usd
+        self.max_tokens: Optional[int] = max_tokens
+        self.max_calls: Optional[int] = max_calls
+        self.usd: float = 0.0
+        self.tokens: int = 0
+        self.calls: int = 0
+        self.nb_refused: int = 0  # calls not made since the budget was spent
+        self._reserved: Reservation = Reservation()  # what the calls in flight have reserved
+        self._refused_limit: Optional[str] = None  # limit a reservation would have passed
+        self._lock: threading.Lock = threading.Lock()
+
+    @property
+    def exceeded(self) -> Optional[str]:
+        """Returns the name of the first limit reached, or which a call has been refused for, None if none is"""
+        if self.max_usd and self.usd >= self.max_usd:
+            return "max_usd"
+        if self.max_tokens and self.tokens >= self.max_tokens:
+            return "max_tokens"
+        if self.max_calls and self.calls >= self.max_calls:
+            return "max_calls"
+        return self._refused_limit
+
+    def _passed_limit(self, calls: int, tokens: int, usd: float) -> Optional[str]:
+        """The first limit passed if `calls`, `tokens` and `usd` were added to what is spent and reserved"""
+        if self.max_usd and (self.usd + self._reserved.usd >= self.max_usd
+                             or self.usd + self._reserved.usd + usd > self.max_usd):
+            return "max_usd"
+        if self.max_tokens and self.tokens + self._reserved.tokens + tokens > self.max_tokens:
+            return "max_tokens"
+        if self.max_calls and self.calls + self._reserved.calls + calls > self.max_calls:
+            return "max_calls"
+        return None
+
+    def check(self):
+        """Raises BudgetExceeded if a limit is reached - see `reserve` to make sure a call stays in the budget"""
+        limit: Optional[str] = self.exceeded
+        if limit:
+            with self._lock:
+                self.nb_refused += 1
+            raise BudgetExceeded(f"Budget spent ({limit}) - call not made")
+
+    def reserve(self, tokens: int = 0, usd: float = 0.0) -> Reservation:
+        """
+        Reserves one call, its max number of tokens and its estimated cost - to be called before making the call
+        Raises BudgetExceeded if the reservation would pass a limit
+        The Reservation is given back to `record` once the call returns, or to `release` if it is not made
+        """
+        with self._lock:
+            limit: Optional[str] = self.exceeded or self._passed_limit(1, tokens, usd)
+            if limit:
+                self.nb_refused += 1
+                first_refusal: bool = self._refused_limit is None
+                self._refused_limit = self._refused_limit or limit
+            else:
+                self._reserved.calls += 1
+                self._reserved.tokens += tokens
+                self._reserved.usd += usd
+        if limit:
+            if first_refusal:
+                logger.warning(f"Budget spent ({limit}): {self.summary()} - no new LLM call will be made")
+            raise BudgetExceeded(f"Budget spent ({limit}) - call not made")
+        return Reservation(1, tokens, usd)
+
+    def release(self, reservation: Optional[Reservation]):
+        """Gives back what a call had reserved, e.g. since it failed"""
+        if not reservation:
+            return
+        with self._lock:
+            self._release(reservation)
+
+    def _release(self, reservation: Reservation):
+        self._reserved.calls -= reservation.calls
+        self._reserved.tokens -= reservation.tokens
+        self._reserved.usd -= reservation.usd
+
+    def record(self, llm_answer: Optional[LLMAnswer], prompt: Prompt = None, reservation: Optional[Reservation] = None):
+        """
+        Adds a completed call - its tokens are estimated if the provider did not return them
+        The hedged requests duplicating the call are counted as calls too, see `LiteLLM.hedge`
+        - reservation: what the call had reserved, replaced by what it actually cost - released if the call failed
+        """
+        if llm_answer is None and reservation:
+            self.release(reservation)
+            return
+        tokens: Optional[int] = llm_answer.meta.get("tokens") if llm_answer else None
+        if tokens is None:
+            tokens = (estimate_tokens(prompt.system) + estimate_tokens(prompt.user) if prompt else 0) \
+                     + (estimate_tokens(llm_answer.text) if llm_answer else 0)
+        with self._lock:
+            was_exceeded: Optional[str] = self.exceeded
+            if reservation:
+                self._release(reservation)
+            self.calls += llm_answer.meta.get("calls", 1) if llm_answer else 1
+            self.tokens += tokens
+            self.usd += (llm_answer.cost or 0.0) if llm_answer else 0.0
+            limit: Optional[str] = self.exceeded
+        if limit and not was_exceeded:
+            logger.warning(f"Budget spent ({limit}): {self.summary()} - no new LLM call will be made")
+
+    def summary(self) -> dict:
+        """Returns what has been spent and the limits, e.g. to be stored in an Expe's meta"""
+        return {
+            "usd": round(self.usd, 6),
+            "tokens": self.tokens,
+            "calls": self.calls,
+            "refused_calls": self.nb_refused,
+            "max_usd": self.max_usd,
+            "max_tokens": self.max_tokens,
+            "max_calls": self.max_calls,
+            "exceeded": self.exceeded,
+        }
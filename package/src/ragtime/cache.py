@@ -0,0 +1,135 @@
+"""
+Persistent content-addressed cache, stored in a single SQLite file.
+
+Values are JSON-serialisable objects stored under the hash of the data identifying them (see `hash_key`),
+e.g. the model, its parameters and the prompt for an LLM response. Least recently used entries are
+evicted once the cache exceeds its max number of entries or its max size. A max age can also be given when
+reading a value, e.g. for retrieved chunks which get stale when the documents change.
+SQLite handles concurrent access, so the same file can be shared by several runs and processes.
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from enum import Enum
+from pathlib import Path
+from typing import Any, Optional, Union
+
+from ragtime.config import logger
+
+
+class CacheMode(Enum):
+    read_write = "read_write"  # reuse cached values and store new ones
+    read_only = "read_only"  # reuse cached values but do not store new ones
+    bypass = "bypass"  # ignore the cache
+
+
+def hash_key(data: Any) -> str:
+    """Returns a stable hash of JSON-serialisable data, whatever the order of its keys"""
+    dumped: str = json.dumps(data, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(dumped.encode("utf-8")).hexdigest()
+
+
+class DiskCache:
+    """
+    SQLite key/value cache with LRU eviction
+    - path: the SQLite file, created if it does not exist
+    - max_entries: max number of entries - 0 for no limit
+    - max_bytes: max total size of the stored values in bytes - 0 for no limit
+    """
+
+    _EVICT_EVERY: int = 100  # limits are checked every N writes
+
+    def __init__(self, path: Union[Path, str], max_entries: int = 0, max_bytes: int = 500 * 2**20):
+        self.path: Path = Path(path)
+        self.max_entries: int = max_entries
+        self.max_bytes: int = max_bytes
+        self.hits: int = 0
+        self.misses: int = 0
+        self._nb_writes: int = 0
+        self._lock: threading.Lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn: sqlite3.Connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "size INTEGER NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+
+    def get(self, key: str, max_age: float = 0) -> Optional[Any]:
+        """
+        Returns the value stored under `key`, None if there is none
+        - max_age: in seconds, a value stored longer ago is removed and None is returned - 0 for no limit
+        """
+        now: float = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT value, created FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is not None and max_age and now - row[1] > max_age:
+                self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE entries SET accessed = ? WHERE key = ?", (now, key))
+        self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, key: str, value: Any):
+        """Stores `value` under `key`, replacing the previous value if any"""
+        dumped: str = json.dumps(value, ensure_ascii=False, default=str)
+        now: float = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, dumped, len(dumped.encode("utf-8")), now, now),
+            )
+            self._nb_writes += 1
+            if self._nb_writes % self._EVICT_EVERY == 0:
+                self._evict()
+
+    def delete(self, key: str):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def evict(self):
+        """Removes the least recently used entries until the cache fits its limits"""
+        with self._lock, self._conn:
+            self._evict()
+
+    def _evict(self):
+        nb, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        nb_to_remove: int = max(0, nb - self.max_entries) if self.max_entries else 0
+        if self.max_bytes and size > self.max_bytes:
+            # walk the entries from the least recently used one until enough bytes are freed
+            freed: int = 0
+            for i, (entry_size,) in enumerate(self._conn.execute("SELECT size FROM entries ORDER BY accessed"), start=1):
+                freed += entry_size
+                if size - freed <= self.max_bytes:
+                    nb_to_remove = max(nb_to_remove, i)
+                    break
+        if nb_to_remove:
+            self._conn.execute(
+                "DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY accessed LIMIT ?)", (nb_to_remove,)
+            )
+            logger.debug(f"{nb_to_remove} entries evicted from cache {self.path}")
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM entries")
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    @property
+    def size(self) -> int:
+        """Total size of the stored values in bytes"""
+        with self._lock:
+            return self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    def close(self):
+        self._conn.close()
@@ -7,6 +7,7 @@ from pathlib import Path
 import shutil
 import sys, os
 from importlib import resources
+from contextvars import ContextVar
 
 if os.name == "nt":
     from py_setenv import setenv
@@ -15,6 +16,7 @@ if os.name == "nt":
 ## CONSTANTS
 
 UNKNOWN_LLM: str = "unknown LLM (manual ?)"
+DEFAULT_MAX_IN_FLIGHT: int = 10  # max number of QAs (and LLM calls) processed at the same time by a TextGenerator
 #################################
 
 # # # FOLDERS
@@ -80,7 +82,16 @@ DEFAULT_TEMPERATURE: int = (
 
 # Logging - class to add msg
 class RagtimeLogger(logging.LoggerAdapter):
-    prefix: str = ""
+    # the prefix is stored per asyncio task so that QAs and LLMs processed concurrently do not mix their prefixes
+    _prefix: ContextVar[str] = ContextVar("ragtime_logger_prefix", default="")
+
+    @property
+    def prefix(self) -> str:
+        return self._prefix.get()
+
+    @prefix.setter
+    def prefix(self, value: str):
+        self._prefix.set(value)
 
     def process(self, msg, kwargs):
         return f'{self.prefix + " " if self.prefix else ""}{msg}', kwargs
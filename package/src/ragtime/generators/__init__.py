@@ -4,3 +4,4 @@ from ragtime.generators.eval_generator import *
 from ragtime.generators.fact_generator import *
 from ragtime.generators.question_generator import *
 from ragtime.generators.question_answer_generator import *
+from ragtime.generators.pipeline import *
@@ -4,6 +4,7 @@ from ragtime.llms import LLM
 from ragtime.expe import QA, Answer, Answers, StartFrom
 from ragtime.config import logger
 from typing import Optional
+import asyncio
 
 class AnsGenerator(TextGenerator):
     """
@@ -34,6 +35,18 @@ class AnsGenerator(TextGenerator):
             qa.chunks.empty()
             self.retriever.retrieve(qa=qa)
 
+    async def awrite_chunks(self, qa: QA):
+        """Same as `write_chunks` without blocking the other QAs in flight - the Retriever may group their queries"""
+        if self.retriever:
+            qa.chunks.empty()
+            await self.retriever.submit(qa=qa)
+
+    def is_complete(self, qa: QA, only_llms: list[str] = None) -> bool:
+        """True if every LLM, or every LLM of `only_llms`, has an Answer in the QA"""
+        names: set[str] = {a.llm_answer.name for a in qa.answers if a and a.text and a.llm_answer} \
+            | {a.llm_answer.full_name for a in qa.answers if a and a.text and a.llm_answer}
+        return all(llm.name in names for llm in self.llms if not only_llms or llm.name in only_llms)
+
     async def gen_for_qa(
         self,
         qa: QA,
@@ -63,16 +76,15 @@ class AnsGenerator(TextGenerator):
                 qa.chunks and start_from <= StartFrom.chunks and not b_missing_only
             ):
                 logger.info(f"Compute chunks")
-                self.write_chunks(qa=qa)
+                await self.awrite_chunks(qa=qa)
             else:  # otherwise reuse the chunks already in the QA object
                 logger.info(f"Reuse existing chunks")
 
-        # Generation loop, for each LLM -> fills the Answers in the QA
+        # Generation for each LLM -> fills the Answers in the QA
         # Get list of LLMs sto actually use, if only_llms defined
-        new_answers: Answer = Answers()
         actual_llms: list[LLM] = ([l for l in self.llms if l in only_llms] if only_llms else self.llms)
 
-        for llm in actual_llms:
+        async def _gen_for_llm(llm: LLM) -> Optional[Answer]:
             # Get existing Answer if any
             prev_ans: Optional[Answer] = [a for a in qa.answers
                                           if a and a.llm_answer and (a.llm_answer.name == llm.name or a.llm_answer.full_name == llm.name)]
@@ -94,11 +106,18 @@ class AnsGenerator(TextGenerator):
             )
 
             # get previous human eval if any
-            if prev_ans and prev_ans.eval:
+            if ans and prev_ans and prev_ans.eval:
                 ans.eval.human = prev_ans.eval.human
+            if ans and ans.text:
+                self._checkpoint("answer", llm.name, ans)
+            return ans
 
-            # Prevent addition of None object
-            if ans and ans.text: new_answers.append(ans)
+        # The LLMs are called concurrently (within the limits of the current Scheduler if any), so a QA takes
+        # as long as the slowest LLM instead of the sum of all of them - gather keeps the order of actual_llms
+        answers: list[Optional[Answer]] = await asyncio.gather(*(_gen_for_llm(llm) for llm in actual_llms))
 
-        # end of the per LLM loop, answers have been generated or retrieved, write them in qa
+        # answers have been generated or retrieved, write them in qa - prevent addition of None object
+        new_answers: Answers = Answers()
+        for ans in answers:
+            if ans and ans.text: new_answers.append(ans)
         qa.answers = new_answers
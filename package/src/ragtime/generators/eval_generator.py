@@ -3,6 +3,18 @@ from ragtime.llms import LLM
 from ragtime.expe import StartFrom, QA, Eval, Facts, Answer
 from ragtime.base import RagtimeException
 from ragtime.config import logger, UNKNOWN_LLM
+import asyncio
+
+
+def _answers_evaluated(qa: QA, only_llms: list[str] = None) -> bool:
+    """True if every Answer of the QA, or of the LLMs in `only_llms`, has an Eval generated by an LLM"""
+    if len(qa.answers) == 0 or len(qa.facts) == 0:
+        return False
+    answers: list[Answer] = [a for a in qa.answers if a and a.text]
+    if only_llms:
+        answers = [a for a in answers
+                   if (a.llm_answer.name if a.llm_answer else UNKNOWN_LLM) in only_llms + [UNKNOWN_LLM]]
+    return all(a.eval and a.eval.llm_answer for a in answers)
 
 
 class EvalGenerator(TextGenerator):
@@ -14,6 +26,9 @@ class EvalGenerator(TextGenerator):
     The conversion between the LLM answer and the Eval is made in post_process
     """
 
+    def is_complete(self, qa: QA, only_llms: list[str] = None) -> bool:
+        return _answers_evaluated(qa, only_llms)
+
     async def gen_for_qa(
         self,
         qa: QA,
@@ -32,11 +47,8 @@ class EvalGenerator(TextGenerator):
             logger.error(f"No Facts, cannot generate Evals")
             return
 
-        # Eval loop
-        for ans in (a for a in qa.answers if a and a.text):
+        async def _eval_answer(ans: Answer):
             llm_name: str = ans.llm_answer.name if ans.llm_answer else UNKNOWN_LLM
-            if only_llms and llm_name not in only_llms and llm_name != UNKNOWN_LLM:
-                continue
             logger.debug(f'Generate Eval for answer generated with "{llm_name}"')
             prev_eval: Eval = ans.eval
 
@@ -52,8 +64,16 @@ class EvalGenerator(TextGenerator):
             )
 
             # save previous human eval if any
-            if prev_eval and prev_eval.human:
+            if ans.eval and prev_eval and prev_eval.human:
                 ans.eval.human = prev_eval.human
+            self._checkpoint("eval", llm_name, ans.eval)
+
+        # Eval of the Answers, run concurrently (within the limits of the current Scheduler if any)
+        answers: list[Answer] = [a for a in qa.answers if a and a.text]
+        if only_llms:
+            answers = [a for a in answers
+                       if (a.llm_answer.name if a.llm_answer else UNKNOWN_LLM) in only_llms + [UNKNOWN_LLM]]
+        await asyncio.gather(*(_eval_answer(ans) for ans in answers))
 
 
 class TwoFactsEvalGenerator(TextGenerator):
@@ -71,6 +91,9 @@ class TwoFactsEvalGenerator(TextGenerator):
                                    2nd LLM is used to generate Eval from the golden Facts and the Facts from the Answer."""
             )
 
+    def is_complete(self, qa: QA, only_llms: list[str] = None) -> bool:
+        return _answers_evaluated(qa, only_llms)
+
     async def gen_for_qa(
         self,
         qa: QA,
@@ -88,8 +111,7 @@ class TwoFactsEvalGenerator(TextGenerator):
             logger.error(f"No Facts, cannot generate Evals")
             return
 
-        # Eval loop
-        for ans in (a for a in qa.answers if a.text):
+        async def _eval_answer(ans: Answer):
             llm_name: str = (ans.llm_answer.name if ans.llm_answer else "unkown LLM (manual ?)")
             logger.debug(f'Generate Facts for answer generated with "{llm_name}"')
             prev_eval: Eval = ans.eval
@@ -120,8 +142,12 @@ class TwoFactsEvalGenerator(TextGenerator):
             )
 
             # save previous human eval if any
-            if prev_eval and prev_eval.human:
+            if ans.eval and prev_eval and prev_eval.human:
                 ans.eval.human = prev_eval.human
+            self._checkpoint("eval", llm_name, ans.eval)
+
+        # Eval of the Answers, run concurrently (within the limits of the current Scheduler if any)
+        await asyncio.gather(*(_eval_answer(ans) for ans in qa.answers if ans.text))
 
 
 class EvalGeneratorChunks(TextGenerator):
@@ -185,6 +211,7 @@ class EvalGeneratorChunks(TextGenerator):
             if prev_eval and prev_eval.human:
                 ans.eval.human = prev_eval.human
             qa.answers.append(ans)
+            self._checkpoint("answer", ans.llm_answer["name"], ans)
         if len(facts_missing) != 0:
             ans = Answer()
             logger.debug(f'Generate Eval for the missing facts for the question "{qa.question.text}"')
@@ -206,4 +233,5 @@ class EvalGeneratorChunks(TextGenerator):
             if prev_eval and prev_eval.human:
                 ans.eval.human = prev_eval.human
             qa.answers.append(ans)
+            self._checkpoint("answer", ans.llm_answer["name"], ans)
 
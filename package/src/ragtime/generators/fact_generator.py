@@ -7,6 +7,10 @@ class FactGenerator(TextGenerator):
     Generate Facts from existing Answers
     """
 
+    def is_complete(self, qa: QA, only_llms: list[str] = None) -> bool:
+        """True if the QA has Facts, or has no validated Answer to make them from"""
+        return len(qa.facts) > 0 or not any(a.eval and a.eval.human == 1.0 for a in qa.answers)
+
     async def gen_for_qa(
         self,
         qa: QA,
@@ -43,4 +47,6 @@ class FactGenerator(TextGenerator):
         )
         
         # Prevent addition of None
-        if f: qa.facts = f
+        if f:
+            qa.facts = f
+            self._checkpoint("facts", self.llm.name, f)
@@ -0,0 +1,203 @@
+"""
+Streaming execution of several generators on the same Expe, e.g. answers -> evals -> chunk evals.
+
+Calling `generate` on each generator one after the other makes every stage wait for the slowest QA of
+the previous one. A Pipeline instead links the stages with queues: a QA moves to the next stage as soon
+as the current one is done with it, so the end-to-end duration is about one long tail instead of the
+sum of one long tail per stage. Each stage has its own pool of workers, i.e. its own concurrency.
+All the stages share one Scheduler, hence the same limits on LLM calls in flight, pacing and cache.
+"""
+
+import asyncio
+import time
+from pathlib import Path
+from typing import Callable, Optional, Union
+
+from ragtime.base import shorten_text
+from ragtime.budget import Budget
+from ragtime.cache import CacheMode, DiskCache
+from ragtime.config import logger, DEFAULT_MAX_IN_FLIGHT
+from ragtime.expe import Expe, QA, StartFrom
+from ragtime.generators.text_generator import TextGenerator
+from ragtime.journal import Journal
+from ragtime.scheduler import Scheduler, SchedulerStats, current_item
+
+
+class Stage:
+    """
+    One step of a Pipeline
+    - generator: the TextGenerator whose `gen_for_qa` is called for each QA
+    - max_in_flight: max number of QAs processed by this stage at the same time - 0 for no limit
+    - name: used in the logs and stats - defaults to the generator's class name
+    - prepare: optional function called on each QA before the generator, e.g. to initialise its meta
+    - start_from, b_missing_only, only_llms: passed to `gen_for_qa`, see `TextGenerator.generate`
+    """
+
+    def __init__(
+        self,
+        generator: TextGenerator,
+        max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+        name: str = None,
+        prepare: Callable[[QA], None] = None,
+        start_from: StartFrom = StartFrom.beginning,
+        b_missing_only: bool = False,
+        only_llms: list[str] = None,
+    ):
+        self.generator: TextGenerator = generator
+        self.max_in_flight: int = max_in_flight
+        self.name: str = name or generator.__class__.__name__
+        self.prepare: Optional[Callable[[QA], None]] = prepare
+        self.start_from: StartFrom = start_from
+        self.b_missing_only: bool = b_missing_only
+        self.only_llms: Optional[list[str]] = only_llms
+        self.stats: SchedulerStats = SchedulerStats()
+        self._in_flight: int = 0
+
+    def nb_workers(self, nb_items: int) -> int:
+        return min(self.max_in_flight, nb_items) if self.max_in_flight else nb_items
+
+
+class Pipeline:
+    """
+    Runs a list of Stages on an Expe, each QA going through the stages in order
+    - stages: the Stages, in execution order
+    - max_in_flight: max number of LLM calls in flight across all the stages - 0 for no limit
+    - max_in_flight_per_llm, min_interval, cache, cache_mode: see `Scheduler`
+    - budget: see `TextGenerator.generate` - once it is spent, QAs are no longer started in any stage and `run` saves
+    the partial Expe
+    """
+
+    def __init__(
+        self,
+        stages: list[Stage],
+        max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+        max_in_flight_per_llm: Union[int, dict[str, int]] = 0,
+        min_interval: Union[float, dict[str, float]] = 0.0,
+        cache: Union[DiskCache, Path, str] = None,
+        cache_mode: CacheMode = CacheMode.read_write,
+        budget: Budget = None,
+    ):
+        if isinstance(cache, (str, Path)):
+            cache = DiskCache(cache)
+        self.stages: list[Stage] = stages
+        self.scheduler: Scheduler = Scheduler(max_in_flight=max_in_flight, max_in_flight_per_llm=max_in_flight_per_llm,
+                                              min_interval=min_interval, cache=cache, cache_mode=cache_mode,
+                                              budget=budget)
+
+    @property
+    def stats(self) -> SchedulerStats:
+        """Counters of the whole run - LLM calls and latencies of all the stages, end-to-end duration"""
+        return self.scheduler.stats
+
+    async def arun(self, expe: Expe, done: dict[str, set[int]] = None) -> SchedulerStats:
+        """
+        Runs the stages - when resuming, `done` gives the indexes of the QAs already done for each stage, which skip it,
+        and only the missing results of the other QAs are generated
+        """
+        b_resume: bool = done is not None
+        done = done or {}
+        journal: Optional[Journal] = self.scheduler.journal
+        nb_q: int = len(expe)
+        queues: list[asyncio.Queue] = [asyncio.Queue() for _ in self.stages]
+        for num, qa in enumerate(expe, start=1):
+            queues[0].put_nowait((num, qa))
+        if self.stages:
+            for _ in range(self.stages[0].nb_workers(nb_q)):
+                queues[0].put_nowait(None)
+        for stage in self.stages:
+            stage.stats = SchedulerStats(nb_items=nb_q)
+        qa_starts: dict[int, float] = {}  # when each QA entered the first stage
+        failed: set[int] = set()  # QAs which failed in at least one stage
+
+        async def _worker(i: int):
+            stage: Stage = self.stages[i]
+            while True:
+                item = await queues[i].get()
+                if item is None:  # the previous stage is over and the queue is empty
+                    return
+                num, qa = item
+                current_item.set(num)
+                logger.prefix = f"[{stage.name}][{num}/{nb_q}]"
+                logger.info(f'*** Question "{shorten_text(qa.question.text)}"')
+                qa_starts.setdefault(num, time.perf_counter())
+                stage._in_flight += 1
+                stage.stats.peak_in_flight = max(stage.stats.peak_in_flight, stage._in_flight)
+                start: float = time.perf_counter()
+                generator_name: str = stage.generator.__class__.__name__
+                try:
+                    if self.scheduler.budget_spent():
+                        stage.stats.nb_skipped += 1
+                    else:
+                        if num - 1 not in done.get(generator_name, ()):
+                            if stage.prepare:
+                                stage.prepare(qa)
+                            await stage.generator.gen_for_qa(qa=qa, start_from=stage.start_from,
+                                                             only_llms=stage.only_llms,
+                                                             b_missing_only=stage.b_missing_only or b_resume)
+                            # a QA whose calls have failed or been refused is not done
+                            if journal and not self.scheduler.budget_spent() \
+                                    and stage.generator.is_complete(qa, only_llms=stage.only_llms):
+                                journal.mark_done(num - 1, generator_name)
+                        stage.stats.nb_done += 1
+                except Exception as e:
+                    # as with successive calls to generate, a QA failing in a stage still goes through the next ones
+                    stage.stats.nb_failed += 1
+                    failed.add(num)
+                    logger.exception(f"Exception caught - {e}")
+                finally:
+                    stage.stats.item_latencies.append(time.perf_counter() - start)
+                    stage._in_flight -= 1
+                if i + 1 < len(self.stages):
+                    queues[i + 1].put_nowait(item)
+                else:
+                    self.stats.item_latencies.append(time.perf_counter() - qa_starts[num])
+
+        async def _run_stage(i: int):
+            stage: Stage = self.stages[i]
+            start: float = time.perf_counter()
+            await asyncio.gather(*(_worker(i) for _ in range(stage.nb_workers(nb_q))))
+            stage.stats.duration = time.perf_counter() - start
+            stage.generator.stats = stage.stats
+            logger.info(f'Stage "{stage.name}" done: {stage.stats.summary()}')
+            if i + 1 < len(self.stages):
+                for _ in range(self.stages[i + 1].nb_workers(nb_q)):
+                    queues[i + 1].put_nowait(None)
+
+        with self.scheduler.running(nb_q) as stats:
+            await asyncio.gather(*(_run_stage(i) for i in range(len(self.stages))))
+            stats.nb_failed = len(failed)
+            stats.nb_skipped = self.stages[0].stats.nb_skipped if self.stages else 0
+            stats.nb_done = nb_q - stats.nb_failed - stats.nb_skipped if self.stages else 0
+        return stats
+
+    def run(self, expe: Expe, journal: Union[Journal, Path, str, bool] = None, resume: bool = False) -> SchedulerStats:
+        """
+        Runs the stages on every QA of the Expe and returns the counters of the whole run
+        - journal, resume: see `TextGenerator.generate` - a QA resumes from the first stage it has not been done by
+        """
+        original_logger_prefix: str = logger.prefix
+        names: str = " -> ".join(s.name for s in self.stages)
+        logger.info(f"{len(expe)} QAs to process through {names}")
+        if resume and not journal:
+            journal = True
+        if journal is True or isinstance(journal, (str, Path)):
+            journal = Journal.for_expe(expe, None if journal is True else journal)
+        done: Optional[dict[str, set[int]]] = journal.replay(expe) if journal and resume else None
+        self.scheduler.journal = journal or None
+        loop = asyncio.get_event_loop()
+        if journal:
+            with journal:
+                stats: SchedulerStats = loop.run_until_complete(self.arun(expe, done))
+        else:
+            stats: SchedulerStats = loop.run_until_complete(self.arun(expe, done))
+        logger.prefix = original_logger_prefix
+        logger.info(f"Pipeline stats: {stats.summary()}")
+        if self.scheduler.budget:
+            expe.meta["budget"] = self.scheduler.budget.summary()
+            if self.scheduler.budget.exceeded:
+                logger.warning(f"Pipeline stopped as the budget is spent - {stats.nb_skipped} QAs not started, "
+                               f"saving what has been done so far")
+                json_path: Optional[Path] = expe.json_path
+                expe.save_temp(name="Budget_spent_Pipeline_")
+                expe.json_path = json_path  # so that resume=True finds the journal
+        return stats
@@ -1,7 +1,6 @@
 from importlib.metadata import metadata
 from pathlib import Path
 from typing import Any
-import random
 from ragtime.config import logger
 from ragtime.generators.text_generator import *
 from ragtime.retrievers.indexer import Indexer
@@ -32,8 +31,7 @@ class QuestAnsGenerator(TextGenerator):
 
         documents, index = self.indexer.create_or_load_nodes(
             create_index=False)
-        random.shuffle(documents)
-        documents = documents[:min(self.nb_quest, len(documents))]
+        documents = documents.sample(self.nb_quest)  # only the sampled nodes are read from the NodeStore
         for doc in documents:
             # Create a new QA object for each question
             qa: QA = QA()
@@ -50,6 +48,7 @@ class QuestAnsGenerator(TextGenerator):
         b_missing_only: bool = False,
         only_llms: list[str] = None,
         start_from: StartFrom = StartFrom.beginning,
+        **kwargs,
     ):
         while len(expe.items) > 0:
             expe.items.pop()
@@ -62,6 +61,7 @@ class QuestAnsGenerator(TextGenerator):
             b_missing_only=b_missing_only,
             only_llms=only_llms,
             start_from=start_from,
+            **kwargs,
         )
 
     async def gen_for_qa(
@@ -90,3 +90,5 @@ class QuestAnsGenerator(TextGenerator):
                         text=qa.question.meta["answer"])
         qa.question = question
         qa.answers.items.append(answer)
+        self._checkpoint("question", self.llm.name, qa.question)
+        self._checkpoint("answer", self.llm.name, answer)
@@ -1,6 +1,5 @@
 from pathlib import Path
 from typing import Any
-import random
 from ragtime.config import logger
 from ragtime.generators.text_generator import *
 from ragtime.retrievers.indexer import Indexer
@@ -31,8 +30,7 @@ class QuestionGenerator(TextGenerator):
 
         documents, index = self.indexer.create_or_load_nodes(
             create_index=False)
-        random.shuffle(documents)
-        documents = documents[:min(self.nb_quest, len(documents))]
+        documents = documents.sample(self.nb_quest)  # only the sampled nodes are read from the NodeStore
         for doc in documents:
             # Create a new QA object for each question
             qa: QA = QA()
@@ -82,3 +80,4 @@ class QuestionGenerator(TextGenerator):
             chunk=qa.question.meta['chunk'],
         )
         qa.question.meta = prev_question.meta
+        self._checkpoint("question", self.llm.name, qa.question)
@@ -7,12 +7,18 @@ from ragtime.expe import StartFrom, QA
 from ragtime.llms import LLM, LiteLLM
 from ragtime.prompters.prompter import Prompter
 from ragtime.base import RagtimeException
-from ragtime.config import logger
+from ragtime.config import logger, DEFAULT_MAX_IN_FLIGHT
 from ragtime.expe import Expe
+from ragtime.scheduler import Scheduler, SchedulerStats, current_scheduler, current_item
+from ragtime.journal import Journal
+from ragtime.cache import CacheMode, DiskCache
+from ragtime.llms.batch import BatchClient, BatchRun
+from ragtime.budget import Budget
 
-import time
-from typing import Optional
+from pathlib import Path
+from typing import Optional, Union
 import asyncio
+import copy
 
 
 class TextGenerator(RagtimeBase, ABC):
@@ -22,12 +28,16 @@ class TextGenerator(RagtimeBase, ABC):
 
     llms: Optional[list[LLM]] = []
     # b_use_chunks: bool = False
-    wait_between_calls:int = 0.4
+    # min time in seconds between the start of two calls to the same LLM - a single value or a dict {llm name: value}
+    wait_between_calls: Union[float, dict[str, float]] = 0.4
+    stats: Optional[SchedulerStats] = None  # throughput and latency counters of the last call to generate
 
-    def __init__(self, llms: list = None, prompter:Prompter = None, wait_between_calls:int = 0):
+    def __init__(self, llms: list = None, prompter:Prompter = None, wait_between_calls: Union[float, dict[str, float]] = 0):
         """
         Args
             llms(LLM or list[LLM]) : list of LLM objects
+            wait_between_calls: min time in seconds between the start of two calls to the same LLM, i.e.
+            1 / max number of requests per second - a single value or a dict {llm name: value}
         """
         super().__init__()
         if not llms:
@@ -63,6 +73,14 @@ class TextGenerator(RagtimeBase, ABC):
         b_missing_only: bool = False,
         only_llms: list[str] = None,
         start_from: StartFrom = StartFrom.beginning,
+        max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+        max_in_flight_per_llm: Union[int, dict[str, int]] = 0,
+        cache: Union[DiskCache, Path, str] = None,
+        cache_mode: CacheMode = CacheMode.read_write,
+        batch: BatchClient = None,
+        journal: Union[Journal, Path, str, bool] = None,
+        resume: bool = False,
+        budget: Budget = None,
     ):
         """
         Main method calling "gen_for_qa" for each QA in an Expe. Returns False if completed with error, True otherwise
@@ -84,18 +102,50 @@ class TextGenerator(RagtimeBase, ABC):
             - only_llms: restrict the llms to be computed again - used in conjunction with start_from -
             if start from beginning, chunks or prompts, compute prompts and llm answers for the list only -
             if start from llm, recompute llm answers for these llm only - has not effect if start
+            - max_in_flight: max number of QAs processed, and of LLM calls made, at the same time - 0 for no limit
+            QAs are fed to the workers as slots free up, so large Expes do not open one connection per QA
+            - max_in_flight_per_llm: max number of calls in flight for each LLM - either a single int or a dict
+            {llm name: limit} - 0 for no limit
+            - cache: a DiskCache, or the path of its file, where LLM answers are looked up before calling the LLMs
+            Answers are keyed by the LLM's name and parameters and the prompt, so re-running an Expe with the same
+            prompts, e.g. to change a prompter's post_process, does not call the LLMs again
+            - cache_mode: read_write to reuse and store answers, read_only to reuse only, bypass to ignore the cache
+            - batch: a BatchClient to send the LLM calls through the provider's batch API instead of one by one -
+            slower but cheaper, for large offline runs (see batch.py)
+            - journal: a Journal, or the path of its file, where each result is appended as soon as it is generated -
+            True for a journal next to the Expe's JSON file (see journal.py)
+            - resume: True to replay the journal (next to the Expe's JSON file if none is given) into the Expe first -
+            QAs already done are skipped and only the missing results of the others are generated
+            - budget: a Budget capping the cost, tokens and number of LLM calls of the run - once it is spent no new
+            call is made, the run stops and the partial Expe is saved - QAs left incomplete are not marked as done in
+            the journal, so that `resume=True` completes them. What has been spent is stored in `expe.meta["budget"]`
+        Calls to each LLM are spaced out by `self.wait_between_calls` without blocking the other calls in flight
+        Throughput and latency counters of the run are available afterwards in `self.stats`
         """
 
         nb_q: int = len(expe)
 
+        stage: str = self.__class__.__name__
+        if resume and not journal:
+            journal = True
+        if journal is True or isinstance(journal, (str, Path)):
+            journal = Journal.for_expe(expe, None if journal is True else journal)
+        done: set[int] = set()
+        if journal and resume:
+            done = journal.replay(expe).get(stage, set())
+            logger.info(f"Resume from journal {journal.path} - {len(done)} QAs already done")
+
         async def _generate_for_qa(num_q: int, qa: QA):
+            if num_q - 1 in done:
+                return
             logger.prefix = f"[{self.__class__.__name__}][{num_q}/{nb_q}]"
             logger.info(f'*** Question "{shorten_text(qa.question.text)}"')
             try:
                 await self.gen_for_qa(
                     qa=qa,
                     start_from=start_from,
-                    b_missing_only=b_missing_only,
+                    # when resuming, the results replayed from the journal are kept
+                    b_missing_only=b_missing_only or resume,
                     only_llms=only_llms,
                 )
             except Exception as e:
@@ -104,8 +154,13 @@ class TextGenerator(RagtimeBase, ABC):
                 if save_on_error:
                     expe.save_to_json(b_overwrite=True)
                     expe.save_temp(name=f"Stopped_at_{num_q}_of_{nb_q}_")
-                return
-            time.sleep(self.wait_between_calls)
+                raise
+            if journal and not (budget and budget.exceeded):
+                # a QA whose LLM calls failed or were refused is not done, so that `resume=True` completes it
+                if self.is_complete(qa, only_llms=only_llms):
+                    journal.mark_done(num_q - 1, stage)
+                else:
+                    logger.warning("Results missing - not marked as done in the journal")
             logger.info(f'End question "{shorten_text(qa.question.text)}"')
 
             if save_every and (num_q % save_every == 0):
@@ -113,10 +168,70 @@ class TextGenerator(RagtimeBase, ABC):
 
         original_logger_prefix:str = logger.prefix
         loop = asyncio.get_event_loop()
-        tasks = [_generate_for_qa(num_q, qa) for num_q, qa in enumerate(expe, start=1)]
-        logger.info(f"{len(tasks)} tasks created")
-        loop.run_until_complete(asyncio.gather(*tasks))
+        if isinstance(cache, (str, Path)):
+            cache = DiskCache(cache)
+        batch_run: Optional[BatchRun] = None
+        if batch:
+            batch_run = BatchRun(batch)
+            self._run_batches(expe, batch_run, cache=cache, cache_mode=cache_mode, start_from=start_from,
+                              b_missing_only=b_missing_only, only_llms=only_llms)
+        scheduler: Scheduler = Scheduler(max_in_flight=max_in_flight, max_in_flight_per_llm=max_in_flight_per_llm,
+                                         min_interval=self.wait_between_calls, cache=cache, cache_mode=cache_mode,
+                                         batch=batch_run, journal=journal or None, budget=budget)
+        logger.info(f"{nb_q} QAs to process with at most {max_in_flight or nb_q} in flight")
+        if journal:
+            with journal:
+                self.stats = loop.run_until_complete(scheduler.run(expe, _generate_for_qa))
+        else:
+            self.stats = loop.run_until_complete(scheduler.run(expe, _generate_for_qa))
         logger.prefix = original_logger_prefix
+        logger.info(f"Generation stats: {self.stats.summary()}")
+        if budget:
+            expe.meta["budget"] = budget.summary()
+            if budget.exceeded:
+                logger.warning(f"Generation stopped as the budget is spent - {self.stats.nb_skipped} QAs not started, "
+                               f"saving what has been done so far")
+                json_path: Optional[Path] = expe.json_path
+                expe.save_temp(name=f"Budget_spent_{stage}_")
+                expe.json_path = json_path  # so that resume=True finds the journal
+
+    def _run_batches(self, expe: Expe, batch_run: BatchRun, cache: Optional[DiskCache], cache_mode: CacheMode, **kwargs):
+        """
+        Runs the generation on a copy of the Expe to collect the LLM requests, sends them in a batch and stores
+        the responses in `batch_run` - repeated while new requests show up, e.g. when some prompts need the answers
+        of other ones, up to the client's max_rounds
+        """
+        loop = asyncio.get_event_loop()
+
+        async def _collect_for_qa(num_q: int, qa: QA):
+            await self.gen_for_qa(qa=qa, **kwargs)
+
+        for num_round in range(1, batch_run.client.max_rounds + 1):
+            # answers already in the cache are not requested again
+            scheduler: Scheduler = Scheduler(max_in_flight=0, cache=cache, batch=batch_run,
+                                             cache_mode=CacheMode.read_only if cache_mode != CacheMode.bypass else cache_mode)
+            batch_run.collecting = True
+            loop.run_until_complete(scheduler.run(copy.deepcopy(expe), _collect_for_qa))
+            batch_run.collecting = False
+            if not batch_run.pending:
+                break
+            logger.info(f"Batch round {num_round}: {len(batch_run.pending)} requests to send")
+            nb_responses: int = batch_run.flush()
+            logger.info(f"Batch round {num_round}: {nb_responses} responses received")
+
+    def _checkpoint(self, kind: str, llm_name: str, obj: RagtimeBase):
+        """Appends a result of the current QA to the journal of the run, if any - see journal.py"""
+        scheduler: Optional[Scheduler] = current_scheduler()
+        num_q: Optional[int] = current_item.get()
+        if obj is not None and scheduler and scheduler.journal and num_q:
+            scheduler.journal.record(num_q - 1, self.__class__.__name__, kind, llm_name, obj)
+
+    def is_complete(self, qa: QA, only_llms: list[str] = None) -> bool:
+        """
+        True if the QA holds every result this generator is expected to write in it - the journal of a run only
+        marks complete QAs as done. Override it in generators whose LLM calls can fail
+        """
+        return True
 
     def write_chunks(self, qa: QA):
         """Write chunks in the current qa if a Retriever has been given when creating the object. Ignore otherwise"""
@@ -0,0 +1,109 @@
+"""
+Pooled HTTP clients for the LLMs and retrievers calling HTTP APIs themselves, e.g. the custom classes of a project.
+
+Connections are kept alive and reused between calls, so a run only pays the TCP / TLS handshake once per host
+instead of once per call. HTTP/2 is used when the optional `h2` package is installed (`pip install httpx[http2]`).
+- `get_async_client()` returns the httpx.AsyncClient of the running event loop - use it, or `ragtime.base.acall_api`,
+in `async` methods such as `LLM.complete`, so that waiting for the response does not block the other calls
+- `get_session()` returns the requests.Session of the current thread, for synchronous code such as `Retriever.retrieve`
+Pool limits and timeouts are set with `configure_http_client`.
+"""
+
+import asyncio
+import importlib.util
+import threading
+import weakref
+from typing import Any, Optional
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+from ragtime.config import logger
+
+_settings: dict[str, Any] = {
+    "max_connections": 100,  # connections open at the same time, to all hosts
+    "max_keepalive_connections": 20,  # idle connections kept open for reuse
+    "keepalive_expiry": 30.0,  # seconds an idle connection is kept open
+    "timeout": 60.0,  # seconds to wait for a response
+    "connect_timeout": 10.0,  # seconds to wait for a connection
+    "sync_timeout": None,  # seconds to wait for a response to a call made with `get_session`, None for no limit
+    "http2": True,  # only if h2 is installed
+}
+# {event loop: (its client, generation of the settings it has been created with)}
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, tuple]" = weakref.WeakKeyDictionary()
+_local: threading.local = threading.local()
+_generation: int = 0  # incremented by configure_http_client so that the clients are rebuilt with the new settings
+_lock: threading.Lock = threading.Lock()
+
+
+def http2_available() -> bool:
+    return importlib.util.find_spec("h2") is not None
+
+
+def configure_http_client(**settings):
+    """
+    Sets the pool limits and timeouts - see `_settings` for the keys
+    Applies to the clients created afterwards: the current ones are replaced at their next use
+    """
+    global _generation
+    unknown: set[str] = set(settings) - set(_settings)
+    if unknown:
+        raise ValueError(f"Unknown HTTP client settings: {sorted(unknown)}")
+    with _lock:
+        _settings.update(settings)
+        _generation += 1
+
+
+def _timeout() -> httpx.Timeout:
+    return httpx.Timeout(_settings["timeout"], connect=_settings["connect_timeout"])
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """
+    Returns the pooled AsyncClient of the running event loop, created at first use
+    A client is bound to the loop it has been created in, hence one client per loop
+    """
+    loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+    client, generation = _async_clients.get(loop, (None, None))
+    if client is None or client.is_closed or generation != _generation:
+        if client is not None and not client.is_closed:
+            loop.create_task(client.aclose())
+        limits: httpx.Limits = httpx.Limits(max_connections=_settings["max_connections"],
+                                            max_keepalive_connections=_settings["max_keepalive_connections"],
+                                            keepalive_expiry=_settings["keepalive_expiry"])
+        http2: bool = _settings["http2"] and http2_available()
+        client = httpx.AsyncClient(limits=limits, timeout=_timeout(), http2=http2)
+        _async_clients[loop] = (client, _generation)
+        logger.debug(f"New pooled HTTP client - HTTP/2 {'on' if http2 else 'off'}")
+    return client
+
+
+async def aclose_async_client():
+    """Closes the client of the running event loop, e.g. before closing the loop"""
+    client, _ = _async_clients.pop(asyncio.get_running_loop(), (None, None))
+    if client is not None:
+        await client.aclose()
+
+
+def get_session() -> requests.Session:
+    """Returns the pooled requests.Session of the current thread, created at first use"""
+    session: requests.Session = getattr(_local, "session", None)
+    if session is None or getattr(_local, "generation", None) != _generation:
+        if session is not None:
+            session.close()
+        session = requests.Session()
+        adapter: HTTPAdapter = HTTPAdapter(pool_connections=_settings["max_keepalive_connections"],
+                                           pool_maxsize=_settings["max_connections"])
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        _local.session, _local.generation = session, _generation
+    return session
+
+
+def session_timeout() -> tuple[float, Optional[float]]:
+    """
+    (connect, read) timeouts of the configuration, to be passed to the calls made with `get_session`
+    The read timeout is `sync_timeout`, None by default as synchronous calls had no limit
+    """
+    return _settings["connect_timeout"], _settings["sync_timeout"]
@@ -0,0 +1,130 @@
+"""
+Append-only checkpoint journal of a generation run.
+
+Each Question, Answer, Facts or Eval produced during `generate` is appended as one JSON line to a journal next to
+the Expe, keyed by the index of its QA, the generator (the stage) and the LLM, and a "done" line is
+appended once a QA has been fully processed by a generator. Checkpointing is then O(1) per result instead
+of rewriting the whole Expe, and a run killed at any point loses at most the LLM calls in flight.
+`generate(resume=True)` replays the journal into the Expe and only processes what is not done yet.
+
+Lines are flushed as soon as written, so they survive the process being killed - use fsync=True to also
+survive the machine crashing, at the cost of a disk sync per line.
+"""
+
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Any, Optional, Union
+
+from pydantic import BaseModel
+
+from ragtime.base import RagtimeException
+from ragtime.config import logger, UNKNOWN_LLM
+from ragtime.expe import Answer, Eval, Expe, Facts, QA, Question
+
+JOURNAL_SUFFIX: str = ".journal.jsonl"
+
+
+class Journal:
+    """
+    JSONL journal of the results of a generation run
+    - path: the journal file, created if it does not exist - use `Journal.for_expe` to put it next to an Expe
+    - fsync: True to sync the file to disk after each line
+    """
+
+    def __init__(self, path: Union[Path, str], fsync: bool = False):
+        self.path: Path = Path(path)
+        self.fsync: bool = fsync
+        self._file = None
+        self._lock: threading.Lock = threading.Lock()
+
+    @classmethod
+    def for_expe(cls, expe: Expe, path: Union[Path, str] = None, fsync: bool = False) -> "Journal":
+        """Returns the journal at `path`, or next to the Expe's JSON file if no path is given"""
+        if path is None:
+            if not expe.json_path:
+                raise RagtimeException("The Expe has no JSON file - give the path of the journal explicitly")
+            path = expe.json_path.with_suffix(JOURNAL_SUFFIX)
+        return cls(path, fsync=fsync)
+
+    def __enter__(self) -> "Journal":
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.path, mode="a", encoding="utf-8")
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def _append(self, line: dict):
+        with self._lock:
+            self._file.write(json.dumps(line, ensure_ascii=False, default=str) + "\n")
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+
+    def record(self, qa_index: int, stage: str, kind: str, llm: str, obj: BaseModel):
+        """
+        Appends a result - kind is "question", "answer", "facts" or "eval"
+        For an eval, llm is the name of the LLM which generated the evaluated Answer
+        """
+        self._append({"qa": qa_index, "stage": stage, "kind": kind, "llm": llm,
+                      "data": obj.model_dump(mode="json")})
+
+    def mark_done(self, qa_index: int, stage: str):
+        self._append({"qa": qa_index, "stage": stage, "done": True})
+
+    def replay(self, expe: Expe) -> dict[str, set[int]]:
+        """
+        Applies the results of the journal to the Expe, in the order they have been written
+        Returns the indexes of the QAs done for each stage
+        """
+        done: dict[str, set[int]] = {}
+        if not self.path.exists():
+            return done
+        nb_records: int = 0
+        with open(self.path, mode="r", encoding="utf-8") as file:
+            for num_line, line in enumerate(file, start=1):
+                try:
+                    entry: dict = json.loads(line)
+                except json.JSONDecodeError:
+                    # most likely the last line, cut when the run has been killed
+                    logger.warning(f"Skip unreadable line {num_line} in journal {self.path}")
+                    continue
+                if not 0 <= entry.get("qa", -1) < len(expe):
+                    continue
+                if entry.get("done"):
+                    done.setdefault(entry["stage"], set()).add(entry["qa"])
+                else:
+                    _apply(expe[entry["qa"]], entry["kind"], entry["llm"], entry["data"])
+                    nb_records += 1
+        logger.info(f"{nb_records} results replayed from journal {self.path}")
+        return done
+
+
+def _llm_name(obj: Any) -> Optional[str]:
+    llm_answer = obj.llm_answer
+    # some generators set llm_answer as a plain dict
+    return llm_answer.get("name") if isinstance(llm_answer, dict) else getattr(llm_answer, "name", None)
+
+
+def _apply(qa: QA, kind: str, llm: str, data: dict):
+    """Writes a result read from the journal in the QA"""
+    if kind == "question":
+        qa.question = Question(**data)
+    elif kind == "facts":
+        qa.facts = Facts(**data)
+    else:
+        ans: Optional[Answer] = next((a for a in qa.answers if (_llm_name(a) or UNKNOWN_LLM) == llm), None)
+        if kind == "answer":
+            if ans:
+                qa.answers[qa.answers.items.index(ans)] = Answer(**data)
+            else:
+                qa.answers.append(Answer(**data))
+        elif kind == "eval" and ans:
+            ans.eval = Eval(**data)
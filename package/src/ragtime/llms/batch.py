@@ -0,0 +1,160 @@
+"""
+Batch execution of LLM calls through OpenAI-compatible batch APIs.
+
+For large offline runs, e.g. nightly evaluations of thousands of questions, latency does not matter
+and providers bill batch requests about half the price of interactive ones, outside of the usual rate limits.
+`TextGenerator.generate(batch=BatchClient(...))` then works in three steps:
+1. the generation is run on a copy of the Expe, the LLM requests being collected instead of sent
+2. the requests are written to a JSONL file, submitted as a batch job, polled until done and the
+responses downloaded - requests depending on the answers of others, e.g. evals using facts generated
+from the answers, are collected and submitted in a further round
+3. the generation is run on the Expe itself, each LLM call being answered with its batch response -
+calls without a response, e.g. failed requests or LLMs not handled by the batch API, are sent live
+Requests and responses are matched by the hash of the LLM parameters and of the prompt, as in the cache.
+"""
+
+import json
+import os
+import time
+from typing import Optional
+
+import requests
+
+from ragtime.base import RagtimeException
+from ragtime.config import logger
+
+CHAT_COMPLETIONS_ENDPOINT: str = "/v1/chat/completions"
+_DONE_STATUSES: set[str] = {"completed", "failed", "expired", "cancelled"}
+
+
+class BatchClient:
+    """
+    Client for the batch API of OpenAI and compatible providers (files + batches endpoints)
+    - api_base: URL of the API - defaults to the OPENAI_API_BASE environment variable, then to OpenAI's URL
+    - api_key: defaults to the OPENAI_API_KEY environment variable
+    - models: names of the LLMs whose calls are sent in batches - None for every LLM supporting it
+    - poll_interval: time in seconds between two checks of a batch status
+    - timeout: max time in seconds to wait for a batch - its completed responses are used anyway
+    - max_rounds: max number of batches submitted in sequence for requests depending on previous answers
+    - cost_factor: cost of a batch request relative to an interactive one - used to compute LLMAnswer.cost
+    """
+
+    def __init__(
+        self,
+        api_base: str = None,
+        api_key: str = None,
+        models: list[str] = None,
+        poll_interval: float = 30.0,
+        timeout: float = 24 * 3600,
+        max_rounds: int = 3,
+        cost_factor: float = 0.5,
+        completion_window: str = "24h",
+    ):
+        self.api_base: str = (api_base or os.environ.get("OPENAI_API_BASE") or "https://api.openai.com/v1").rstrip("/")
+        self.api_key: Optional[str] = api_key or os.environ.get("OPENAI_API_KEY")
+        self.models: Optional[list[str]] = models
+        self.poll_interval: float = poll_interval
+        self.timeout: float = timeout
+        self.max_rounds: int = max_rounds
+        self.cost_factor: float = cost_factor
+        self.completion_window: str = completion_window
+
+    def accepts(self, llm_name: str) -> bool:
+        return self.models is None or llm_name in self.models
+
+    def _request(self, method: str, path: str, **kwargs) -> requests.Response:
+        headers: dict = {"Authorization": f"Bearer {self.api_key}"} if self.api_key else {}
+        response: requests.Response = requests.request(method, f"{self.api_base}{path}", headers=headers,
+                                                        timeout=300, **kwargs)
+        if not response.ok:
+            raise RagtimeException(f"Batch API error {response.status_code} on {path}: {response.text[:300]}")
+        return response
+
+    def submit(self, batch_requests: dict[str, dict]) -> str:
+        """Uploads the requests {custom_id: request body} as a JSONL file, creates the batch and returns its id"""
+        lines: list[str] = [
+            json.dumps({"custom_id": custom_id, "method": "POST", "url": CHAT_COMPLETIONS_ENDPOINT, "body": body},
+                       ensure_ascii=False)
+            for custom_id, body in batch_requests.items()
+        ]
+        content: bytes = ("\n".join(lines) + "\n").encode("utf-8")
+        file_id: str = self._request("POST", "/files", data={"purpose": "batch"},
+                                     files={"file": ("ragtime_batch.jsonl", content)}).json()["id"]
+        batch: dict = self._request("POST", "/batches", json={
+            "input_file_id": file_id,
+            "endpoint": CHAT_COMPLETIONS_ENDPOINT,
+            "completion_window": self.completion_window,
+        }).json()
+        logger.info(f'Batch {batch["id"]} submitted with {len(lines)} requests')
+        return batch["id"]
+
+    def wait(self, batch_id: str) -> dict:
+        """Polls the batch until it is done or the timeout is reached and returns the batch object"""
+        start: float = time.monotonic()
+        while True:
+            batch: dict = self._request("GET", f"/batches/{batch_id}").json()
+            status: str = batch.get("status", "")
+            if status in _DONE_STATUSES:
+                logger.info(f"Batch {batch_id} {status} - {batch.get('request_counts')}")
+                return batch
+            if time.monotonic() - start > self.timeout:
+                logger.error(f"Batch {batch_id} still {status} after {self.timeout}s - use what is done so far")
+                return batch
+            logger.debug(f"Batch {batch_id} {status} - wait {self.poll_interval}s")
+            time.sleep(self.poll_interval)
+
+    def download(self, batch: dict) -> dict[str, dict]:
+        """Returns the responses of a batch as {custom_id: chat completion body} - failed requests are logged and skipped"""
+        responses: dict[str, dict] = {}
+        if batch.get("error_file_id"):
+            for line in self._request("GET", f"/files/{batch['error_file_id']}/content").text.splitlines():
+                if line.strip():
+                    error: dict = json.loads(line)
+                    logger.error(f'Batch request {error.get("custom_id")} failed: {error.get("error") or error.get("response")}')
+        if not batch.get("output_file_id"):
+            return responses
+        for line in self._request("GET", f"/files/{batch['output_file_id']}/content").text.splitlines():
+            if not line.strip():
+                continue
+            result: dict = json.loads(line)
+            response: dict = result.get("response") or {}
+            if result.get("error") or response.get("status_code", 200) != 200:
+                logger.error(f'Batch request {result.get("custom_id")} failed: {result.get("error") or response.get("body")}')
+                continue
+            responses[result["custom_id"]] = response["body"]
+        return responses
+
+    def run(self, batch_requests: dict[str, dict]) -> dict[str, dict]:
+        """Submits the requests, waits for the batch and returns its responses"""
+        return self.download(self.wait(self.submit(batch_requests)))
+
+
+class BatchRun:
+    """
+    Requests collected and responses received during a generation in batch mode - set in the Scheduler
+    While `collecting` is True, LLMs add their requests instead of calling the provider
+    """
+
+    def __init__(self, client: BatchClient):
+        self.client: BatchClient = client
+        self.collecting: bool = False
+        self.pending: dict[str, dict] = {}  # requests to be submitted in the next batch
+        self.submitted: set[str] = set()  # requests already sent, failed ones are not sent again but called live
+        self.responses: dict[str, dict] = {}
+
+    def add(self, custom_id: str, body: dict):
+        if custom_id not in self.submitted:
+            self.pending[custom_id] = body
+
+    def response(self, custom_id: str) -> Optional[dict]:
+        return self.responses.get(custom_id)
+
+    def flush(self) -> int:
+        """Submits the pending requests as one batch and keeps the responses - returns the number of responses"""
+        if not self.pending:
+            return 0
+        self.submitted.update(self.pending)
+        responses: dict[str, dict] = self.client.run(self.pending)
+        self.responses.update(responses)
+        self.pending = {}
+        return len(responses)
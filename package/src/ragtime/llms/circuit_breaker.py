@@ -0,0 +1,191 @@
+"""
+Circuit breakers per model and endpoint, shared by every LLM object calling them.
+
+When an endpoint is down, calling it for every queued QA makes each call wait for its retries.
+After `failure_threshold` consecutive failures the circuit of the endpoint opens: calls fail at once,
+without reaching the provider, so they can go to a fallback deployment or be skipped.
+After `reset_timeout` seconds the circuit is half-open: a single probe call is let through - the circuit
+closes if it succeeds and opens again if it fails.
+
+State changes are sent to the listeners registered with `add_circuit_listener`, e.g. to show them in a job log,
+and `circuit_states()` returns the current state of every circuit.
+"""
+
+import threading
+import time
+from enum import Enum
+from typing import Callable, Optional
+
+from ragtime.base import RagtimeException
+from ragtime.config import logger
+
+
+class CircuitState(Enum):
+    closed = "closed"  # calls go through
+    open = "open"  # calls fail at once
+    half_open = "half_open"  # a single probe call goes through
+
+
+class CircuitOpenError(RagtimeException):
+    """Raised when a call is not made because the circuit of its endpoint is open"""
+
+    pass
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker of one model / endpoint
+    - failure_threshold: number of consecutive failures opening the circuit
+    - reset_timeout: time in seconds after which an open circuit lets a probe call through
+    """
+
+    def __init__(self, key: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.key: str = key
+        self.failure_threshold: int = failure_threshold
+        self.reset_timeout: float = reset_timeout
+        self.nb_failures: int = 0  # consecutive failures
+        self._state: CircuitState = CircuitState.closed
+        self._opened_at: float = 0.0
+        self._probe: Optional[int] = None  # token of the probe call in flight, if any
+        self._nb_probes: int = 0
+        self._changes: list[CircuitState] = []  # state changes not sent to the listeners yet
+        self._lock: threading.Lock = threading.Lock()
+
+    @property
+    def state(self) -> CircuitState:
+        with self._lock:
+            state: CircuitState = self._current_state()
+        self._notify()
+        return state
+
+    def _current_state(self) -> CircuitState:
+        if self._state == CircuitState.open and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self._set_state(CircuitState.half_open)
+        return self._state
+
+    def _set_state(self, state: CircuitState):
+        # called with the lock held - the listeners are called by _notify once it is released
+        if state == self._state:
+            return
+        self._state = state
+        if state == CircuitState.open:
+            self._opened_at = time.monotonic()
+        logger.warning(f'Circuit of "{self.key}" {state.value}'
+                       + (f" after {self.nb_failures} consecutive failures" if state == CircuitState.open else ""))
+        self._changes.append(state)
+
+    def _notify(self):
+        """Sends the pending state changes to the listeners - must be called without holding the lock,
+        as a listener may read the state of this circuit or of the others"""
+        with self._lock:
+            changes, self._changes = self._changes, []
+        for state in changes:
+            for listener in list(_listeners):
+                try:
+                    listener(self.key, state)
+                except Exception as e:
+                    logger.debug(f"Circuit listener failed: {e}")
+
+    def before_call(self) -> Optional[int]:
+        """
+        Raises CircuitOpenError if the call must not be made - lets a single probe through when half-open
+        Returns the token of the probe, None if the call is not a probe - to give to `record_*` once the call is over
+        """
+        with self._lock:
+            state: CircuitState = self._current_state()
+            blocked: bool = state == CircuitState.open or (state == CircuitState.half_open and self._probe is not None)
+            probe: Optional[int] = None
+            if state == CircuitState.half_open and not blocked:
+                self._nb_probes += 1
+                self._probe = probe = self._nb_probes
+        self._notify()
+        if blocked:
+            raise CircuitOpenError(f'Circuit of "{self.key}" is {state.value} - call not made')
+        return probe
+
+    def record_success(self, probe: Optional[int] = None):
+        """
+        The probe closes the circuit - a call started before the circuit opened only resets the failures
+        of a closed circuit
+        """
+        with self._lock:
+            if probe is not None and probe == self._probe:
+                self._probe = None
+                self.nb_failures = 0
+                self._set_state(CircuitState.closed)
+            elif probe is None and self._state == CircuitState.closed:
+                self.nb_failures = 0
+        self._notify()
+
+    def record_failure(self, probe: Optional[int] = None):
+        """The probe opens the circuit again - the other calls open it after `failure_threshold` failures"""
+        with self._lock:
+            if probe is not None and probe == self._probe:
+                self._probe = None
+                self.nb_failures += 1
+                self._set_state(CircuitState.open)
+            elif probe is None:
+                self.nb_failures += 1
+                if self._state == CircuitState.closed and self.nb_failures >= self.failure_threshold:
+                    self._set_state(CircuitState.open)
+        self._notify()
+
+    def record_cancel(self, probe: Optional[int] = None):
+        """The call has been cancelled before any outcome, e.g. a hedged request - if it was the probe, lets another one through"""
+        with self._lock:
+            if probe is not None and probe == self._probe:
+                self._probe = None
+
+
+_breakers: dict[str, CircuitBreaker] = {}
+_breakers_lock: threading.Lock = threading.Lock()
+_listeners: list[Callable[[str, CircuitState], None]] = []
+_settings: dict[str, float] = {"failure_threshold": 5, "reset_timeout": 30.0}
+
+
+def circuit_key(model: str, api_base: Optional[str] = None) -> str:
+    return f"{model}@{api_base.rstrip('/')}" if api_base else model
+
+
+def configure_circuit_breakers(failure_threshold: int = None, reset_timeout: float = None):
+    """Sets the parameters of the circuit breakers - applies to the existing ones as well"""
+    with _breakers_lock:
+        if failure_threshold is not None:
+            _settings["failure_threshold"] = failure_threshold
+        if reset_timeout is not None:
+            _settings["reset_timeout"] = reset_timeout
+        for breaker in _breakers.values():
+            breaker.failure_threshold = _settings["failure_threshold"]
+            breaker.reset_timeout = _settings["reset_timeout"]
+
+
+def get_circuit_breaker(model: str, api_base: Optional[str] = None) -> CircuitBreaker:
+    key: str = circuit_key(model, api_base)
+    with _breakers_lock:
+        if key not in _breakers:
+            _breakers[key] = CircuitBreaker(key, failure_threshold=int(_settings["failure_threshold"]),
+                                            reset_timeout=_settings["reset_timeout"])
+        return _breakers[key]
+
+
+def circuit_states() -> dict[str, dict]:
+    """Returns {key: {"state", "failures"}} for every circuit"""
+    with _breakers_lock:
+        breakers: list[CircuitBreaker] = list(_breakers.values())
+    return {b.key: {"state": b.state.value, "failures": b.nb_failures} for b in breakers}
+
+
+def add_circuit_listener(listener: Callable[[str, CircuitState], None]):
+    """Registers a function called with (key, new state) each time a circuit changes state"""
+    _listeners.append(listener)
+
+
+def remove_circuit_listener(listener: Callable[[str, CircuitState], None]):
+    if listener in _listeners:
+        _listeners.remove(listener)
+
+
+def reset_circuit_breakers():
+    """Forgets every circuit, e.g. between two independent runs or in tests"""
+    with _breakers_lock:
+        _breakers.clear()
@@ -0,0 +1,45 @@
+"""
+Running latency statistics of the calls to each model / deployment, shared by all the LLM objects calling it.
+Used to decide when a call is late enough to be hedged, i.e. duplicated (see `LiteLLM.hedge`).
+"""
+
+import threading
+from collections import deque
+from typing import Optional
+
+from ragtime.scheduler import percentile
+
+
+class LatencyTracker:
+    """Latencies in seconds of the last `window` successful calls to a deployment"""
+
+    def __init__(self, window: int = 200):
+        self._latencies: deque[float] = deque(maxlen=window)
+        self._lock: threading.Lock = threading.Lock()
+
+    def add(self, latency: float):
+        with self._lock:
+            self._latencies.append(latency)
+
+    def __len__(self) -> int:
+        return len(self._latencies)
+
+    def quantile(self, q: float, min_samples: int = 1) -> Optional[float]:
+        """Returns the q-quantile of the latencies, None if fewer than `min_samples` calls have been measured"""
+        with self._lock:
+            if len(self._latencies) < max(min_samples, 1):
+                return None
+            return percentile(list(self._latencies), q)
+
+
+_trackers: dict[str, LatencyTracker] = {}
+_trackers_lock: threading.Lock = threading.Lock()
+
+
+def get_latency_tracker(model: str, api_base: Optional[str] = None) -> LatencyTracker:
+    """Returns the LatencyTracker of a model served by a given endpoint"""
+    key: str = f"{model}@{(api_base or '').rstrip('/')}"
+    with _trackers_lock:
+        if key not in _trackers:
+            _trackers[key] = LatencyTracker()
+        return _trackers[key]
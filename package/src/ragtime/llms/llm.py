@@ -5,6 +5,14 @@ from ragtime.prompters.prompter import Prompter
 from ragtime.base import RagtimeBase
 from ragtime.expe import QA, Prompt, LLMAnswer, WithLLMAnswer, StartFrom, Chunk
 from ragtime.config import logger, DEFAULT_MAX_TOKENS, DEFAULT_TEMPERATURE
+from ragtime.scheduler import Scheduler, current_scheduler, llm_slot
+from ragtime.cache import CacheMode, hash_key
+from ragtime.llms.rate_limiter import RateLimiter, get_rate_limiter
+from ragtime.tokens import estimate_tokens, prompt_target
+from ragtime.llms.batch import BatchRun
+from ragtime.llms.latency import LatencyTracker, get_latency_tracker
+from ragtime.llms.circuit_breaker import CircuitBreaker, CircuitOpenError, get_circuit_breaker
+from ragtime.budget import Budget, BudgetExceeded, Reservation, current_reservation
 
 import litellm
 from litellm import completion_cost, acompletion
@@ -14,12 +22,18 @@ import re
 from datetime import datetime
 from typing import Optional, Any
 import asyncio
+import time
 
 # Drop provider-unsupported params instead of 400-ing (reasoning models reject
 # temperature!=1 and max_tokens). Set once at import time.
 litellm.drop_params = True
 
 
+def _batch_collecting() -> bool:
+    scheduler: Optional[Scheduler] = current_scheduler()
+    return bool(scheduler and scheduler.batch and scheduler.batch.collecting)
+
+
 class LLM(RagtimeBase):
     """
     Base class for text to text LLMs.
@@ -57,7 +71,11 @@ class LLM(RagtimeBase):
         if not (prev_obj and prev_obj.llm_answer and prev_obj.llm_answer.prompt) \
                 or (start_from <= StartFrom.prompt and not b_missing_only):
             logger.debug(f"Generate prompt")
-            prompt = self.prompter.get_prompt(**kwargs)
+            token = prompt_target.set((self.name, self._effective_max_tokens()))
+            try:
+                prompt = self.prompter.get_prompt(**kwargs)
+            finally:
+                prompt_target.reset(token)
         else:
             logger.debug(f"Reuse existing Prompt")
             prompt = prev_obj.llm_answer.prompt
@@ -73,7 +91,7 @@ class LLM(RagtimeBase):
             b_exception:bool = False
             exc:Exception = None
             try:
-                result.llm_answer = await self.complete(prompt)
+                result.llm_answer = await self._complete_or_reuse(prompt)
                 if result.llm_answer:
                     if result.llm_answer.chunks:
                         for chunk in result.llm_answer.chunks:
@@ -84,10 +102,17 @@ class LLM(RagtimeBase):
                     result.llm_answer.prompt.prompter = self.prompter.name  # and it name
                 else:
                     b_exception = True
+            except (CircuitOpenError, BudgetExceeded) as e:
+                # the circuit opening, or the budget being spent, has already been logged - not again for each call
+                logger.debug(f"Skip - {e}")
+                return None
             except Exception as e:
                 exc = e
                 b_exception = True
 
+            if b_exception and not exc and _batch_collecting():
+                logger.debug(f"Collecting batch requests - call deferred")
+                return None
             if b_exception:
                 logger.exception(f"Exception while generating - skip it\n{exc if exc else ''}")
                 return None
@@ -116,6 +141,95 @@ class LLM(RagtimeBase):
 
         return result
 
+    def _effective_max_tokens(self) -> int:
+        """Max number of tokens of the answer actually requested from the model - reserved in its context window"""
+        return self.max_tokens
+
+    def _cache_params(self) -> dict:
+        """Parameters which, with the prompt, identify an LLMAnswer in the cache - override to add yours"""
+        return {"class": self.__class__.__name__, "name": self.name, "max_tokens": self.max_tokens}
+
+    def cache_key(self, prompt: Prompt) -> str:
+        return hash_key({**self._cache_params(), "system": prompt.system, "user": prompt.user})
+
+    async def _complete_or_reuse(self, prompt: Prompt) -> LLMAnswer:
+        """
+        Returns the LLMAnswer cached for this prompt if the current run uses a cache, or its batch response
+        if the run is in batch mode, calls `complete` otherwise
+        While a batch is collecting requests, the request is added to the batch and None is returned
+        New answers are stored in the cache if the run's cache mode allows it, and added to the run's budget if any
+        Raises BudgetExceeded instead of calling the LLM if the call could pass the budget of the run (see `Budget.reserve`)
+        """
+        scheduler: Optional[Scheduler] = current_scheduler()
+        cache = scheduler.cache if scheduler else None
+        batch: Optional[BatchRun] = scheduler.batch if scheduler else None
+        budget: Optional[Budget] = scheduler.budget if scheduler else None
+        key: str = self.cache_key(prompt) if cache is not None or batch is not None else ""
+        if cache is not None:
+            cached: Optional[dict] = cache.get(key)
+            if cached:
+                logger.debug(f"Reuse LLMAnswer from cache")
+                scheduler.stats.cache_hits += 1
+                llm_answer: LLMAnswer = LLMAnswer(**cached)
+                llm_answer.meta["cached"] = True
+                return llm_answer
+
+        llm_answer: Optional[LLMAnswer] = None
+        if batch is not None:
+            response: Optional[dict] = batch.response(key)
+            if response is not None:
+                logger.debug(f"Use LLMAnswer from batch response")
+                scheduler.stats.batch_answers += 1
+                llm_answer = self.from_batch_response(response)
+                llm_answer.meta["batch"] = True
+                if llm_answer.cost:
+                    llm_answer.cost *= batch.client.cost_factor
+            elif batch.collecting:
+                request: Optional[dict] = self.batch_request(prompt) if batch.client.accepts(self.name) else None
+                if request is not None:
+                    batch.add(key, request)
+                return None
+
+        reservation: Optional[Reservation] = None
+        if llm_answer is None:
+            async with llm_slot(self.name):
+                if budget:
+                    # once the slot is free, as the budget may have been spent meanwhile
+                    reservation = self._reserve(budget, prompt)
+                token = current_reservation.set(reservation)
+                try:
+                    llm_answer = await self.complete(prompt)
+                except BaseException:
+                    if budget:
+                        budget.release(reservation)
+                    raise
+                finally:
+                    current_reservation.reset(token)
+        if budget:
+            budget.record(llm_answer, prompt, reservation)
+
+        if cache is not None and scheduler.cache_mode == CacheMode.read_write and llm_answer and llm_answer.text:
+            cache.set(key, llm_answer.model_dump(mode="json", exclude={"prompt"}))
+        return llm_answer
+
+    def _estimate_cost(self, prompt_tokens: int, completion_tokens: int) -> float:
+        """Cost in USD of a call with this number of tokens, 0.0 if the price of the model is unknown"""
+        return 0.0
+
+    def _reserve(self, budget: Budget, prompt: Prompt) -> Reservation:
+        """Reserves in the budget the max tokens and the max cost of a call with this prompt - raises BudgetExceeded"""
+        prompt_tokens: int = estimate_tokens(prompt.system) + estimate_tokens(prompt.user)
+        max_tokens: int = self._effective_max_tokens() or 0
+        return budget.reserve(prompt_tokens + max_tokens, self._estimate_cost(prompt_tokens, max_tokens))
+
+    def batch_request(self, prompt: Prompt) -> Optional[dict]:
+        """Returns the body of the chat completion request to send in a batch - None if the LLM does not support batches"""
+        return None
+
+    def from_batch_response(self, response: dict) -> LLMAnswer:
+        """Converts a chat completion response received in a batch into an LLMAnswer"""
+        raise NotImplementedError("Must implement this to use batches!")
+
     @abstractmethod
     async def complete(self, prompt: Prompt) -> LLMAnswer:
         raise NotImplementedError("Must implement this!")
@@ -130,6 +244,8 @@ class LiteLLM(LLM):
     The generate method uses the standard litellm completion method.
     Default values of temperature (0.0)
     Number of retries when calling the API (3) can be changed.
+    Calls wait for the rate limits of their provider, shared with the other LLMs calling it (see rate_limiter.py).
+    Slow calls can be hedged and failed calls sent to fallback deployments (see `hedge` and `fallbacks`).
     The proper API keys and endpoints have to be specified in the keys.py module.
     """
 
@@ -140,37 +256,257 @@ class LiteLLM(LLM):
     # {"api_base": ..., "api_key": ...} to reach an OpenAI-compatible
     # endpoint such as OVH AI Endpoints.
     extra_params: dict = {}
+    # Equivalent deployments called in order when the previous ones fail, each one a dict overriding
+    # the model name and / or the completion kwargs, e.g. [{"api_base": ..., "api_key": ...}, {"model": "openai/..."}]
+    fallbacks: list[dict] = []
+    # Hedging: when a call has not answered after the running `hedge_quantile` latency of its deployment,
+    # a duplicate request is sent (to the next deployment if any) and the first answer is used
+    # No hedging until `hedge_min_samples` calls have been measured
+    hedge: bool = False
+    hedge_quantile: float = 0.95
+    hedge_min_samples: int = 20
 
-    async def complete(self, prompt: Prompt) -> LLMAnswer:
+    def _completion_kwargs(self) -> dict:
+        return {"reasonning_effort": None, **self.extra_params}
+
+    def _estimate_cost(self, prompt_tokens: int, completion_tokens: int) -> float:
+        try:
+            return sum(litellm.cost_per_token(model=self.name, prompt_tokens=prompt_tokens,
+                                              completion_tokens=completion_tokens))
+        except Exception:
+            return 0.0
+
+    def _cache_params(self) -> dict:
+        # api_key identifies the account, not the answer: keep it out of the key (and out of the cache file)
+        kwargs: dict = {k: v for k, v in self._completion_kwargs().items() if k != "api_key"}
+        return {**super()._cache_params(), "temperature": self.temperature,
+                "max_tokens": self._effective_max_tokens(), "params": kwargs}
+
+    def batch_request(self, prompt: Prompt) -> Optional[dict]:
+        # same parameters as in _acompletion, the endpoint and the key being the batch client's
+        model: str = self.name.split("/", 1)[1] if self.name.split("/", 1)[0] in litellm.provider_list else self.name
+        body: dict = {
+            "model": model,
+            "messages": [
+                {"content": prompt.system, "role": "system"},
+                {"content": prompt.user, "role": "user"},
+            ],
+            "temperature": self.temperature,
+            "max_tokens": self._effective_max_tokens(),
+        }
+        for k, v in self._completion_kwargs().items():
+            if k == "extra_body":
+                body.update(v)
+            elif k not in ("api_base", "api_key", "reasonning_effort") and v is not None:
+                body[k] = v
+        return body
+
+    def from_batch_response(self, response: dict) -> LLMAnswer:
+        return self._parse_response(litellm.ModelResponse(**response), datetime.now())
+
+    def _deployments(self) -> list[tuple[str, dict]]:
+        """Returns the (model, completion kwargs) to call in order: the LLM itself first, then its fallbacks"""
+        kwargs: dict = self._completion_kwargs()
+        result: list[tuple[str, dict]] = [(self.name, kwargs)]
+        for fallback in self.fallbacks:
+            fallback = dict(fallback)
+            result.append((fallback.pop("model", self.name), {**kwargs, **fallback}))
+        return result
+
+    async def _acompletion(self, prompt: Prompt, losers: Optional[list] = None) -> Optional[Any]:
+        """
+        Calls the LLM's deployments in order until one of them answers - see `fallbacks`
+        Each call is hedged if `hedge` is True - deployments whose circuit is open are skipped (see circuit_breaker.py)
+        The requests sent but whose answer is not used are added to `losers`, see `_hedged_call`
+        Returns the raw response, or None if every deployment failed
+        Raises CircuitOpenError if no call has been made since the circuits of all the deployments are open
+        """
         messages: list[dict] = [
             {"content": prompt.system, "role": "system"},
             {"content": prompt.user, "role": "user"},
         ]
+        deployments: list[tuple[str, dict]] = self._deployments()
+        circuit_error: Optional[CircuitOpenError] = None
+        nb_open: int = 0
+        for num, (model, kwargs) in enumerate(deployments):
+            try:
+                answer = await self._hedged_call(prompt, messages, deployments, num, losers)
+            except CircuitOpenError as e:
+                circuit_error = e
+                nb_open += 1
+                continue
+            if answer is not None:
+                return answer
+            if num + 1 < len(deployments):
+                logger.warning(f'"{model}" at {kwargs.get("api_base") or "default endpoint"} failed - fall back to the next deployment')
+        if nb_open == len(deployments):
+            raise circuit_error
+        return None
+
+    async def _hedged_call(self, prompt: Prompt, messages: list[dict], deployments: list[tuple[str, dict]], num: int,
+                           losers: Optional[list] = None) -> Optional[Any]:
+        """
+        Calls the deployment `num` - if hedging is on and no answer has arrived `hedge_quantile` latency of this
+        deployment after the request has been sent, i.e. once the rate limits let it through, sends a duplicate
+        request to the next deployment (the same one if there is none) and returns the first answer, the other
+        request being cancelled
+        The duplicate request takes its own slot in the current Scheduler and is reserved in its Budget, if any
+        The requests sent but not used are added to `losers` as (model, raw response or None if it did not answer)
+        """
+        model, kwargs = deployments[num]
+        delay: Optional[float] = None
+        if self.hedge:
+            delay = get_latency_tracker(model, kwargs.get("api_base")).quantile(self.hedge_quantile, self.hedge_min_samples)
+        if delay is None:
+            return await self._call_deployment(prompt, messages, model, kwargs)
+
+        first_sent: asyncio.Event = asyncio.Event()
+        first: asyncio.Task = asyncio.ensure_future(self._call_deployment(prompt, messages, model, kwargs, first_sent))
+        waiting: asyncio.Task = asyncio.ensure_future(first_sent.wait())
+        try:
+            await asyncio.wait({first, waiting}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            waiting.cancel()
+        done, _ = await asyncio.wait({first}, timeout=delay)
+        if done:
+            return first.result()
+        hedge_model, hedge_kwargs = deployments[(num + 1) % len(deployments)]
+        logger.debug(f"No answer after {delay:.2f}s - hedge with a duplicate request to {hedge_model}")
+        hedge_sent: asyncio.Event = asyncio.Event()
+        duplicate: asyncio.Task = asyncio.ensure_future(
+            self._duplicate_call(prompt, messages, hedge_model, hedge_kwargs, hedge_sent))
+        sent: dict[asyncio.Task, tuple[str, asyncio.Event]] = {first: (model, first_sent),
+                                                               duplicate: (hedge_model, hedge_sent)}
+        tasks: set[asyncio.Task] = {first, duplicate}
+        winner: Optional[asyncio.Task] = None
+        try:
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                # a failed request, or a duplicate not sent since its circuit is open or the budget is spent,
+                # leaves the other one running
+                winner = next((t for t in done if not t.exception() and t.result() is not None), None)
+                if winner is not None:
+                    break
+        finally:
+            for task in tasks:
+                task.cancel()
+        if losers is not None:
+            for task, (loser_model, loser_sent) in sent.items():
+                if task is not winner and loser_sent.is_set():
+                    response = task.result() if task.done() and not task.cancelled() and not task.exception() else None
+                    losers.append((loser_model, response))
+        return winner.result() if winner is not None else None
+
+    async def _duplicate_call(self, prompt: Prompt, messages: list[dict], model: str, kwargs: dict,
+                              sent: asyncio.Event) -> Optional[Any]:
+        """A hedged request: a call of its own for the Scheduler and the Budget - raises BudgetExceeded if it is spent"""
+        async with llm_slot(self.name):
+            scheduler: Optional[Scheduler] = current_scheduler()
+            reservation: Optional[Reservation] = current_reservation.get()
+            if scheduler and scheduler.budget and reservation:
+                reservation.add(self._reserve(scheduler.budget, prompt))
+            return await self._call_deployment(prompt, messages, model, kwargs, sent)
+
+    async def _call_deployment(self, prompt: Prompt, messages: list[dict], model: str, kwargs: dict,
+                               sent: Optional[asyncio.Event] = None) -> Optional[Any]:
+        """
+        Calls litellm's acompletion on one deployment, within the rate limits shared by the LLMs calling
+        the same provider (see rate_limiter.py) - retries when the provider still answers with a RateLimitError
+        `sent` is set once the rate limits have let the request through
+        A request cancelled while waiting for its answer adds its time so far to the latencies of the deployment
+        Returns the raw response, or None if the call failed
+        Raises CircuitOpenError, without calling, if the circuit of the deployment is open
+        """
+        limiter: Optional[RateLimiter] = get_rate_limiter(model, kwargs.get("api_base"))
+        tracker: LatencyTracker = get_latency_tracker(model, kwargs.get("api_base"))
+        breaker: CircuitBreaker = get_circuit_breaker(model, kwargs.get("api_base"))
+        probe: Optional[int] = breaker.before_call()
+        nb_tokens: int = estimate_tokens(prompt.system) + estimate_tokens(prompt.user)
         retry: int = 1
         wait_step: float = 3.0
+        try:
+            while retry < self.num_retries:
+                try:
+                    if limiter:
+                        await limiter.acquire(nb_tokens)
+                    if sent:
+                        sent.set()
+                    start: float = time.perf_counter()
+                    try:
+                        answer = await acompletion(
+                            messages=messages,
+                            model=model,
+                            temperature=self.temperature,
+                            num_retries=self.num_retries,
+                            max_tokens=self._effective_max_tokens(),
+                            **kwargs,
+                        )
+                    except asyncio.CancelledError:
+                        # a lower bound of the latency: without it only the calls faster than the hedge would count
+                        tracker.add(time.perf_counter() - start)
+                        raise
+                    tracker.add(time.perf_counter() - start)
+                    breaker.record_success(probe)
+                    if limiter:
+                        usage = getattr(answer, "usage", None)
+                        limiter.record_usage(nb_tokens, getattr(usage, "total_tokens", None))
+                    return answer
+                except RateLimitError as e:
+                    # the endpoint is up, it is not a failure for the circuit breaker
+                    logger.debug(f"Rate limit reached - will retry in {wait_step:.2f}s\n\t{str(e)}")
+                    await asyncio.sleep(wait_step)
+                    retry += 1
+                except Exception as e:
+                    breaker.record_failure(probe)
+                    logger.exception(f'The following exception occurred with prompt\n"{str(prompt)[:300]}"\nException: {e}')
+                    return None
+        finally:
+            breaker.record_cancel(probe)  # no effect once a success or a failure has been recorded
+        logger.error(f"Rate limit still reached after {self.num_retries} tries with {model}")
+        return None
+
+    async def complete(self, prompt: Prompt) -> LLMAnswer:
         start_ts: datetime = datetime.now()
-        answer: dict = None
-        while retry < self.num_retries:
+        losers: list[tuple[str, Optional[Any]]] = []
+        answer = await self._acompletion(prompt, losers)
+        if answer is None:
+            return None
+        llm_answer: LLMAnswer = self._parse_response(answer, start_ts)
+        total_tokens: Optional[int] = self._total_tokens(answer)
+        if total_tokens is not None:
+            llm_answer.meta["tokens"] = total_tokens
+        if losers:
+            self._add_hedges(llm_answer, prompt, losers)
+        return llm_answer
+
+    @staticmethod
+    def _total_tokens(answer: Any) -> Optional[int]:
+        usage = answer.get("usage") if isinstance(answer, dict) else getattr(answer, "usage", None)
+        return usage.get("total_tokens") if isinstance(usage, dict) else getattr(usage, "total_tokens", None)
+
+    def _add_hedges(self, llm_answer: LLMAnswer, prompt: Prompt, losers: list[tuple[str, Optional[Any]]]):
+        """
+        Adds the requests sent for the answer but not used to its cost, tokens and number of calls (`meta["calls"]`)
+        A request cancelled before answering is counted with its prompt only, at the price of the LLM
+        """
+        prompt_tokens: int = estimate_tokens(prompt.system) + estimate_tokens(prompt.user)
+        tokens: int = llm_answer.meta.get("tokens") or prompt_tokens + estimate_tokens(llm_answer.text)
+        cost: float = llm_answer.cost or 0.0
+        for model, response in losers:
+            if response is None:
+                tokens += prompt_tokens
+                cost += self._estimate_cost(prompt_tokens, 0)
+                continue
+            tokens += self._total_tokens(response) or prompt_tokens
             try:
-                time_to_wait: float = wait_step
-                answer = await acompletion(
-                    messages=messages,
-                    model=self.name,
-                    temperature=self.temperature,
-                    num_retries=self.num_retries,
-                    max_tokens=self.max_tokens,
-                    reasonning_effort=None,
-                    **self.extra_params,
-                )
-                break
-            except RateLimitError as e:
-                logger.debug(f"Rate limit reached - will retry in {time_to_wait:.2f}s\n\t{str(e)}")
-                await asyncio.sleep(time_to_wait)
-                retry += 1
+                cost += float(completion_cost(response))
             except Exception as e:
-                logger.exception(f'The following exception occurred with prompt\n"{str(prompt)[:300]}"\nException: {e}')
-                return None
+                logger.debug(f"completion_cost unavailable for {model}: {e}")
+        llm_answer.meta.update({"tokens": tokens, "calls": 1 + len(losers)})
+        llm_answer.cost = cost
 
+    def _parse_response(self, answer: Any, start_ts: datetime) -> LLMAnswer:
+        """Converts a raw chat completion response into an LLMAnswer"""
         try:
             full_name: str = answer["model"]
             text: str = answer["choices"][0]["message"]["content"]
@@ -275,34 +611,7 @@ class ReasoningLLM(LiteLLM):
         """Return the clean answer text. Base implementation trusts content."""
         return message.get("content") or ""
 
-    async def complete(self, prompt: Prompt) -> LLMAnswer:
-        messages: list[dict] = [
-            {"content": prompt.system, "role": "system"},
-            {"content": prompt.user, "role": "user"},
-        ]
-        retry: int = 1
-        wait_step: float = 3.0
-        start_ts: datetime = datetime.now()
-        answer: dict = None
-        while retry < self.num_retries:
-            try:
-                answer = await acompletion(
-                    messages=messages,
-                    model=self.name,
-                    temperature=self.temperature,
-                    num_retries=self.num_retries,
-                    max_tokens=self._effective_max_tokens(),
-                    **self._completion_kwargs(),
-                )
-                break
-            except RateLimitError as e:
-                logger.debug(f"Rate limit reached - will retry in {wait_step:.2f}s\n\t{str(e)}")
-                await asyncio.sleep(wait_step)
-                retry += 1
-            except Exception as e:
-                logger.exception(f'The following exception occurred with prompt\n"{str(prompt)[:300]}"\nException: {e}')
-                return None
-
+    def _parse_response(self, answer: Any, start_ts: datetime) -> LLMAnswer:
         try:
             full_name: str = answer["model"]
             message = answer["choices"][0]["message"]
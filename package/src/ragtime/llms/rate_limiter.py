@@ -0,0 +1,156 @@
+"""
+Requests-per-minute and tokens-per-minute limits shared by every LLM calling the same provider.
+
+Limits are token buckets keyed by the LLM's `api_base` if it has one (e.g. all the models served by
+an OVH AI Endpoints account), by its LiteLLM provider otherwise (e.g. "openai", "mistral").
+Every LLM object calling the same key shares the same buckets, so answer generation, fact generation
+and evaluation running against the same account share one budget.
+
+The limits of a key come from `register_rate_limits`. Without registered limits, the "rpm" / "tpm" entries
+of a model in LiteLLM's model catalog (`litellm.model_cost`) are limits of this model only: the model gets its
+own buckets, whatever the other models of its provider. A model without any known limit is not throttled.
+Providers limiting each model separately, e.g. OVH AI Endpoints per API key and model, register their
+limits with `model`: each model of the key then gets its own buckets.
+"""
+
+import asyncio
+import threading
+import time
+from typing import Optional
+
+import litellm
+
+from ragtime.config import logger
+from ragtime.tokens import estimate_tokens
+
+
+class TokenBucket:
+    """
+    Bucket holding at most `capacity` units, refilled continuously with `capacity` units per `period` seconds.
+    Acquiring units never blocks the event loop: the caller reserves its units, possibly going in debt,
+    and sleeps asynchronously until the debt is paid back by the refill.
+    Thread-safe, so a bucket can be shared by event loops running in different threads.
+    """
+
+    def __init__(self, capacity: float, period: float = 60.0):
+        self.capacity: float = float(capacity)
+        self.rate: float = self.capacity / period  # units refilled per second
+        self._level: float = self.capacity
+        self._last: float = time.monotonic()
+        self._lock: threading.Lock = threading.Lock()
+
+    def _refill(self):
+        now: float = time.monotonic()
+        self._level = min(self.capacity, self._level + (now - self._last) * self.rate)
+        self._last = now
+
+    def reserve(self, amount: float) -> float:
+        """Takes `amount` units and returns the time to wait before they are actually available"""
+        amount = min(amount, self.capacity)  # a request larger than the bucket must still go through
+        with self._lock:
+            self._refill()
+            self._level -= amount
+            return -self._level / self.rate if self._level < 0 else 0.0
+
+    def adjust(self, amount: float):
+        """Takes (amount > 0) or gives back (amount < 0) units without waiting, e.g. once the actual usage is known"""
+        with self._lock:
+            self._refill()
+            self._level = min(self.capacity, self._level - amount)
+
+    async def acquire(self, amount: float = 1.0):
+        wait: float = self.reserve(amount)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+class RateLimiter:
+    """Requests-per-minute and tokens-per-minute buckets for one provider key - 0 means no limit"""
+
+    def __init__(self, key: str, rpm: int = 0, tpm: int = 0):
+        self.key: str = key
+        self.rpm: int = rpm or 0
+        self.tpm: int = tpm or 0
+        self.requests: Optional[TokenBucket] = TokenBucket(self.rpm) if self.rpm else None
+        self.tokens: Optional[TokenBucket] = TokenBucket(self.tpm) if self.tpm else None
+
+    async def acquire(self, nb_tokens: int = 0):
+        """Waits until one request of `nb_tokens` tokens can be sent"""
+        waits: list[float] = []
+        if self.requests:
+            waits.append(self.requests.reserve(1))
+        if self.tokens and nb_tokens:
+            waits.append(self.tokens.reserve(nb_tokens))
+        wait: float = max(waits, default=0.0)
+        if wait > 0:
+            logger.debug(f'Rate limit for "{self.key}" - wait {wait:.2f}s')
+            await asyncio.sleep(wait)
+
+    def record_usage(self, estimated_tokens: int, actual_tokens: Optional[int]):
+        """Corrects the tokens bucket with the actual number of tokens used by a request, once known"""
+        if self.tokens and actual_tokens is not None:
+            self.tokens.adjust(actual_tokens - estimated_tokens)
+
+
+_registered_limits: dict[str, tuple[int, int]] = {}
+_limiters: dict[str, RateLimiter] = {}
+_limiters_lock: threading.Lock = threading.Lock()
+
+
+def _provider_key(model: str, api_base: Optional[str] = None) -> str:
+    if api_base:
+        return api_base.rstrip("/")
+    # same resolution as litellm.get_llm_provider for the common cases, without its console output on unknown models
+    if "/" in model and model.split("/", 1)[0] in litellm.provider_list:
+        return model.split("/", 1)[0]
+    return (litellm.model_cost.get(model) or {}).get("litellm_provider") or model
+
+
+def _model_key(key: str, model: str) -> str:
+    return f"{key.rstrip('/')}::{model}"
+
+
+def rate_limit_key(model: str, api_base: Optional[str] = None) -> str:
+    """
+    Returns the key whose limits apply to `model`: its api_base if any, its LiteLLM provider otherwise -
+    followed by the model name unless limits have been registered for the key itself, as the limits then come
+    from the model (registered for it or from the catalog)
+    """
+    key: str = _provider_key(model, api_base)
+    return key if key in _registered_limits and _model_key(key, model) not in _registered_limits \
+        else _model_key(key, model)
+
+
+def register_rate_limits(key: str, rpm: int = 0, tpm: int = 0, model: Optional[str] = None):
+    """
+    Sets the limits of a provider key (an api_base or a LiteLLM provider name), e.g. the rates of your account.
+    With `model`, the limits only apply to this model, which does not share them with the other models of the key.
+    Takes precedence over the model catalog. Limiters already created for this key are replaced.
+    """
+    key = _model_key(key, model) if model else key.rstrip("/")
+    with _limiters_lock:
+        _registered_limits[key] = (rpm, tpm)
+        _limiters.pop(key, None)
+
+
+def _catalog_limits(model: str) -> tuple[int, int]:
+    """Returns (rpm, tpm) from LiteLLM's model catalog, (0, 0) if unknown"""
+    candidates: list[str] = [model] + ([model.split("/", 1)[1]] if "/" in model else [])
+    for name in candidates:
+        entry: dict = litellm.model_cost.get(name) or {}
+        if entry.get("rpm") or entry.get("tpm"):
+            return entry.get("rpm") or 0, entry.get("tpm") or 0
+    return 0, 0
+
+
+def get_rate_limiter(model: str, api_base: Optional[str] = None) -> Optional[RateLimiter]:
+    """Returns the RateLimiter shared by all the LLMs calling `model` through the same key, None if no limit is known"""
+    key: str = rate_limit_key(model, api_base)
+    with _limiters_lock:
+        limiter: Optional[RateLimiter] = _limiters.get(key)
+        if limiter is None:
+            # a model key without registered limits takes the catalog limits of its own model only
+            rpm, tpm = _registered_limits.get(key) or _catalog_limits(model)
+            if rpm or tpm:
+                limiter = _limiters[key] = RateLimiter(key, rpm=rpm, tpm=tpm)
+        return limiter
@@ -8,6 +8,7 @@ import json
 from unidecode import unidecode
 from typing import Optional
 
+
 class AnsPrompterBase(Prompter):
     """
     This simple prompter just send the question as is to the LLM
@@ -85,6 +86,9 @@ Contenu
             )
             for chunk in chunks
         ]
+        chunks_as_list = self.fit_chunks(
+            chunks_as_list, [chunk.meta.get("score") for chunk in chunks],
+            [system_msg, fmt_chunks_to_user_msg.format(chunks="", question=question.text)], result)
         chunks_as_str: str = str_joint.join(chunks_as_list)
         result.user = fmt_chunks_to_user_msg.format(
             chunks=chunks_as_str, question=question.text
@@ -265,6 +269,9 @@ class AnsPrompterWithRetrieverFR_2024_06_04(Prompter):
             )
             for chunk in chunks
         ]
+        chunks_as_list = self.fit_chunks(
+            chunks_as_list, [chunk.meta.get("score") for chunk in chunks],
+            [system_msg, fmt_chunks_to_user_msg.format(chunks="", question=question.text)], result)
         chunks_as_str: str = str_joint.join(chunks_as_list)
         result.user = fmt_chunks_to_user_msg.format(
             chunks=chunks_as_str, question=question.text
@@ -1,6 +1,12 @@
 from abc import ABC, abstractmethod
+from typing import Optional
 from ragtime.base import RagtimeBase
 from ragtime.expe import Prompt, QA, WithLLMAnswer
+from ragtime.config import logger
+from ragtime.tokens import count_tokens, prompt_target, prompt_token_budget, truncate_to_tokens
+
+# a chunk is truncated to fit the remaining budget only if at least this number of tokens can be kept
+MIN_TRUNCATED_CHUNK_TOKENS: int = 50
 
 
 class Prompter(RagtimeBase, ABC):
@@ -9,14 +15,72 @@ class Prompter(RagtimeBase, ABC):
     A Prompter is designed to generate prompts for Answers, Facts and Evals.
     It also contains a method to post-process text returned by an LLM, since post-processing is directly related to the prompt
     It must be provided to every LLM objects at creation time
+    max_prompt_tokens: max number of tokens of the prompts, the context window of the LLM being the limit anyway
+    - used by the prompters able to shorten their prompts, see `token_budget`
     """
     system:str = ""
     name:str = ""
-    
-    def __init__(self):
-        super().__init__()
+    max_prompt_tokens: Optional[int] = None
+
+    def __init__(self, **data):
+        super().__init__(**data)
         self.name = self.__class__.__name__
 
+    def token_budget(self) -> tuple[Optional[str], Optional[int]]:
+        """
+        Returns (model, max number of tokens) for the prompt being built for the current LLM
+        The budget is None if neither the model's context window nor `max_prompt_tokens` is known
+        """
+        model, max_output_tokens = prompt_target.get() or (None, None)
+        return model, prompt_token_budget(model, max_output_tokens, self.max_prompt_tokens)
+
+    def fit_chunks(self, chunks: list[str], scores: list[Optional[float]], fixed_texts: list[str],
+                   prompt: Prompt) -> list[str]:
+        """
+        Returns the chunks holding in the token budget of the prompt (see `token_budget`) once the rest of
+        the prompt, `fixed_texts`, is counted - the chunks unchanged if there is no budget
+        The budget decisions are stored in `prompt.meta["token_budget"]`
+        """
+        model, budget = self.token_budget()
+        if budget is None:
+            return chunks
+        fixed_tokens: int = sum(count_tokens(text, model) for text in fixed_texts)
+        kept, prompt.meta["token_budget"] = self._fit_chunks(chunks, scores, budget - fixed_tokens, model)
+        prompt.meta["token_budget"].update({"model": model, "budget": budget, "fixed_tokens": fixed_tokens})
+        return kept
+
+    @staticmethod
+    def _fit_chunks(chunks: list[str], scores: list[Optional[float]], budget: int,
+                    model: Optional[str]) -> tuple[list[str], dict]:
+        """
+        Keeps the chunks holding in `budget` tokens, the best scored first - the first chunk exceeding the
+        remaining budget is truncated and the next ones are dropped
+        Returns the chunks kept, in their original order, and the budget decisions
+        """
+        # chunks without a score keep their rank after the scored ones
+        order: list[int] = sorted(range(len(chunks)), key=lambda i: -scores[i] if scores[i] is not None else float("inf"))
+        kept: dict[int, str] = {}
+        dropped: list[int] = []
+        truncated: list[int] = []
+        remaining: int = budget
+        for i in order:
+            nb_tokens: int = count_tokens(chunks[i], model) + 1  # + the joint
+            if nb_tokens <= remaining:
+                kept[i] = chunks[i]
+                remaining -= nb_tokens
+            elif remaining >= MIN_TRUNCATED_CHUNK_TOKENS and not dropped:
+                kept[i] = truncate_to_tokens(chunks[i], remaining - 1, model)
+                truncated.append(i)
+                remaining = 0
+            else:
+                dropped.append(i)
+        decisions: dict = {"chunks_tokens": budget - remaining, "kept": sorted(kept),
+                           "truncated": truncated, "dropped": sorted(dropped)}
+        if truncated or dropped:
+            logger.debug(f"Prompt budget of {budget} tokens for the chunks: {len(truncated)} chunk(s) truncated, "
+                         f"{len(dropped)} dropped")
+        return [kept[i] for i in sorted(kept)], decisions
+
     @abstractmethod
     def get_prompt(self) -> Prompt:
         raise NotImplementedError("Must implement this!")
@@ -1,2 +1,8 @@
 from ragtime.retrievers.retriever import *
-from ragtime.retrievers.indexer import *
\ No newline at end of file
+from ragtime.retrievers.indexer import *
+from ragtime.retrievers.cached_retriever import *
+from ragtime.retrievers.bm25 import *
+from ragtime.retrievers.node_store import *
+from ragtime.retrievers.embeddings import *
+from ragtime.retrievers.ann import *
+from ragtime.retrievers.hybrid import *
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Approximate nearest neighbour search on an EmbeddingStore with an inverted file index (IVF), in NumPy.
+
+The embeddings are clustered with k-means into `nlist` lists. A query is only compared to the embeddings
+of the `nprobe` lists whose centroids are the closest to it: with `nprobe` = `nlist` the search is exact,
+lower values trade recall for speed - `benchmark_recall` measures both against the exact search.
+Like the BM25 postings, the lists are stored as compressed sparse rows, next to the embeddings.
+"""
+
+import hashlib
+import os
+import time
+from typing import Optional
+
+import numpy as np
+
+from ragtime.config import logger
+from ragtime.retrievers.embeddings import EmbeddingStore, normalize, top_k
+
+IVF_FILE: str = "ivf.npz"
+TRAIN_POINTS_PER_LIST: int = 64  # embeddings sampled per list to train the centroids
+ASSIGN_BLOCK_ROWS: int = 65536
+
+
+def default_nlist(nb: int) -> int:
+    """About the square root of the number of embeddings, the usual balance between the two steps of a search"""
+    return max(1, int(round(np.sqrt(nb))))
+
+
+def _signature(store: EmbeddingStore) -> str:
+    return hashlib.md5(("\n".join(store.node_ids) + "\n" + store.embedder_name).encode("utf-8")).hexdigest()
+
+
+def _assign(matrix: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Number of the closest centroid of every row, by blocks of rows"""
+    result: np.ndarray = np.zeros(len(matrix), dtype=np.int32)
+    for start in range(0, len(matrix), ASSIGN_BLOCK_ROWS):
+        block: np.ndarray = np.asarray(matrix[start:start + ASSIGN_BLOCK_ROWS], dtype=np.float32)
+        result[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return result
+
+
+def train_centroids(matrix: np.ndarray, nlist: int, iterations: int = 20, seed: int = 0) -> np.ndarray:
+    """Spherical k-means on a sample of the rows - returns `nlist` normalised centroids"""
+    rng: np.random.Generator = np.random.default_rng(seed)
+    nb_train: int = min(len(matrix), TRAIN_POINTS_PER_LIST * nlist)
+    sample: np.ndarray = np.asarray(matrix[np.sort(rng.choice(len(matrix), nb_train, replace=False))], dtype=np.float32)
+    centroids: np.ndarray = sample[rng.choice(nb_train, nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assignment: np.ndarray = np.argmax(sample @ centroids.T, axis=1)
+        sums: np.ndarray = np.zeros_like(centroids)
+        np.add.at(sums, assignment, sample)
+        empty: np.ndarray = np.bincount(assignment, minlength=nlist) == 0
+        sums[empty] = sample[rng.choice(nb_train, int(empty.sum()))]  # an empty list restarts from a random point
+        centroids = normalize(sums)
+    return centroids
+
+
+class IVFIndex:
+    """
+    Inverted lists of the rows of an EmbeddingStore - the rows of list `c` are `rows[offsets[c]:offsets[c + 1]]`
+    - nprobe: number of lists searched by default
+    """
+
+    def __init__(self, centroids: np.ndarray, offsets: np.ndarray, rows: np.ndarray, signature: str,
+                 embedder_name: str, nb_trained: int, nprobe: int = 8):
+        self.centroids: np.ndarray = centroids
+        self.offsets: np.ndarray = offsets
+        self.rows: np.ndarray = rows
+        self.signature: str = signature  # of the node ids and the embedder the lists have been made for
+        self.embedder_name: str = embedder_name
+        self.nb_trained: int = nb_trained  # number of embeddings when the centroids were trained
+        self.nprobe: int = nprobe
+
+    @property
+    def nlist(self) -> int:
+        return len(self.centroids)
+
+    @classmethod
+    def build(cls, store: EmbeddingStore, nlist: int = 0, centroids: Optional[np.ndarray] = None,
+              nb_trained: int = 0, nprobe: int = 8) -> "IVFIndex":
+        """
+        Assigns the rows of the store to the lists - the centroids are trained unless given
+        - nlist: number of lists, 0 for `default_nlist`
+        """
+        if centroids is None:
+            nlist = min(nlist or default_nlist(len(store)), len(store))
+            centroids = train_centroids(store.matrix, nlist) if nlist else np.zeros((0, store.matrix.shape[1]), np.float32)
+            nb_trained = len(store)
+        assignment: np.ndarray = _assign(store.matrix, centroids) if len(centroids) else np.zeros(0, np.int32)
+        offsets: np.ndarray = np.zeros(len(centroids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignment, minlength=len(centroids)), out=offsets[1:])
+        # stable, so the rows of a list are in increasing order and read sequentially from the matrix
+        rows: np.ndarray = np.argsort(assignment, kind="stable").astype(np.int32)
+        return cls(centroids=centroids, offsets=offsets, rows=rows, signature=_signature(store),
+                   embedder_name=store.embedder_name, nb_trained=nb_trained, nprobe=nprobe)
+
+    @classmethod
+    def load_or_build(cls, store: EmbeddingStore, nlist: int = 0, nprobe: int = 8) -> "IVFIndex":
+        """
+        Returns the index saved next to the store if it is up to date, builds and saves it otherwise
+        When the nodes change, the rows are assigned again to the saved centroids - they are trained again
+        only if the embedder or `nlist` changed or if the number of embeddings doubled since their training
+        """
+        index: Optional[IVFIndex] = cls.load(store.folder, nprobe=nprobe) if store.folder else None
+        b_same_lists: bool = index is not None and (not nlist or index.nlist == min(nlist, len(store)))
+        if b_same_lists and index.signature == _signature(store):
+            return index
+        if b_same_lists and index.embedder_name == store.embedder_name \
+                and index.centroids.shape[1] == store.matrix.shape[1] and len(store) <= 2 * index.nb_trained:
+            index = cls.build(store, centroids=index.centroids, nb_trained=index.nb_trained, nprobe=nprobe)
+        else:
+            index = cls.build(store, nlist=nlist, nprobe=nprobe)
+            logger.info(f"IVF index trained: {index.nlist} lists for {len(store)} embeddings")
+        if store.folder:
+            index.save(store.folder)
+        return index
+
+    def save(self, folder: str):
+        np.savez(os.path.join(folder, IVF_FILE), centroids=self.centroids, offsets=self.offsets, rows=self.rows,
+                 signature=np.array(self.signature), embedder_name=np.array(self.embedder_name),
+                 nb_trained=np.array(self.nb_trained))
+
+    @classmethod
+    def load(cls, folder: str, nprobe: int = 8) -> Optional["IVFIndex"]:
+        path: str = os.path.join(folder, IVF_FILE)
+        if not os.path.exists(path):
+            return None
+        with np.load(path, allow_pickle=False) as arrays:
+            return cls(centroids=arrays["centroids"], offsets=arrays["offsets"], rows=arrays["rows"],
+                       signature=str(arrays["signature"]), embedder_name=str(arrays["embedder_name"]),
+                       nb_trained=int(arrays["nb_trained"]), nprobe=nprobe)
+
+    def search(self, store: EmbeddingStore, queries: np.ndarray, k: int = 5,
+               nprobe: Optional[int] = None) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Same as `EmbeddingStore.search`, only looking at the rows of the `nprobe` closest lists
+        A query with less than `k` rows in its lists gets rows -1 with a score of -inf after them
+        """
+        queries = normalize(np.atleast_2d(queries))
+        result_rows: np.ndarray = np.full((len(queries), k), -1, dtype=np.int64)
+        result_scores: np.ndarray = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        if not self.nlist:
+            return result_rows, result_scores
+        probes, _ = top_k(queries @ self.centroids.T, nprobe or self.nprobe)
+        for num_query, query in enumerate(queries):
+            candidates: np.ndarray = np.sort(np.concatenate(
+                [self.rows[self.offsets[c]:self.offsets[c + 1]] for c in probes[num_query]]))
+            if not len(candidates):
+                continue
+            scores: np.ndarray = np.asarray(store.matrix[candidates], dtype=np.float32) @ query
+            columns, best_scores = top_k(scores[None, :], k)
+            result_rows[num_query, :columns.shape[1]] = candidates[columns[0]]
+            result_scores[num_query, :columns.shape[1]] = best_scores[0]
+        return result_rows, result_scores
+
+
+def benchmark_recall(store: EmbeddingStore, index: IVFIndex, queries: np.ndarray, k: int = 10,
+                     nprobes: tuple[int, ...] = (1, 2, 4, 8, 16, 32)) -> list[dict]:
+    """
+    Compares the IVF search to the exact search for several `nprobe`: returns, for each one, the recall@k
+    - the share of the exact k nearest rows which are found - and the time per query of both searches
+    """
+    start: float = time.perf_counter()
+    exact_rows, _ = store.search(queries, k=k)
+    exact_ms: float = (time.perf_counter() - start) * 1000 / len(queries)
+    result: list[dict] = []
+    for nprobe in nprobes:
+        if nprobe > index.nlist:
+            continue
+        start = time.perf_counter()
+        rows, _ = index.search(store, queries, k=k, nprobe=nprobe)
+        ann_ms: float = (time.perf_counter() - start) * 1000 / len(queries)
+        found: int = sum(len(set(exact) & set(approx)) for exact, approx in zip(exact_rows.tolist(), rows.tolist()))
+        recall: float = found / exact_rows.size if exact_rows.size else 1.0
+        result.append({"nprobe": nprobe, "recall": recall, "ms_per_query": ann_ms, "exact_ms_per_query": exact_ms})
+        logger.info(f"IVF nlist={index.nlist} nprobe={nprobe}: recall@{k}={recall:.3f}, "
+                    f"{ann_ms:.3f} ms/query vs {exact_ms:.3f} ms/query exact")
+    return result
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Lexical retrieval with BM25, fully local: no embedding model, no server, deterministic.
+
+The inverted index is stored as compressed sparse rows: the postings of term `t` are the slices
+`[indptr[t]:indptr[t + 1]]` of `doc_ids` (node numbers) and `tfs` (term frequencies), in NumPy arrays.
+A query only reads the postings of its terms and scores them with vectorized operations.
+The index is built from the nodes of an `Indexer` and saved next to them - see `Indexer.create_or_load_bm25`.
+"""
+
+import json
+import os
+import re
+import threading
+from collections import Counter
+from typing import Any, Optional
+
+import numpy as np
+from pydantic import PrivateAttr
+from unidecode import unidecode
+
+from ragtime.config import logger
+from ragtime.expe import QA
+from ragtime.retrievers.node_store import node_to_chunk
+from ragtime.retrievers.retriever import Retriever
+
+BM25_ARRAYS_FILE: str = "bm25.npz"
+BM25_VOCAB_FILE: str = "bm25_vocab.json"
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> list[str]:
+    """Lowercase words without accents - single characters are ignored"""
+    return [t for t in _TOKEN_RE.findall(unidecode(text or "").lower()) if len(t) > 1]
+
+
+class BM25Index:
+    """
+    BM25 inverted index over a list of texts, identified by their position
+    - k1: term frequency saturation
+    - b: length normalisation, 0 for none and 1 for full
+    """
+
+    def __init__(self, terms: list[str], indptr: np.ndarray, doc_ids: np.ndarray, tfs: np.ndarray,
+                 doc_lens: np.ndarray, node_ids: list[str], k1: float = 1.2, b: float = 0.75):
+        self.vocab: dict[str, int] = {t: i for i, t in enumerate(terms)}
+        self.terms: list[str] = terms
+        self.indptr: np.ndarray = indptr
+        self.doc_ids: np.ndarray = doc_ids
+        self.tfs: np.ndarray = tfs
+        self.doc_lens: np.ndarray = doc_lens
+        self.node_ids: list[str] = node_ids
+        self.k1: float = k1
+        self.b: float = b
+        nb_docs: int = len(doc_lens)
+        dfs: np.ndarray = np.diff(indptr)
+        self.idf: np.ndarray = np.log1p((nb_docs - dfs + 0.5) / (dfs + 0.5)).astype(np.float32)
+        avg_len: float = float(doc_lens.mean()) if nb_docs else 1.0
+        # per document denominator term of BM25, computed once
+        self._norm: np.ndarray = (k1 * (1 - b + b * doc_lens / max(avg_len, 1e-9))).astype(np.float32)
+
+    def __len__(self) -> int:
+        return len(self.doc_lens)
+
+    @classmethod
+    def build(cls, texts: list[str], node_ids: Optional[list[str]] = None, k1: float = 1.2, b: float = 0.75) -> "BM25Index":
+        vocab: dict[str, int] = {}
+        term_col: list[int] = []
+        doc_col: list[int] = []
+        tf_col: list[int] = []
+        doc_lens: list[int] = []
+        for num_doc, text in enumerate(texts):
+            tokens: list[str] = tokenize(text)
+            doc_lens.append(len(tokens))
+            for term, tf in Counter(tokens).items():
+                term_col.append(vocab.setdefault(term, len(vocab)))
+                doc_col.append(num_doc)
+                tf_col.append(tf)
+        term_arr: np.ndarray = np.asarray(term_col, dtype=np.int64)
+        order: np.ndarray = np.argsort(term_arr, kind="stable")  # postings sorted by term, then by document
+        indptr: np.ndarray = np.zeros(len(vocab) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_arr, minlength=len(vocab)), out=indptr[1:])
+        return cls(terms=list(vocab), indptr=indptr,
+                   doc_ids=np.asarray(doc_col, dtype=np.int32)[order],
+                   tfs=np.minimum(np.asarray(tf_col, dtype=np.int64)[order], np.iinfo(np.uint16).max).astype(np.uint16),
+                   doc_lens=np.asarray(doc_lens, dtype=np.int32),
+                   node_ids=node_ids if node_ids is not None else [str(i) for i in range(len(doc_lens))], k1=k1, b=b)
+
+    def save(self, folder: str):
+        os.makedirs(folder, exist_ok=True)
+        np.savez(os.path.join(folder, BM25_ARRAYS_FILE), indptr=self.indptr, doc_ids=self.doc_ids, tfs=self.tfs,
+                 doc_lens=self.doc_lens)
+        with open(os.path.join(folder, BM25_VOCAB_FILE), "w", encoding="utf-8") as f:
+            json.dump({"terms": self.terms, "node_ids": self.node_ids, "k1": self.k1, "b": self.b}, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, folder: str, k1: Optional[float] = None, b: Optional[float] = None) -> Optional["BM25Index"]:
+        """Returns the index saved in `folder`, None if there is none - `k1` and `b` replace the saved ones if given"""
+        arrays_path: str = os.path.join(folder, BM25_ARRAYS_FILE)
+        vocab_path: str = os.path.join(folder, BM25_VOCAB_FILE)
+        if not (os.path.exists(arrays_path) and os.path.exists(vocab_path)):
+            return None
+        with open(vocab_path, encoding="utf-8") as f:
+            vocab: dict[str, Any] = json.load(f)
+        with np.load(arrays_path, allow_pickle=False) as arrays:
+            return cls(terms=vocab["terms"], indptr=arrays["indptr"], doc_ids=arrays["doc_ids"], tfs=arrays["tfs"],
+                       doc_lens=arrays["doc_lens"], node_ids=vocab["node_ids"], k1=vocab["k1"] if k1 is None else k1,
+                       b=vocab["b"] if b is None else b)
+
+    def scores(self, query: str) -> np.ndarray:
+        """Returns the BM25 score of every document for the query"""
+        result: np.ndarray = np.zeros(len(self), dtype=np.float32)
+        for term, nb in Counter(tokenize(query)).items():
+            num_term: Optional[int] = self.vocab.get(term)
+            if num_term is None:
+                continue
+            start, end = self.indptr[num_term], self.indptr[num_term + 1]
+            docs: np.ndarray = self.doc_ids[start:end]
+            tfs: np.ndarray = self.tfs[start:end].astype(np.float32)
+            # a document appears once in the postings of a term, so the fancy indexed += is safe
+            result[docs] += nb * self.idf[num_term] * tfs * (self.k1 + 1) / (tfs + self._norm[docs])
+        return result
+
+    def search(self, query: str, k: int = 5) -> list[tuple[int, float]]:
+        """Returns the (document number, score) of the `k` best documents, best first - documents scoring 0 excluded"""
+        scores: np.ndarray = self.scores(query)
+        k = min(k, len(scores))
+        if k <= 0:
+            return []
+        best: np.ndarray = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best], kind="stable")]
+        return [(int(i), float(scores[i])) for i in best if scores[i] > 0]
+
+
+class BM25Retriever(Retriever):
+    """
+    Retrieves the best nodes of an Indexer's documents with BM25
+    The index is built at first use and saved next to the nodes, it is rebuilt when the nodes change
+    - dataset: the name of the Indexer, i.e. the folder of the dataset
+    - base_dir: the folder of the datasets
+    - top_k: max number of chunks per question
+    - k1, b: BM25 parameters
+    Chunks get the meta `score`, `node_id`, `display_name` (file name) and `page_number` (page label) if any
+    """
+
+    dataset: str
+    base_dir: str = ""
+    top_k: int = 5
+    k1: float = 1.2
+    b: float = 0.75
+    _index: Optional[BM25Index] = PrivateAttr(default=None)
+    _nodes: Any = PrivateAttr(default=None)  # the NodeStore
+    _documents: Optional[str] = PrivateAttr(default=None)  # hash of the documents, see `_cache_params`
+    # the index is loaded once even if `retrieve` runs in several threads
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+
+    def _indexer(self):
+        from ragtime.retrievers.indexer import Indexer  # the Indexer imports this module
+
+        return Indexer(self.dataset, **({"base_dir": self.base_dir} if self.base_dir else {}))
+
+    def _load(self):
+        with self._lock:
+            if self._index is None:
+                self._nodes, self._index = self._indexer().create_or_load_bm25(k1=self.k1, b=self.b)
+
+    def _cache_params(self) -> dict:
+        # the Chunks change once the documents are indexed again - hashed once, as the index is loaded once
+        if self._documents is None:
+            self._documents = self._indexer().generate_hash()
+        return {**super()._cache_params(), "documents": self._documents}
+
+    def retrieve(self, qa: QA):
+        self._load()
+        qa.chunks.empty()
+        for num_node, score in self._index.search(qa.question.text, k=self.top_k):
+            qa.chunks.append(node_to_chunk(self._nodes[num_node], score))
+        logger.debug(f"Retrieved {len(qa.chunks)} chunk(s) with BM25")
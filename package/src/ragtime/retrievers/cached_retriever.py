@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+
+from pathlib import Path
+from typing import Any, Optional, Union
+
+from pydantic import ConfigDict
+
+from ragtime.cache import CacheMode, DiskCache
+from ragtime.config import logger
+from ragtime.expe import QA, Chunk
+from ragtime.retrievers.retriever import Retriever
+
+
+class CachedRetriever(Retriever):
+    """
+    Puts a persistent cache in front of a Retriever: the Chunks of a question are reused as long as the
+    retriever, its configuration - the version of the documents for the local retrievers - the question text
+    and meta are the same - see `Retriever.cache_key`
+    The cache is a DiskCache, so it is shared by the runs and processes using the same file, and evicts
+    its least recently used entries beyond its max size
+    - retriever: the Retriever called on cache misses
+    - cache: a DiskCache, or the path of its file
+    - ttl: in seconds, cached Chunks older than this are retrieved again, e.g. since the documents may have changed - 0 for no limit
+    - cache_mode: read_write to reuse and store Chunks, read_only to reuse only, bypass to always call the retriever
+    Empty results are not stored, as they usually come from a failed retrieval
+    """
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    retriever: Retriever
+    cache: DiskCache
+    ttl: float = 24 * 3600
+    cache_mode: CacheMode = CacheMode.read_write
+
+    def __init__(self, retriever: Retriever, cache: Union[DiskCache, Path, str], **data: Any):
+        if isinstance(cache, (str, Path)):
+            cache = DiskCache(cache)
+        data.setdefault("batch_size", retriever.batch_size)
+        data.setdefault("batch_wait", retriever.batch_wait)
+        super().__init__(retriever=retriever, cache=cache, **data)
+
+    def _reuse(self, qa: QA) -> bool:
+        """Writes the cached Chunks in the QA if any, returns True if so"""
+        qa.chunks.meta.pop("cached", None)
+        if self.cache_mode == CacheMode.bypass:
+            return False
+        cached: Optional[list] = self.cache.get(self.retriever.cache_key(qa), max_age=self.ttl)
+        if not cached:
+            return False
+        logger.debug(f"Reuse {len(cached)} chunk(s) from the retrieval cache")
+        qa.chunks.empty()
+        for chunk in cached:
+            qa.chunks.append(Chunk(**chunk))
+        qa.chunks.meta["cached"] = True
+        return True
+
+    def _store(self, qa: QA):
+        if self.cache_mode == CacheMode.read_write and qa.chunks:
+            self.cache.set(self.retriever.cache_key(qa), [c.model_dump(mode="json") for c in qa.chunks])
+
+    def retrieve(self, qa: QA):
+        if not self._reuse(qa):
+            self.retriever.retrieve(qa=qa)
+            self._store(qa)
+
+    async def aretrieve(self, qa: QA):
+        if not self._reuse(qa):
+            await self.retriever.aretrieve(qa=qa)
+            self._store(qa)
+
+    async def retrieve_many(self, qas: list[QA]):
+        """Only the QAs which are not in the cache are sent to the retriever"""
+        missing: list[QA] = [qa for qa in qas if not self._reuse(qa)]
+        if missing:
+            await self.retriever.retrieve_many(missing)
+            for qa in missing:
+                self._store(qa)
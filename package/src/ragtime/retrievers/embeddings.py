@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+"""
+Dense retrieval on a local matrix of node embeddings.
+
+The embeddings of the nodes of an Indexer are the rows of a single `.npy` matrix, float32 or float16,
+L2-normalised and memory-mapped when loaded. Searching a batch of questions is one matrix product followed
+by an `argpartition`, so many questions are scored at once without any vector database.
+Embeddings come from an `Embedder`: subclass it to plug a local model, `HashEmbedder` needs no model at all.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import threading
+from abc import abstractmethod
+from typing import Any, Optional
+
+import numpy as np
+from pydantic import PrivateAttr
+
+from ragtime.base import RagtimeBase
+from ragtime.config import logger
+from ragtime.expe import QA
+from ragtime.retrievers.bm25 import tokenize
+from ragtime.retrievers.node_store import node_to_chunk
+from ragtime.retrievers.retriever import Retriever
+
+EMBEDDINGS_FILE: str = "embeddings.npy"
+EMBEDDINGS_META_FILE: str = "embeddings.json"
+SEARCH_BLOCK_ROWS: int = 65536  # rows of the matrix scored at once, bounds the memory used by a search
+
+
+class Embedder(RagtimeBase):
+    """
+    Turns texts into vectors of `dim` floats
+    The `embed` method must be implemented - its vectors do not need to be normalised
+    `name` identifies the model: embeddings made by another one are computed again
+    """
+
+    name: str
+    dim: int
+    batch_size: int = 64  # texts given at once to `embed` when indexing
+
+    @abstractmethod
+    def embed(self, texts: list[str]) -> np.ndarray:
+        raise NotImplementedError("Must implement this!")
+
+
+class HashEmbedder(Embedder):
+    """
+    Model-free embedder: each word is hashed into one of `dim` dimensions with a random sign
+    Texts sharing words get close vectors - a deterministic stub for tests and a baseline, not a semantic model
+    """
+
+    name: str = "hash"
+    dim: int = 256
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        result: np.ndarray = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for token in tokenize(text):
+                digest: int = int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "little")
+                result[row, digest % self.dim] += 1.0 if (digest >> 63) else -1.0
+        return result
+
+
+class SentenceTransformerEmbedder(Embedder):
+    """
+    Local model from the sentence-transformers library - `pip install sentence-transformers`
+    - name: the name of the model, e.g. "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+    """
+
+    dim: int = 0  # read from the model
+    _model: Any = PrivateAttr(default=None)
+
+    def model_post_init(self, __context: Any):
+        from sentence_transformers import SentenceTransformer
+
+        self._model = SentenceTransformer(self.name)
+        self.dim = self._model.get_sentence_embedding_dimension()
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        return np.asarray(self._model.encode(texts, batch_size=self.batch_size), dtype=np.float32)
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """Rows divided by their L2 norm, as float32 - null rows are kept null"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms: np.ndarray = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def top_k(scores: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+    """Returns the columns and values of the `k` best scores of every row, best first"""
+    k = min(k, scores.shape[1])
+    if k <= 0:
+        return np.zeros((len(scores), 0), dtype=np.int64), np.zeros((len(scores), 0), dtype=np.float32)
+    best: np.ndarray = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    best_scores: np.ndarray = np.take_along_axis(scores, best, axis=1)
+    order: np.ndarray = np.argsort(-best_scores, axis=1, kind="stable")
+    return np.take_along_axis(best, order, axis=1), np.take_along_axis(best_scores, order, axis=1)
+
+
+class EmbeddingStore:
+    """
+    Matrix of the normalised embeddings of nodes, row i being the node `node_ids[i]`, with the embedder used
+    Scores are cosine similarities
+    """
+
+    def __init__(self, matrix: np.ndarray, node_ids: list[str], embedder_name: str, folder: Optional[str] = None):
+        self.matrix: np.ndarray = matrix
+        self.node_ids: list[str] = node_ids
+        self.embedder_name: str = embedder_name
+        self.folder: Optional[str] = folder  # where the store is saved, None if it is only in memory
+
+    def __len__(self) -> int:
+        return len(self.node_ids)
+
+    @classmethod
+    def build(cls, folder: str, nodes, node_ids: list[str], embedder: Embedder, dtype: str = "float32",
+              previous: Optional["EmbeddingStore"] = None) -> "EmbeddingStore":
+        """
+        Embeds the nodes, e.g. a NodeStore, batch by batch directly into the matrix file, so only a batch is in memory
+        The rows of the nodes already in `previous`, made by the same embedder, are copied instead of being computed again
+        """
+        reusable: dict[str, int] = {}
+        if previous is not None and previous.embedder_name == embedder.name and previous.matrix.shape[1] == embedder.dim:
+            reusable = {node_id: row for row, node_id in enumerate(previous.node_ids)}
+        tmp_path: str = os.path.join(folder, EMBEDDINGS_FILE + ".tmp.npy")
+        matrix: np.ndarray = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.dtype(dtype),
+                                                       shape=(len(node_ids), embedder.dim))
+        to_embed: list[int] = []
+        for row, node_id in enumerate(node_ids):
+            if node_id in reusable:
+                matrix[row] = previous.matrix[reusable[node_id]]
+            else:
+                to_embed.append(row)
+        if previous is not None:
+            previous.close()  # its file is replaced below, which fails on Windows while it is memory-mapped
+        for start in range(0, len(to_embed), embedder.batch_size):
+            rows: list[int] = to_embed[start:start + embedder.batch_size]
+            matrix[rows] = normalize(embedder.embed([nodes[row].get_content() for row in rows]))
+        logger.info(f"Embeddings: {len(to_embed)} node(s) embedded with {embedder.name}, {len(node_ids) - len(to_embed)} reused")
+        matrix.flush()
+        del matrix
+        os.replace(tmp_path, os.path.join(folder, EMBEDDINGS_FILE))
+        with open(os.path.join(folder, EMBEDDINGS_META_FILE), "w", encoding="utf-8") as f:
+            json.dump({"embedder": embedder.name, "dtype": dtype, "node_ids": node_ids}, f)
+        return cls.load(folder)
+
+    @classmethod
+    def load(cls, folder: str) -> Optional["EmbeddingStore"]:
+        """Returns the store saved in `folder`, memory-mapped - None if there is none"""
+        meta_path: str = os.path.join(folder, EMBEDDINGS_META_FILE)
+        if not (os.path.exists(meta_path) and os.path.exists(os.path.join(folder, EMBEDDINGS_FILE))):
+            return None
+        with open(meta_path, encoding="utf-8") as f:
+            meta: dict[str, Any] = json.load(f)
+        matrix: np.ndarray = np.load(os.path.join(folder, EMBEDDINGS_FILE), mmap_mode="r") if meta["node_ids"] \
+            else np.load(os.path.join(folder, EMBEDDINGS_FILE))
+        return cls(matrix=matrix, node_ids=meta["node_ids"], embedder_name=meta["embedder"], folder=folder)
+
+    def close(self):
+        """Drops the memory map of the matrix - the store is empty afterwards"""
+        self.matrix = np.zeros((0, self.matrix.shape[1]), dtype=self.matrix.dtype)
+        self.node_ids = []
+
+    def search(self, queries: np.ndarray, k: int = 5) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the rows and the scores of the `k` nearest nodes of each query vector, best first
+        The matrix is scored by blocks of rows, so a float16 matrix is never converted as a whole
+        """
+        queries = normalize(np.atleast_2d(queries))
+        best_rows: np.ndarray = np.zeros((len(queries), 0), dtype=np.int64)
+        best_scores: np.ndarray = np.zeros((len(queries), 0), dtype=np.float32)
+        for start in range(0, len(self), SEARCH_BLOCK_ROWS):
+            block: np.ndarray = np.asarray(self.matrix[start:start + SEARCH_BLOCK_ROWS], dtype=np.float32)
+            rows, scores = top_k(queries @ block.T, k)
+            # merge with the best rows of the previous blocks
+            candidate_rows: np.ndarray = np.hstack([best_rows, rows + start])
+            columns, best_scores = top_k(np.hstack([best_scores, scores]), k)
+            best_rows = np.take_along_axis(candidate_rows, columns, axis=1)
+        return best_rows, best_scores
+
+
+class DenseRetriever(Retriever):
+    """
+    Retrieves the nodes of an Indexer's documents whose embeddings are the closest to the question's
+    The embeddings are computed at first use and saved next to the nodes - only those of new nodes are computed afterwards
+    Questions retrieved together by `retrieve_many` are embedded and scored in one batch, hence the default `batch_size`
+    - dataset: the name of the Indexer, i.e. the folder of the dataset
+    - base_dir: the folder of the datasets
+    - embedder: the Embedder of the nodes and questions
+    - dtype: "float32", or "float16" to halve the size of the matrix
+    - top_k: max number of chunks per question
+    - ann: True to search an approximate nearest neighbour index (`ann.IVFIndex`) instead of every embedding
+    - ann_lists: number of lists of the index, 0 for about the square root of the number of nodes
+    - ann_probes: number of lists searched per question - more for a better recall, less for a faster search
+    Chunks get the meta `score` (cosine similarity), `node_id`, `display_name` and `page_number`
+    """
+
+    dataset: str
+    base_dir: str = ""
+    embedder: Embedder
+    dtype: str = "float32"
+    top_k: int = 5
+    batch_size: int = 32
+    ann: bool = False
+    ann_lists: int = 0
+    ann_probes: int = 8
+    _store: Optional[EmbeddingStore] = PrivateAttr(default=None)
+    _ann_index: Any = PrivateAttr(default=None)  # the IVFIndex if `ann`
+    _nodes: Any = PrivateAttr(default=None)  # the NodeStore
+    _documents: Optional[str] = PrivateAttr(default=None)  # hash of the documents, see `_cache_params`
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+
+    def _indexer(self):
+        from ragtime.retrievers.indexer import Indexer  # the Indexer imports this module
+
+        return Indexer(self.dataset, **({"base_dir": self.base_dir} if self.base_dir else {}))
+
+    def _cache_params(self) -> dict:
+        # the Chunks change once the documents are indexed again - hashed once, as the store is loaded once
+        if self._documents is None:
+            self._documents = self._indexer().generate_hash()
+        return {**super()._cache_params(), "documents": self._documents}
+
+    def _load(self):
+        with self._lock:
+            if self._store is None:
+                indexer = self._indexer()
+                if self.ann:
+                    self._nodes, self._store, self._ann_index = indexer.create_or_load_ann(
+                        self.embedder, dtype=self.dtype, nlist=self.ann_lists, nprobe=self.ann_probes)
+                else:
+                    self._nodes, self._store = indexer.create_or_load_embeddings(self.embedder, dtype=self.dtype)
+
+    def _retrieve_batch(self, qas: list[QA]):
+        self._load()
+        queries: np.ndarray = self.embedder.embed([qa.question.text for qa in qas])
+        if self._ann_index is not None:
+            rows, scores = self._ann_index.search(self._store, queries, k=self.top_k)
+        else:
+            rows, scores = self._store.search(queries, k=self.top_k)
+        for qa, qa_rows, qa_scores in zip(qas, rows, scores):
+            qa.chunks.empty()
+            for row, score in zip(qa_rows, qa_scores):
+                if row >= 0:
+                    qa.chunks.append(node_to_chunk(self._nodes[int(row)], float(score)))
+        logger.debug(f"Retrieved the chunks of {len(qas)} question(s) with {self.embedder.name}")
+
+    def retrieve(self, qa: QA):
+        self._retrieve_batch([qa])
+
+    async def retrieve_many(self, qas: list[QA]):
+        await asyncio.to_thread(self._retrieve_batch, qas)
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+Hybrid retrieval: the BM25 and dense rankings of the nodes of an Indexer fused into one.
+
+Both searches run on the same NodeStore, concurrently, for a whole batch of questions. Each one returns
+`candidates` nodes per question and their rankings are fused by node id, with reciprocal rank fusion (RRF)
+- which only uses the ranks, so the BM25 and cosine scores never need to be comparable - or with a weighted
+sum of the scores, min-max normalised per question.
+"""
+
+import asyncio
+import threading
+import time
+from typing import Any, Literal, Optional
+
+from pydantic import PrivateAttr
+
+from ragtime.config import logger
+from ragtime.expe import QA, Chunk
+from ragtime.retrievers.bm25 import BM25Retriever
+from ragtime.retrievers.embeddings import DenseRetriever, Embedder
+from ragtime.retrievers.retriever import Retriever
+
+_COMPONENTS: tuple[str, ...] = ("bm25", "dense")
+
+
+def reciprocal_rank_fusion(rankings: dict[str, list[Chunk]], weights: dict[str, float],
+                           rrf_k: int = 60) -> dict[str, float]:
+    """
+    Fused score of every node id, the sum over the rankings of `weight / (rrf_k + rank)`, ranks starting at 1
+    - rrf_k: the larger, the less the first ranks weigh compared to the next ones
+    """
+    result: dict[str, float] = {}
+    for name, chunks in rankings.items():
+        for rank, chunk in enumerate(chunks, start=1):
+            node_id: str = chunk.meta["node_id"]
+            result[node_id] = result.get(node_id, 0.0) + weights.get(name, 1.0) / (rrf_k + rank)
+    return result
+
+
+def weighted_fusion(rankings: dict[str, list[Chunk]], weights: dict[str, float]) -> dict[str, float]:
+    """
+    Fused score of every node id, the weighted sum of its scores min-max normalised per ranking
+    A node missing from a ranking gets 0 for it
+    """
+    result: dict[str, float] = {}
+    for name, chunks in rankings.items():
+        if not chunks:
+            continue
+        scores: list[float] = [chunk.meta["score"] for chunk in chunks]
+        low, high = min(scores), max(scores)
+        for chunk, score in zip(chunks, scores):
+            normalised: float = (score - low) / (high - low) if high > low else 1.0
+            node_id: str = chunk.meta["node_id"]
+            result[node_id] = result.get(node_id, 0.0) + weights.get(name, 1.0) * normalised
+    return result
+
+
+class HybridRetriever(Retriever):
+    """
+    Retrieves the nodes of an Indexer's documents with both a BM25Retriever and a DenseRetriever and fuses their rankings
+    `retrieve_many` runs the two searches concurrently, each one for all the questions at once, hence the default `batch_size`
+    - dataset: the name of the Indexer, i.e. the folder of the dataset
+    - base_dir: the folder of the datasets
+    - embedder: the Embedder of the dense search
+    - dtype, ann, ann_lists, ann_probes: as in DenseRetriever
+    - k1, b: BM25 parameters
+    - top_k: max number of chunks per question after the fusion
+    - candidates: number of nodes returned by each search before the fusion
+    - fusion: "rrf" (reciprocal rank fusion) or "weighted" (weighted sum of the normalised scores)
+    - rrf_k: constant of the reciprocal rank fusion
+    - bm25_weight, dense_weight: weight of each ranking in the fusion
+    Chunks get the meta `score` (fused), `node_id`, `display_name`, `page_number` and, for each search which
+    returned them, `bm25_score` / `bm25_rank` and `dense_score` / `dense_rank`
+    `qa.chunks.meta["timing"]` gets the time in seconds of each search and of the fusion, for the batch of the QA
+    """
+
+    dataset: str
+    base_dir: str = ""
+    embedder: Embedder
+    dtype: str = "float32"
+    ann: bool = False
+    ann_lists: int = 0
+    ann_probes: int = 8
+    k1: float = 1.2
+    b: float = 0.75
+    top_k: int = 5
+    candidates: int = 50
+    fusion: Literal["rrf", "weighted"] = "rrf"
+    rrf_k: int = 60
+    bm25_weight: float = 1.0
+    dense_weight: float = 1.0
+    batch_size: int = 32
+    _bm25: Optional[BM25Retriever] = PrivateAttr(default=None)
+    _dense: Optional[DenseRetriever] = PrivateAttr(default=None)
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+
+    def model_post_init(self, __context: Any):
+        self._bm25 = BM25Retriever(dataset=self.dataset, base_dir=self.base_dir, top_k=self.candidates,
+                                   k1=self.k1, b=self.b)
+        self._dense = DenseRetriever(dataset=self.dataset, base_dir=self.base_dir, embedder=self.embedder,
+                                     dtype=self.dtype, top_k=self.candidates, ann=self.ann,
+                                     ann_lists=self.ann_lists, ann_probes=self.ann_probes)
+
+    def _load(self):
+        # one after the other, as both create the nodes of the Indexer if they do not exist yet
+        with self._lock:
+            self._bm25._load()
+            self._dense._load()
+
+    def _cache_params(self) -> dict:
+        # the Chunks change once the documents are indexed again, see BM25Retriever
+        return {**super()._cache_params(), "documents": self._bm25._cache_params()["documents"]}
+
+    def _search_bm25(self, qas: list[QA]) -> tuple[list[list[Chunk]], float]:
+        start: float = time.perf_counter()
+        result: list[list[Chunk]] = []
+        for qa in qas:
+            shadow: QA = QA(question=qa.question)
+            self._bm25.retrieve(shadow)
+            result.append(shadow.chunks.items)
+        return result, time.perf_counter() - start
+
+    def _search_dense(self, qas: list[QA]) -> tuple[list[list[Chunk]], float]:
+        start: float = time.perf_counter()
+        shadows: list[QA] = [QA(question=qa.question) for qa in qas]
+        self._dense._retrieve_batch(shadows)
+        return [shadow.chunks.items for shadow in shadows], time.perf_counter() - start
+
+    def _fuse(self, qas: list[QA], bm25: list[list[Chunk]], dense: list[list[Chunk]], timing: dict[str, float]):
+        start: float = time.perf_counter()
+        weights: dict[str, float] = {"bm25": self.bm25_weight, "dense": self.dense_weight}
+        for qa, bm25_chunks, dense_chunks in zip(qas, bm25, dense):
+            rankings: dict[str, list[Chunk]] = {"bm25": bm25_chunks, "dense": dense_chunks}
+            scores: dict[str, float] = reciprocal_rank_fusion(rankings, weights, rrf_k=self.rrf_k) \
+                if self.fusion == "rrf" else weighted_fusion(rankings, weights)
+            # node id -> its Chunk, with the score and rank given by each search
+            chunks: dict[str, Chunk] = {}
+            for name in _COMPONENTS:
+                for rank, chunk in enumerate(rankings[name], start=1):
+                    node_id: str = chunk.meta["node_id"]
+                    fused: Chunk = chunks.setdefault(node_id, Chunk(text=chunk.text, meta=dict(chunk.meta)))
+                    fused.meta[f"{name}_score"] = chunk.meta["score"]
+                    fused.meta[f"{name}_rank"] = rank
+            qa.chunks.empty()
+            for node_id in sorted(scores, key=lambda n: -scores[n])[:self.top_k]:
+                chunks[node_id].meta["score"] = scores[node_id]
+                qa.chunks.append(chunks[node_id])
+        timing["fusion"] = time.perf_counter() - start
+        for qa in qas:
+            qa.chunks.meta["timing"] = {**timing, "batch": len(qas)}
+        logger.debug(f"Retrieved the chunks of {len(qas)} question(s) with BM25 ({timing['bm25']:.3f}s) "
+                     f"and {self.embedder.name} ({timing['dense']:.3f}s), fused with {self.fusion}")
+
+    def retrieve(self, qa: QA):
+        """Runs the two searches one after the other - see `retrieve_many` to run them concurrently"""
+        self._load()
+        bm25, bm25_time = self._search_bm25([qa])
+        dense, dense_time = self._search_dense([qa])
+        self._fuse([qa], bm25, dense, {"bm25": bm25_time, "dense": dense_time})
+
+    async def aretrieve(self, qa: QA):
+        await self.retrieve_many([qa])
+
+    async def retrieve_many(self, qas: list[QA]):
+        await asyncio.to_thread(self._load)
+        (bm25, bm25_time), (dense, dense_time) = await asyncio.gather(
+            asyncio.to_thread(self._search_bm25, qas), asyncio.to_thread(self._search_dense, qas))
+        self._fuse(qas, bm25, dense, {"bm25": bm25_time, "dense": dense_time})
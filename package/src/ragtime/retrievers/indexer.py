@@ -1,10 +1,18 @@
 import os
 import hashlib
-import pickle
+import json
 import shutil
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
 from pathlib import Path
-from ragtime.config import DATASETS_FOLDER_NAME, DOCUMENTS_FOLDER_NAME
+import numpy as np
+from ragtime.config import DATASETS_FOLDER_NAME, DOCUMENTS_FOLDER_NAME, logger
 from ragtime.expe import Expe
+from ragtime.retrievers.ann import IVFIndex
+from ragtime.retrievers.bm25 import BM25Index
+from ragtime.retrievers.embeddings import EmbeddingStore
+from ragtime.retrievers.node_store import NodeStore, NodeStoreWriter
 from llama_index.core.node_parser import SentenceSplitter
 from llama_index.core import (
     VectorStoreIndex,
@@ -13,11 +21,28 @@ from llama_index.core import (
     load_index_from_storage,
 )
 
+MANIFEST_FILE_NAME = "manifest.json"
+CHUNK_SIZE = 2048  # in tokens, for the SentenceSplitter
+MIN_FILES_PER_PROCESS = 8  # below, starting a process costs more than it saves
+INDEX_BATCH_SIZE = 256  # nodes read from the NodeStore and added to a new vector index at a time
+
+
+def _split_file(file_path, recursive, chunk_size):
+    """Reads a file and splits it into nodes - a module function, so that it can run in a worker process"""
+    documents = SimpleDirectoryReader(
+        input_files=[file_path], exclude_hidden=False, recursive=recursive
+    ).load_data()
+    return SentenceSplitter(chunk_size=chunk_size).get_nodes_from_documents(documents)
+
 
 class Indexer:
-    def __init__(self, name, base_dir=DATASETS_FOLDER_NAME):
+    def __init__(self, name, base_dir=DATASETS_FOLDER_NAME, max_workers=None):
+        """
+        - max_workers: max number of processes reading and splitting the files - the number of CPUs by default
+        """
         self.name = name
         self.base_dir = base_dir
+        self.max_workers = max_workers or os.cpu_count() or 1
         self.storage_path = os.path.join(base_dir, name, "storage")
 
     def list_files(self):
@@ -28,36 +53,91 @@ class Indexer:
                     file_path = os.path.join(root, file)
                     if not file.startswith("."):
                         files_list.append(file_path)
-        if len(files_list) > 50:
-            raise Exception("La liste des fichiers dépasse la limite de 50 fichiers.")
         return files_list
 
-    def read_doc(self, recursive=True):
-        return SimpleDirectoryReader(
-            input_files=self.list_files(), exclude_hidden=False, recursive=recursive
-        ).load_data()
-
     def generate_hash(self):
-        files_list = self.list_files()
-        concatenated_names = "".join(
-            [os.path.basename(file_path) for file_path in files_list]
-        )
-        unique_hash = hashlib.md5(concatenated_names.encode()).hexdigest()
-        return unique_hash
-
-    def find_dir_with_hash(self, hash_value):
-        if not os.path.exists(self.storage_path):
+        """
+        Hash of the names and contents of the documents - changes as soon as a document is edited
+        Only the files whose size or modification time differ from the manifest of the nodes are read
+        """
+        return self.hash_entries(self.scan_files(self.list_files(), self.load_manifest()))
+
+    @staticmethod
+    def hash_entries(entries):
+        concatenated = "".join(f"{rel_path}:{entry['hash']}" for rel_path, entry in sorted(entries.items()))
+        return hashlib.md5(concatenated.encode()).hexdigest()
+
+    @staticmethod
+    def file_hash(file_path):
+        sha = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            for block in iter(lambda: f.read(2**20), b""):
+                sha.update(block)
+        return sha.hexdigest()
+
+    def scan_files(self, files_list, manifest=None):
+        """
+        Returns the manifest entries {path relative to the dataset folder: {hash, size, mtime, file_path}} of the files
+        A file whose size and modification time are those of its entry in `manifest` is not read again
+        """
+        dataset_dir = os.path.join(self.base_dir, self.name)
+        previous = manifest["files"] if manifest else {}
+        entries = {}
+        for file_path in files_list:
+            rel_path = os.path.relpath(file_path, dataset_dir)
+            stat = os.stat(file_path)
+            entry = previous.get(rel_path)
+            if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime_ns:
+                file_hash = entry["hash"]
+            else:
+                file_hash = self.file_hash(file_path)
+            entries[rel_path] = {"hash": file_hash, "size": stat.st_size, "mtime": stat.st_mtime_ns,
+                                 "file_path": file_path}
+        return entries
+
+    def manifest_path(self):
+        return os.path.join(self.storage_path, "nodes", MANIFEST_FILE_NAME)
+
+    def load_manifest(self):
+        """Returns the manifest of the saved nodes, None if there is none or if it was made with other settings"""
+        if not os.path.exists(self.manifest_path()):
+            return None
+        with open(self.manifest_path(), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("chunk_size") != CHUNK_SIZE:
             return None
-        for dir_name in os.listdir(self.storage_path):
-            dir_path = os.path.join(self.storage_path, dir_name)
-            if os.path.isdir(dir_path):
-                hash_file = os.path.join(dir_path, "hash.txt")
-                if os.path.exists(hash_file):
-                    with open(hash_file, "r") as f:
-                        existing_hash = f.read()
-                    if existing_hash == hash_value:
-                        return dir_path
-        return None
+        return manifest
+
+    def save_manifest(self, entries):
+        files = {rel_path: {k: v for k, v in entry.items() if k != "file_path"} for rel_path, entry in entries.items()}
+        with open(self.manifest_path(), "w", encoding="utf-8") as f:
+            json.dump({"chunk_size": CHUNK_SIZE, "files": files}, f, ensure_ascii=False, indent=1)
+
+    def split_file(self, file_path, recursive=True):
+        return _split_file(file_path, recursive, CHUNK_SIZE)
+
+    def iter_split_files(self, files_list, recursive=True):
+        """
+        Yields the nodes of each file, in the order of `files_list`
+        Files are read and split in a pool of `max_workers` processes when there are enough of them - at most
+        2 files per process are in flight, so only these documents are in memory whatever the number of files
+        """
+        nb_processes = min(self.max_workers, len(files_list) // MIN_FILES_PER_PROCESS)
+        if nb_processes <= 1:
+            for file_path in files_list:
+                yield self.split_file(file_path, recursive=recursive)
+            return
+        logger.info(f"Indexer {self.name}: split {len(files_list)} file(s) in {nb_processes} processes")
+        with ProcessPoolExecutor(max_workers=nb_processes) as executor:
+            in_flight = deque()
+            pending = iter(files_list)
+            for file_path in islice(pending, 2 * nb_processes):
+                in_flight.append(executor.submit(_split_file, file_path, recursive, CHUNK_SIZE))
+            while in_flight:
+                file_nodes = in_flight.popleft().result()
+                for file_path in islice(pending, 1):
+                    in_flight.append(executor.submit(_split_file, file_path, recursive, CHUNK_SIZE))
+                yield file_nodes
 
     def create_storage_directory(self, dir_index=True):
         storage_dir = os.path.join(self.storage_path)
@@ -99,58 +179,122 @@ class Indexer:
     def create_or_load_nodes(
         self, recursive=True, check_existance=True, create_index=True
     ):
-        new_hash = self.generate_hash()
-        existing_dir = self.find_dir_with_hash(new_hash)
+        """
+        Returns the NodeStore of the documents, a read-only sequence of their nodes, and their VectorStoreIndex
+        if `create_index` - None otherwise
+        The content hash of every file is kept in a manifest next to the nodes: only the files added or changed
+        since then are read and split again, the nodes of the other files are kept with their ids, and the nodes
+        of the changed and removed files are removed - from the index too
+        - check_existance: False to read and split all the files again
+        """
+        files_list = self.list_files()
+        manifest = self.load_manifest() if check_existance else None
+        nodes_dir = os.path.join(self.storage_path, "nodes")
+        if manifest is not None and NodeStore.exists(nodes_dir):
+            previous_store = NodeStore(nodes_dir)
+        else:
+            # full rebuild: no manifest or no node store (storage made by an older version), other settings or rebuild asked
+            if os.path.exists(self.storage_path):
+                shutil.rmtree(self.storage_path)
+            manifest, previous_store = None, None
+        main_dir, hash_dir, nodes_dir = self.create_storage_directory(dir_index=create_index)
 
-        if check_existance and existing_dir:
-            nodes_file = os.path.join(self.storage_path, "nodes", "nodes.pkl")
-            with open(nodes_file, "rb") as f:
-                nodes = pickle.load(f)
+        entries = self.scan_files(files_list, manifest)
+        previous_files = manifest["files"] if manifest else {}
+        reused = {}
+        for rel_path, entry in entries.items():
+            previous = previous_files.get(rel_path)
+            if previous and previous["hash"] == entry["hash"] and all(i in previous_store for i in previous["node_ids"]):
+                reused[rel_path] = previous["node_ids"]
+        to_split = [entry["file_path"] for rel_path, entry in entries.items() if rel_path not in reused]
+        reused_ids = {node_id for node_ids in reused.values() for node_id in node_ids}
+        removed_ids = [node_id for node_id in previous_store.ids if node_id not in reused_ids] if previous_store else []
 
-            if create_index:
-                index_file = os.path.join(
-                    self.storage_path, f"Index_storage_{self.name}"
-                )
-                if not os.path.exists(index_file):
-                    os.makedirs(index_file, exist_ok=True)
-                if os.path.exists(index_file) and not os.listdir(index_file):
-                    storage_context = StorageContext.from_defaults()
-                    storage_context.docstore.add_documents(nodes)
-                    index = VectorStoreIndex(nodes, storage_context=storage_context)
-                    index.storage_context.persist(persist_dir=index_file)
-                else:
-                    storage_context = StorageContext.from_defaults(
-                        persist_dir=index_file
-                    )
-                    index = load_index_from_storage(storage_context)
-                return nodes, index
-            else:
-                return nodes, None
+        # the nodes of the files split again are added to an existing vector index as each file is split
+        index = None
+        if create_index and os.listdir(main_dir):
+            index = load_index_from_storage(StorageContext.from_defaults(persist_dir=main_dir))
+        nb_new = 0
+        if to_split or removed_ids or manifest is None:
+            # the nodes are written file by file as soon as they are split - the records of the nodes kept are
+            # copied without being decoded - then the previous store is closed and the new one replaces it
+            split_nodes = self.iter_split_files(to_split, recursive=recursive)
+            with NodeStoreWriter(nodes_dir, replaces=previous_store) as writer:
+                for rel_path, entry in entries.items():
+                    if rel_path in reused:
+                        for node_id in reused[rel_path]:
+                            writer.append_record(node_id, previous_store.record(previous_store.position(node_id)))
+                        entry["node_ids"] = reused[rel_path]
+                    else:
+                        file_nodes = next(split_nodes)
+                        writer.append(file_nodes)
+                        entry["node_ids"] = [node.id_ for node in file_nodes]
+                        nb_new += len(file_nodes)
+                        if index is not None:
+                            self.add_to_index(index, file_nodes)
+            logger.info(f"Indexer {self.name}: {nb_new} new node(s), {len(removed_ids)} removed, {len(reused_ids)} kept")
+            self.save_manifest(entries)
+            self.save_hash(self.hash_entries(entries), hash_dir)
+            index_dir = os.path.join(self.storage_path, f"Index_storage_{self.name}")
+            if not create_index and os.path.exists(index_dir):
+                shutil.rmtree(index_dir)  # not updated here, so rebuilt when asked for
+        if previous_store:
+            previous_store.close()
+        nodes = NodeStore(nodes_dir)
 
-        if os.path.exists(self.storage_path):
-            shutil.rmtree(self.storage_path)
+        if not create_index:
+            return nodes, None
+        if index is None:
+            # a new index is filled from the NodeStore, a batch of nodes at a time
+            index = VectorStoreIndex([], storage_context=StorageContext.from_defaults())
+            for start in range(0, len(nodes), INDEX_BATCH_SIZE):
+                self.add_to_index(index, nodes[start:start + INDEX_BATCH_SIZE])
+        elif removed_ids:
+            index.delete_nodes(removed_ids, delete_from_docstore=True)
+        if removed_ids or nb_new or not os.listdir(main_dir):
+            index.storage_context.persist(persist_dir=main_dir)
+        return nodes, index
 
-        documents = self.read_doc(recursive=recursive)
-        splitter = SentenceSplitter(chunk_size=2048)
-        nodes = splitter.get_nodes_from_documents(documents)
+    @staticmethod
+    def add_to_index(index, nodes):
+        index.storage_context.docstore.add_documents(nodes)
+        index.insert_nodes(nodes)
 
-        main_dir, hash_dir, nodes_dir = self.create_storage_directory(
-            dir_index=create_index
-        )
+    def create_or_load_bm25(self, recursive=True, k1=1.2, b=0.75):
+        """
+        Returns the nodes and their BM25Index, saved next to the nodes
+        The index is rebuilt if the nodes have changed since it was saved
+        """
+        nodes, _ = self.create_or_load_nodes(recursive=recursive, create_index=False)
+        nodes_dir = os.path.join(self.storage_path, "nodes")
+        node_ids = nodes.ids
+        index = BM25Index.load(nodes_dir, k1=k1, b=b)
+        if index is None or index.node_ids != node_ids:
+            index = BM25Index.build([node.get_content() for node in nodes], node_ids=node_ids, k1=k1, b=b)
+            index.save(nodes_dir)
+        return nodes, index
 
-        self.save_hash(new_hash, hash_dir)
-        nodes_file = os.path.join(nodes_dir, "nodes.pkl")
-        with open(nodes_file, "wb") as f:
-            pickle.dump(nodes, f)
+    def create_or_load_embeddings(self, embedder, dtype="float32", recursive=True):
+        """
+        Returns the nodes and their EmbeddingStore, saved next to the nodes as a `.npy` matrix
+        Only the nodes which are new, or all of them if the embedder or the dtype changed, are embedded
+        """
+        nodes, _ = self.create_or_load_nodes(recursive=recursive, create_index=False)
+        nodes_dir = os.path.join(self.storage_path, "nodes")
+        store = EmbeddingStore.load(nodes_dir)
+        if store is None or store.node_ids != nodes.ids or store.embedder_name != embedder.name \
+                or store.matrix.shape[1] != embedder.dim or store.matrix.dtype != np.dtype(dtype):
+            store = EmbeddingStore.build(nodes_dir, nodes, nodes.ids, embedder, dtype=dtype, previous=store)
+        return nodes, store
 
-        if create_index:
-            storage_context = StorageContext.from_defaults()
-            storage_context.docstore.add_documents(nodes)
-            index = VectorStoreIndex(nodes, storage_context=storage_context)
-            index.storage_context.persist(persist_dir=main_dir)
-            return nodes, index
-        else:
-            return nodes, None
+    def create_or_load_ann(self, embedder, dtype="float32", nlist=0, nprobe=8, recursive=True):
+        """
+        Returns the nodes, their EmbeddingStore and its IVFIndex, saved next to the nodes
+        - nlist: number of lists of the index, 0 for about the square root of the number of nodes
+        - nprobe: number of lists searched by default
+        """
+        nodes, store = self.create_or_load_embeddings(embedder, dtype=dtype, recursive=recursive)
+        return nodes, store, IVFIndex.load_or_build(store, nlist=nlist, nprobe=nprobe)
 
 
 def annotation_human_auto(path: Path):
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+On-disk store of the nodes of an Indexer, read through memory maps.
+
+- `nodes-<generation>.bin`: the nodes one after the other, each one as a UTF-8 JSON record
+- `nodes-<generation>.idx.npy`: one fixed-width (offset, length) entry per node, giving the position of its record in the blob
+- `nodes-<generation>.ids.json`: the node ids, in the same order
+- `nodes.json`: the generation of the current files
+Opening a store only reads the ids: a node is decoded when it is accessed, so taking a few nodes of a large
+dataset, by position or by id, only reads these nodes. Unlike a pickle, reading a store runs no code.
+A new store is written as a new generation, published by replacing `nodes.json` only once its files are complete.
+"""
+
+import json
+import mmap
+import os
+import random
+import re
+from collections.abc import Sequence
+from typing import Iterable, Iterator, Optional, Union
+
+import numpy as np
+from llama_index.core.schema import BaseNode
+from llama_index.core.storage.docstore.utils import doc_to_json, json_to_doc
+
+from ragtime.config import logger
+from ragtime.expe import Chunk
+
+STORE_FILE: str = "nodes.json"
+_OFFSET_DTYPE = np.dtype([("offset", "<u8"), ("length", "<u4")])
+_GENERATION_FILE = re.compile(r"^nodes-(\d+)\.(bin|idx\.npy|ids\.json)$")
+
+
+def _generation(folder: str) -> Optional[int]:
+    """The generation of the current store in `folder`, None if there is none"""
+    try:
+        with open(os.path.join(folder, STORE_FILE), encoding="utf-8") as f:
+            return json.load(f)["generation"]
+    except FileNotFoundError:
+        return None
+
+
+def _files(folder: str, generation: int) -> tuple[str, str, str]:
+    """Paths of the blob, offsets and ids of a generation"""
+    return tuple(os.path.join(folder, f"nodes-{generation}.{ext}") for ext in ("bin", "idx.npy", "ids.json"))
+
+
+def node_to_chunk(node: BaseNode, score: float) -> Chunk:
+    """The Chunk of a retrieved node, with the meta used by the answer prompters"""
+    return Chunk(text=node.get_content(),
+                 meta={"score": score, "node_id": node.id_, "display_name": node.metadata.get("file_name", ""),
+                       "page_number": node.metadata.get("page_label", "")})
+
+
+class NodeStore(Sequence):
+    """Read-only sequence of the nodes saved in `folder` - see `NodeStoreWriter` to create one"""
+
+    def __init__(self, folder: str):
+        self.folder: str = folder
+        try:
+            self._open(_generation(folder))
+        except FileNotFoundError:
+            # a new generation has been published and the previous one removed since nodes.json was read
+            self._open(_generation(folder))
+
+    def _open(self, generation: Optional[int]):
+        if generation is None:
+            raise FileNotFoundError(f"No node store in {self.folder}")
+        blob_path, offsets_path, ids_path = _files(self.folder, generation)
+        with open(ids_path, encoding="utf-8") as f:
+            self.ids: list[str] = json.load(f)
+        self._positions: Optional[dict[str, int]] = None
+        self._offsets: np.ndarray = np.load(offsets_path, mmap_mode="r") if self.ids \
+            else np.zeros(0, dtype=_OFFSET_DTYPE)
+        self._file = open(blob_path, "rb")
+        # mmap does not accept empty files
+        self._blob: Union[mmap.mmap, bytes] = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) \
+            if os.path.getsize(blob_path) else b""
+
+    @staticmethod
+    def exists(folder: str) -> bool:
+        generation: Optional[int] = _generation(folder)
+        return generation is not None and all(os.path.exists(path) for path in _files(folder, generation))
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def record(self, position: int) -> bytes:
+        """The raw JSON record of a node, without decoding it"""
+        offset, length = self._offsets[position]
+        return self._blob[int(offset):int(offset) + int(length)]
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [self[i] for i in range(*position.indices(len(self)))]
+        if position < 0:
+            position += len(self)
+        if not 0 <= position < len(self):
+            raise IndexError(f"Node {position} out of range")
+        return json_to_doc(json.loads(self.record(position)))
+
+    def __iter__(self) -> Iterator[BaseNode]:
+        for position in range(len(self)):
+            yield self[position]
+
+    def position(self, node_id: str) -> Optional[int]:
+        if self._positions is None:
+            self._positions = {node_id: i for i, node_id in enumerate(self.ids)}
+        return self._positions.get(node_id)
+
+    def __contains__(self, node_id) -> bool:
+        return self.position(node_id) is not None
+
+    def get(self, node_id: str) -> Optional[BaseNode]:
+        """Returns the node with this id, None if there is none"""
+        position: Optional[int] = self.position(node_id)
+        return None if position is None else self[position]
+
+    def sample(self, nb: int, rng: Optional[random.Random] = None) -> list[BaseNode]:
+        """Returns `nb` nodes taken at random - only these nodes are read"""
+        positions: list[int] = (rng or random).sample(range(len(self)), min(nb, len(self)))
+        return [self[i] for i in positions]
+
+    def close(self):
+        if isinstance(self._blob, mmap.mmap):
+            self._blob.close()
+        self._file.close()
+
+
+class NodeStoreWriter:
+    """
+    Writes a NodeStore in `folder`, node by node, without keeping them in memory
+    The nodes are written as a new generation of files, published on `close` by replacing `nodes.json` - a single
+    rename - so a store being read, or left by a crash, is never seen half written
+    The files of the previous generations are removed once the new one is published
+    - replaces: the NodeStore currently open on `folder`, if any - records can be copied from it while writing,
+    it is closed on `close` before its files are removed, as an open memory map cannot be removed on Windows
+    """
+
+    def __init__(self, folder: str, replaces: Optional[NodeStore] = None):
+        self.folder: str = folder
+        self.replaces: Optional[NodeStore] = replaces
+        os.makedirs(folder, exist_ok=True)
+        self.generation: int = max([_generation(folder) or 0] + self._generations()) + 1
+        self.ids: list[str] = []
+        self._offsets: list[tuple[int, int]] = []
+        self._size: int = 0
+        self._blob = open(_files(folder, self.generation)[0], "wb")
+
+    def _generations(self) -> list[int]:
+        """The generations having files in the folder"""
+        return [int(match.group(1)) for match in map(_GENERATION_FILE.match, os.listdir(self.folder)) if match]
+
+    def append_record(self, node_id: str, record: bytes):
+        self._blob.write(record)
+        self._offsets.append((self._size, len(record)))
+        self.ids.append(node_id)
+        self._size += len(record)
+
+    def append(self, nodes: Iterable[BaseNode]):
+        for node in nodes:
+            self.append_record(node.id_, json.dumps(doc_to_json(node), ensure_ascii=False).encode("utf-8"))
+
+    def close(self):
+        self._blob.close()
+        _, offsets_path, ids_path = _files(self.folder, self.generation)
+        np.save(offsets_path, np.array(self._offsets, dtype=_OFFSET_DTYPE))
+        with open(ids_path, "w", encoding="utf-8") as f:
+            json.dump(self.ids, f)
+        tmp_path: str = os.path.join(self.folder, STORE_FILE + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"generation": self.generation}, f)
+        os.replace(tmp_path, os.path.join(self.folder, STORE_FILE))
+        if self.replaces:
+            self.replaces.close()
+        for generation in set(self._generations()) - {self.generation}:
+            self._remove(generation)
+
+    def _remove(self, generation: int):
+        for path in _files(self.folder, generation):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:  # still open by another reader on Windows - removed by the next writer
+                logger.debug(f"Node store file {path} not removed: {e}")
+
+    def __enter__(self) -> "NodeStoreWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._blob.close()
+            self._remove(self.generation)
@@ -1,20 +1,126 @@
 #!/usr/bin/env python3
 
+import asyncio
+import contextvars
+import weakref
 from abc import abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
 from ragtime.base import RagtimeBase
+from ragtime.cache import hash_key
+from ragtime.config import logger
 from ragtime.expe import QA
 
+RETRIEVER_THREADS: int = 8  # max number of synchronous `retrieve` calls running at the same time
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=RETRIEVER_THREADS, thread_name_prefix="ragtime_retriever")
+    return _executor
+
 
 class Retriever(RagtimeBase):
     """
     Retriever abstract class
     The `retrieve` method must be implemented
     The LLM must be given as a list of string from https://litellm.vercel.app/docs/providers
+    Retrievers doing I/O can also implement `aretrieve` not to use a thread, and `retrieve_many` to send the
+    queries of several QAs in a single request - set `batch_size` > 1 for the generators to group them
+    - batch_size: max number of QAs retrieved together by `retrieve_many` when the chunks are requested with `submit`
+    - batch_wait: max time in seconds a QA waits for others to fill its batch
     """
 
+    batch_size: int = 1
+    batch_wait: float = 0.01
+
     @abstractmethod
     def retrieve(self, qa: QA):
         """
         Retrurns the Chunks from a Question and writes them in the QA object
         """
         raise NotImplementedError("Must implement this!")
+
+    def _cache_params(self) -> dict:
+        """Parameters which, with the question, identify the Chunks of a QA in a cache - override to add yours, e.g. an index version"""
+        return {"class": self.__class__.__name__,
+                **self.model_dump(mode="json", exclude={"meta", "batch_size", "batch_wait"})}
+
+    def cache_key(self, qa: QA) -> str:
+        return hash_key({**self._cache_params(), "question": qa.question.text, "question_meta": qa.question.meta})
+
+    async def aretrieve(self, qa: QA):
+        """
+        Writes the Chunks of a QA without blocking the event loop
+        By default runs `retrieve` in a thread pool, so `retrieve` must not share state between calls unprotected
+        """
+        ctx: contextvars.Context = contextvars.copy_context()  # keeps the logger prefix of the QA
+        await asyncio.get_running_loop().run_in_executor(_get_executor(), ctx.run, self.retrieve, qa)
+
+    async def retrieve_many(self, qas: list[QA]):
+        """
+        Writes the Chunks of several QAs - by default calls `aretrieve` for each of them concurrently
+        Override it to send several queries per request
+        """
+        await asyncio.gather(*(self.aretrieve(qa) for qa in qas))
+
+    async def submit(self, qa: QA):
+        """
+        Writes the Chunks of a QA - if `batch_size` > 1, the QAs submitted at the same time are grouped
+        and retrieved together with `retrieve_many`
+        """
+        if self.batch_size <= 1:
+            await self.aretrieve(qa)
+            return
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        batchers: dict[int, _MicroBatcher] = _batchers.setdefault(loop, {})
+        batcher: Optional[_MicroBatcher] = batchers.get(id(self))
+        if batcher is None or batcher.retriever is not self:
+            batcher = batchers[id(self)] = _MicroBatcher(self)
+        await batcher.submit(qa)
+
+
+class _MicroBatcher:
+    """Groups the QAs submitted to a Retriever within `batch_wait` seconds, up to `batch_size`, into one `retrieve_many`"""
+
+    def __init__(self, retriever: Retriever):
+        self.retriever: Retriever = retriever
+        self._pending: list[tuple[QA, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    async def submit(self, qa: QA):
+        future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self._pending.append((qa, future))
+        if len(self._pending) >= self.retriever.batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.retriever.batch_wait, self._flush)
+        await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            asyncio.ensure_future(self._run(batch))
+
+    async def _run(self, batch: list[tuple[QA, asyncio.Future]]):
+        logger.debug(f"Retrieve the chunks of {len(batch)} QA(s) together")
+        try:
+            await self.retriever.retrieve_many([qa for qa, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for _, future in batch:
+            if not future.done():
+                future.set_result(None)
+
+
+# {event loop: {id of the Retriever: its batcher}} - futures and timers are bound to a loop
+_batchers: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict[int, _MicroBatcher]]" = weakref.WeakKeyDictionary()
@@ -0,0 +1,276 @@
+"""
+Bounded-concurrency scheduling of the generation work.
+
+A Scheduler feeds the QAs of an Expe to a fixed pool of workers through a queue, so
+at most `max_in_flight` QAs are processed at the same time, whatever the size of the Expe.
+Every LLM call made while a Scheduler runs goes through `llm_slot`, which enforces
+the global and per-LLM limits on the number of calls in flight, spaces out the calls
+to each LLM and records their latency.
+
+The Scheduler running in the current task is available with `current_scheduler()`, so
+the LLM layer can use it without being given it explicitly.
+"""
+
+import asyncio
+import time
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Iterable, Optional, Union
+
+from ragtime.base import RagtimeBase, div0
+from ragtime.cache import CacheMode, DiskCache
+from ragtime.config import logger
+
+if TYPE_CHECKING:
+    from ragtime.budget import Budget
+    from ragtime.journal import Journal
+    from ragtime.llms.batch import BatchRun
+
+
+def percentile(values: list[float], q: float) -> float:
+    """Returns the q-quantile (0 <= q <= 1) of a list of values, 0.0 if the list is empty"""
+    if not values:
+        return 0.0
+    values = sorted(values)
+    pos: float = q * (len(values) - 1)
+    low: int = int(pos)
+    high: int = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (pos - low)
+
+
+class SchedulerStats(RagtimeBase):
+    """Throughput and latency counters filled while a Scheduler runs"""
+
+    nb_items: int = 0
+    nb_done: int = 0
+    nb_failed: int = 0
+    nb_skipped: int = 0  # items not started since the budget of the run was spent
+    peak_in_flight: int = 0  # max number of items processed at the same time
+    duration: float = 0.0  # wall-clock time of the whole run in seconds
+    item_latencies: list[float] = []
+    llm_calls: dict[str, int] = {}
+    llm_latencies: dict[str, list[float]] = {}
+    cache_hits: int = 0  # LLM answers reused from the cache instead of calling the LLM
+    batch_answers: int = 0  # LLM answers taken from batch responses instead of calling the LLM
+
+    @property
+    def throughput(self) -> float:
+        """Number of items processed per second"""
+        return div0(self.nb_done + self.nb_failed, self.duration)
+
+    def latency(self, q: float = 0.5, llm_name: str = None) -> float:
+        """Returns the q-quantile of the latency of the items, or of the calls to `llm_name` if given"""
+        values: list[float] = self.llm_latencies.get(llm_name, []) if llm_name else self.item_latencies
+        return percentile(values, q)
+
+    def summary(self) -> dict:
+        """Returns the main counters as a dict, e.g. to be logged or stored in an Expe's meta"""
+        return {
+            "items": self.nb_items,
+            "done": self.nb_done,
+            "failed": self.nb_failed,
+            "skipped": self.nb_skipped,
+            "peak_in_flight": self.peak_in_flight,
+            "duration": round(self.duration, 3),
+            "throughput": round(self.throughput, 3),
+            "latency_p50": round(self.latency(0.5), 3),
+            "latency_p95": round(self.latency(0.95), 3),
+            "cache_hits": self.cache_hits,
+            "batch_answers": self.batch_answers,
+            "llms": {
+                name: {
+                    "calls": nb,
+                    "latency_p50": round(self.latency(0.5, name), 3),
+                    "latency_p95": round(self.latency(0.95, name), 3),
+                }
+                for name, nb in self.llm_calls.items()
+            },
+        }
+
+
+class Pacer:
+    """
+    Spaces out the start of successive calls by at least `interval` seconds.
+    Each call reserves the next free time slot and sleeps asynchronously until it,
+    so waiting never blocks the other tasks running on the event loop.
+    """
+
+    def __init__(self, interval: float = 0.0):
+        self.interval: float = interval
+        self._next_slot: float = 0.0
+
+    async def wait(self):
+        if self.interval <= 0:
+            return
+        now: float = time.monotonic()
+        slot: float = max(now, self._next_slot)
+        self._next_slot = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+_current_scheduler: ContextVar[Optional["Scheduler"]] = ContextVar("ragtime_scheduler", default=None)
+
+
+def current_scheduler() -> Optional["Scheduler"]:
+    """Returns the Scheduler running in the current task, None if there is none"""
+    return _current_scheduler.get()
+
+
+# number of the item (from 1) processed in the current task, e.g. to checkpoint its results
+current_item: ContextVar[Optional[int]] = ContextVar("ragtime_item", default=None)
+
+
+class Scheduler:
+    """
+    Runs a worker coroutine on a list of items with bounded concurrency.
+    - max_in_flight: max number of items processed at the same time, which is also the max number of
+    LLM calls in flight across all the LLMs - 0 means no limit
+    - max_in_flight_per_llm: max number of calls in flight for a single LLM, either a single value
+    for every LLM or a dict {llm name: limit} - 0 or missing means no limit
+    - min_interval: min time in seconds between the start of two calls to the same LLM, either a single
+    value for every LLM or a dict {llm name: interval} - 1 / min_interval is the max number of requests
+    per second sent to an LLM - 0 or missing means no pacing
+    - cache: the DiskCache where LLM answers are looked up before calling the LLMs - None for no cache
+    - cache_mode: how the cache is used during this run
+    - batch: the BatchRun collecting the LLM requests, or providing their responses, in batch mode - None otherwise
+    - journal: the Journal where the results are checkpointed - None for no journal
+    - budget: the Budget limiting the LLM calls of the run - once it is spent, no new item is started
+    """
+
+    def __init__(
+        self,
+        max_in_flight: int = 0,
+        max_in_flight_per_llm: Union[int, dict[str, int]] = 0,
+        min_interval: Union[float, dict[str, float]] = 0.0,
+        cache: Optional[DiskCache] = None,
+        cache_mode: CacheMode = CacheMode.read_write,
+        batch: Optional["BatchRun"] = None,
+        journal: Optional["Journal"] = None,
+        budget: Optional["Budget"] = None,
+    ):
+        self.max_in_flight: int = max_in_flight
+        self.max_in_flight_per_llm: Union[int, dict[str, int]] = max_in_flight_per_llm
+        self.min_interval: Union[float, dict[str, float]] = min_interval
+        self.cache: Optional[DiskCache] = cache if cache_mode != CacheMode.bypass else None
+        self.cache_mode: CacheMode = cache_mode
+        self.batch: Optional["BatchRun"] = batch
+        self.journal: Optional["Journal"] = journal
+        self.budget: Optional["Budget"] = budget
+        self.stats: SchedulerStats = SchedulerStats()
+        self._calls_sem: Optional[asyncio.Semaphore] = None
+        self._llm_sems: dict[str, asyncio.Semaphore] = {}
+        self._pacers: dict[str, Pacer] = {}
+        self._in_flight: int = 0
+
+    @staticmethod
+    def _per_llm(value: Union[float, dict[str, float]], llm_name: str) -> float:
+        if isinstance(value, dict):
+            return value.get(llm_name, 0)
+        return value or 0
+
+    def _llm_limit(self, llm_name: str) -> int:
+        return self._per_llm(self.max_in_flight_per_llm, llm_name)
+
+    def _pacer(self, llm_name: str) -> Pacer:
+        if llm_name not in self._pacers:
+            self._pacers[llm_name] = Pacer(self._per_llm(self.min_interval, llm_name))
+        return self._pacers[llm_name]
+
+    @asynccontextmanager
+    async def llm_slot(self, llm_name: str):
+        """Waits for a free slot to call `llm_name`, paces the call and records its duration"""
+        llm_sem: Optional[asyncio.Semaphore] = self._llm_sems.get(llm_name)
+        if llm_sem is None and self._llm_limit(llm_name):
+            llm_sem = self._llm_sems.setdefault(llm_name, asyncio.Semaphore(self._llm_limit(llm_name)))
+        if llm_sem:
+            await llm_sem.acquire()
+        if self._calls_sem:
+            await self._calls_sem.acquire()
+        start: float = time.perf_counter()
+        try:
+            await self._pacer(llm_name).wait()
+            start = time.perf_counter()
+            yield
+        finally:
+            self.stats.llm_calls[llm_name] = self.stats.llm_calls.get(llm_name, 0) + 1
+            self.stats.llm_latencies.setdefault(llm_name, []).append(time.perf_counter() - start)
+            if self._calls_sem:
+                self._calls_sem.release()
+            if llm_sem:
+                llm_sem.release()
+
+    def budget_spent(self) -> bool:
+        return bool(self.budget and self.budget.exceeded)
+
+    @contextmanager
+    def running(self, nb_items: int = 0):
+        """
+        Makes the Scheduler the current one, with fresh stats and limits, for the duration of the block.
+        Used by `run`, and by executors feeding their own workers, e.g. a Pipeline
+        """
+        self.stats = SchedulerStats(nb_items=nb_items)
+        self._calls_sem = asyncio.Semaphore(self.max_in_flight) if self.max_in_flight else None
+        self._llm_sems = {}
+        self._pacers = {}
+        self._in_flight = 0
+        token = _current_scheduler.set(self)
+        start: float = time.perf_counter()
+        try:
+            yield self.stats
+        finally:
+            self.stats.duration = time.perf_counter() - start
+            _current_scheduler.reset(token)
+
+    async def run(self, items: Iterable, worker: Callable[[int, Any], Awaitable]) -> SchedulerStats:
+        """
+        Calls `worker(num, item)` for each item, numbered from 1, with at most `max_in_flight` calls at the same time.
+        Items are fed to the workers through a queue as soon as a worker is free.
+        An exception raised by `worker` is counted as a failure and does not stop the run.
+        Once the budget, if any, is spent the remaining items are skipped.
+        """
+        items = list(items)
+        queue: asyncio.Queue = asyncio.Queue()
+        for num, item in enumerate(items, start=1):
+            queue.put_nowait((num, item))
+        nb_workers: int = min(self.max_in_flight, len(items)) if self.max_in_flight else len(items)
+
+        async def _worker():
+            while True:
+                try:
+                    num, item = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                if self.budget_spent():
+                    self.stats.nb_skipped += 1
+                    queue.task_done()
+                    continue
+                self._in_flight += 1
+                self.stats.peak_in_flight = max(self.stats.peak_in_flight, self._in_flight)
+                current_item.set(num)
+                start: float = time.perf_counter()
+                try:
+                    await worker(num, item)
+                    self.stats.nb_done += 1
+                except Exception as e:
+                    self.stats.nb_failed += 1
+                    logger.debug(f"Item {num} failed: {e}")
+                finally:
+                    self.stats.item_latencies.append(time.perf_counter() - start)
+                    self._in_flight -= 1
+                    queue.task_done()
+
+        with self.running(len(items)):
+            await asyncio.gather(*(_worker() for _ in range(nb_workers)))
+        return self.stats
+
+
+@asynccontextmanager
+async def llm_slot(llm_name: str):
+    """Waits for a free slot in the current Scheduler, if any, to call `llm_name`"""
+    scheduler: Optional[Scheduler] = current_scheduler()
+    if scheduler:
+        async with scheduler.llm_slot(llm_name):
+            yield
+    else:
+        yield
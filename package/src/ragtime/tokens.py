@@ -0,0 +1,90 @@
+"""
+Token counting and prompt budgets.
+
+Texts are counted with the tokenizer of the model when LiteLLM knows it (tiktoken for OpenAI models,
+the Hugging Face tokenizers it bundles for the others), with the fast approximation of `estimate_tokens`
+otherwise. The context window of a model comes from `register_context_window` if it has been registered,
+from LiteLLM's model catalog (`litellm.model_cost`) otherwise.
+
+The budget of a prompt is the context window of the model minus the tokens reserved for its answer,
+possibly capped by the prompter's `max_prompt_tokens` - see `AnsPrompterWithRetrieverFR.get_prompt` which
+fits its chunks in it.
+"""
+
+import threading
+from contextvars import ContextVar
+from typing import Optional
+
+import litellm
+
+from ragtime.config import logger
+
+# (model, max number of tokens of the answer) of the LLM whose prompt is being built, set by `LLM.generate`
+# so that a prompter shared by several LLMs knows the one it works for
+prompt_target: ContextVar[Optional[tuple[str, int]]] = ContextVar("prompt_target", default=None)
+
+_registered_windows: dict[str, int] = {}
+_no_tokenizer: set[str] = set()  # models for which LiteLLM failed to count - not tried again
+_lock: threading.Lock = threading.Lock()
+
+
+def estimate_tokens(text: str) -> int:
+    """Fast approximation of the number of tokens in a text - 1 token is about 4 characters"""
+    return len(text or "") // 4 + 1
+
+
+def count_tokens(text: str, model: Optional[str] = None) -> int:
+    """Returns the number of tokens of a text with the tokenizer of `model`, an approximation if it is unknown"""
+    if not text:
+        return 0
+    if model and model not in _no_tokenizer:
+        try:
+            return litellm.token_counter(model=model, text=text)
+        except Exception as e:
+            logger.debug(f'No tokenizer for "{model}", tokens will be approximated: {e}')
+            with _lock:
+                _no_tokenizer.add(model)
+    return estimate_tokens(text)
+
+
+def register_context_window(model: str, nb_tokens: int):
+    """Sets the context window of a model, e.g. a model served by a private endpoint - takes precedence over the catalog"""
+    with _lock:
+        _registered_windows[model] = nb_tokens
+
+
+def context_window(model: str) -> Optional[int]:
+    """Returns the max number of input tokens of a model, None if unknown"""
+    if model in _registered_windows:
+        return _registered_windows[model]
+    bare: str = model.split("/", 1)[1] if "/" in model else model
+    entry: dict = litellm.model_cost.get(model) or litellm.model_cost.get(bare) or {}
+    if not entry:
+        # same model served by another provider, e.g. "openai/Mistral-7B-Instruct-v0.3" on an OVH endpoint
+        entry = next((v for k, v in litellm.model_cost.items() if k.endswith(f"/{bare}")), {})
+    return entry.get("max_input_tokens") or entry.get("max_tokens")
+
+
+def prompt_token_budget(model: Optional[str], max_output_tokens: Optional[int] = None,
+                        max_prompt_tokens: Optional[int] = None) -> Optional[int]:
+    """
+    Returns the max number of tokens of a prompt, None if there is no known limit
+    - model: name of the model, its context window is the limit
+    - max_output_tokens: tokens reserved for the answer in the context window
+    - max_prompt_tokens: explicit budget, used if lower than the limit of the model
+    """
+    window: Optional[int] = context_window(model) if model else None
+    limit: Optional[int] = max(window - (max_output_tokens or 0), 0) if window else None
+    if max_prompt_tokens:
+        return min(limit, max_prompt_tokens) if limit is not None else max_prompt_tokens
+    return limit
+
+
+def truncate_to_tokens(text: str, nb_tokens: int, model: Optional[str] = None) -> str:
+    """Returns the beginning of `text` holding in `nb_tokens` tokens"""
+    nb_text_tokens: int = count_tokens(text, model)
+    while text and nb_text_tokens > nb_tokens:
+        # tokens are roughly proportional to characters - shrink a bit more than needed to converge quickly
+        text = text[: int(len(text) * nb_tokens / nb_text_tokens * 0.95)]
+        nb_text_tokens = count_tokens(text, model)
+    return text
@@ -0,0 +1,112 @@
+"""Tests for the Albert classes of the repository root (classes.py): cache of the collections and batched search.
+
+No network / API keys required (acall_api is monkeypatched).
+"""
+import asyncio
+import os
+import sys
+import warnings
+
+warnings.filterwarnings("ignore")
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+import classes  # noqa: E402
+from ragtime.expe import QA, Question  # noqa: E402
+
+listings = []
+
+
+async def fetch():
+    listings.append(1)
+    await asyncio.sleep(0.01)
+    return [{"id": f"c{len(listings)}", "model": "BAAI/bge-m3"}]
+
+
+def test_collections_are_cached_until_their_ttl():
+    async def scenario():
+        cache = classes._CollectionsCache(ttl=0.05)
+        assert await cache.get(fetch) == [{"id": "c1", "model": "BAAI/bge-m3"}]
+        assert (await cache.get(fetch))[0]["id"] == "c1" and len(listings) == 1
+        await asyncio.sleep(0.06)
+        # expired: the previous list is returned while it is listed again in the background
+        assert (await cache.get(fetch))[0]["id"] == "c1"
+        await asyncio.sleep(0.03)
+        assert (await cache.get(fetch))[0]["id"] == "c2" and len(listings) == 2
+
+    listings.clear()
+    asyncio.new_event_loop().run_until_complete(scenario())
+
+
+def test_concurrent_first_load_lists_once_and_shares_its_failure():
+    async def failing():
+        listings.append(1)
+        await asyncio.sleep(0.01)
+        raise ConnectionError("Albert is down")
+
+    async def scenario():
+        cache = classes._CollectionsCache(ttl=60)
+        results = await asyncio.gather(*(cache.get(failing) for _ in range(5)), return_exceptions=True)
+        assert len(listings) == 1 and all(isinstance(r, ConnectionError) for r in results)
+        # the failed listing is not kept: the next call lists them again
+        results = await asyncio.gather(*(cache.get(fetch) for _ in range(5)))
+        assert len(listings) == 2 and all(r == results[0] for r in results)
+
+    listings.clear()
+    asyncio.new_event_loop().run_until_complete(scenario())
+
+
+class _Response:
+    def __init__(self, data):
+        self.data = data
+
+    def json(self):
+        return {"data": self.data}
+
+
+def test_albert_retriever_searches_a_batch_concurrently_with_one_listing(monkeypatch):
+    requests_sent = []
+    in_flight = [0, 0]  # current, max
+
+    async def fake_acall_api(method, url, headers=None, json=None, **kwargs):
+        requests_sent.append((url.rsplit("/", 1)[-1], json and json["prompt"]))
+        if url.endswith("/collections"):
+            return _Response([{"id": "bge", "model": "BAAI/bge-m3"}, {"id": "other", "model": "e5"}])
+        in_flight[0] += 1
+        in_flight[1] = max(in_flight)
+        await asyncio.sleep(0.01)
+        in_flight[0] -= 1
+        assert json["collections"] == ["bge"]
+        return _Response([{"score": 0.8, "chunk": {"content": f"about {json['prompt']}",
+                                                   "metadata": {"document_name": "doc.pdf", "document_id": 1}}}])
+
+    monkeypatch.setattr(classes, "acall_api", fake_acall_api)
+    monkeypatch.setattr(classes, "ALBERT_SEARCH_CONCURRENCY", 3)
+    classes._collections_caches.clear()
+    retriever = classes.AlbertRetriever(api_key="key", top_k=2)
+    qas = [QA(question=Question(text=f"q{i}")) for i in range(10)]
+    asyncio.new_event_loop().run_until_complete(retriever.retrieve_many(qas))
+
+    assert [r for r in requests_sent if r[0] == "collections"] == [("collections", None)]
+    assert sorted(r[1] for r in requests_sent if r[0] == "search") == sorted(f"q{i}" for i in range(10))
+    assert in_flight[1] == 3
+    assert [(qa.chunks[0].text, qa.chunks[0].meta["display_name"]) for qa in qas] == \
+        [(f"about q{i}", "doc.pdf") for i in range(10)]
+
+
+def test_sync_retrieve_closes_the_pooled_client_of_its_loop(monkeypatch):
+    from ragtime.http_client import get_async_client
+
+    clients = []
+
+    async def fake_acall_api(method, url, headers=None, json=None, **kwargs):
+        clients.append(get_async_client())
+        if url.endswith("/collections"):
+            return _Response([{"id": "bge", "model": "BAAI/bge-m3"}])
+        return _Response([])
+
+    monkeypatch.setattr(classes, "acall_api", fake_acall_api)
+    classes._collections_caches.clear()
+    classes.AlbertRetriever(api_key="key", top_k=2).retrieve(QA(question=Question(text="q")))
+    assert clients and all(client.is_closed for client in clients)
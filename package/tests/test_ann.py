@@ -0,0 +1,61 @@
+"""Tests for the IVF approximate nearest neighbour index and its recall benchmark.
+
+No network / API keys required (random embeddings, HashEmbedder).
+"""
+import os
+import warnings
+
+warnings.filterwarnings("ignore")
+
+import numpy as np
+
+from ragtime.expe import QA, Question
+from ragtime.retrievers import DenseRetriever, EmbeddingStore, HashEmbedder, IVFIndex, benchmark_recall
+
+
+def _clustered_store(tmp_path, nb: int = 3000, dim: int = 32, nb_clusters: int = 40) -> EmbeddingStore:
+    rng = np.random.default_rng(1)
+    centers = rng.normal(size=(nb_clusters, dim))
+    matrix = centers[rng.integers(nb_clusters, size=nb)] + 0.3 * rng.normal(size=(nb, dim))
+    matrix = (matrix / np.linalg.norm(matrix, axis=1, keepdims=True)).astype(np.float32)
+    np.save(tmp_path / "embeddings.npy", matrix)
+    return EmbeddingStore(np.load(tmp_path / "embeddings.npy", mmap_mode="r"), [str(i) for i in range(nb)], "test",
+                          folder=str(tmp_path))
+
+
+def test_recall_grows_with_nprobe_and_is_exact_when_all_lists_are_searched(tmp_path):
+    store = _clustered_store(tmp_path)
+    index = IVFIndex.build(store, nlist=50)
+    assert index.nlist == 50 and sorted(index.rows.tolist()) == list(range(len(store)))
+    queries = np.asarray(store.matrix[:100]) + 0.05 * np.random.default_rng(2).normal(size=(100, 32))
+    results = benchmark_recall(store, index, queries, k=10, nprobes=(1, 4, 16, 50))
+    recalls = [r["recall"] for r in results]
+    assert recalls == sorted(recalls) and recalls[-1] == 1.0 and recalls[2] > 0.9
+    exact_rows, exact_scores = store.search(queries, k=10)
+    rows, scores = index.search(store, queries, k=10, nprobe=50)
+    assert (rows == exact_rows).all() and np.allclose(scores, exact_scores, atol=1e-5)
+
+
+def test_index_is_saved_and_centroids_are_reused_when_nodes_change(tmp_path):
+    store = _clustered_store(tmp_path, nb=500)
+    index = IVFIndex.load_or_build(store, nlist=10)
+    assert os.path.exists(tmp_path / "ivf.npz")
+    assert IVFIndex.load_or_build(store, nlist=10).signature == index.signature
+
+    grown = EmbeddingStore(np.vstack([store.matrix, store.matrix[:50]]), store.node_ids + [f"new{i}" for i in range(50)],
+                           "test", folder=str(tmp_path))
+    updated = IVFIndex.load_or_build(grown, nlist=10)
+    assert (updated.centroids == index.centroids).all() and len(updated.rows) == 550
+    assert updated.signature != index.signature
+
+
+def test_dense_retriever_with_ann(tmp_path):
+    docs = tmp_path / "corpus" / "documents"
+    docs.mkdir(parents=True)
+    for i, text in enumerate(["Les chats dorment.", "Les chiens courent.", "Les impôts en ligne.", "Le train part."]):
+        (docs / f"doc{i}.txt").write_text(text, encoding="utf-8")
+    retriever = DenseRetriever(dataset="corpus", base_dir=str(tmp_path), embedder=HashEmbedder(), top_k=1,
+                               ann=True, ann_lists=2, ann_probes=2)
+    qa = QA(question=Question(text="Quand part le train ?"))
+    retriever.retrieve(qa)
+    assert qa.chunks[0].meta["display_name"] == "doc3.txt"
@@ -0,0 +1,130 @@
+"""Tests for the batch execution mode, against a local stub of the OpenAI files / batches API.
+
+No network / API keys required: the stub answers each request of the uploaded JSONL file,
+and acompletion is monkeypatched to record the calls sent live.
+"""
+import json
+import threading
+import warnings
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+warnings.filterwarnings("ignore")
+
+import ragtime.llms.llm as llmmod
+from ragtime.expe import Expe, QA, Question
+from ragtime.generators import AnsGenerator
+from ragtime.llms import LiteLLM
+from ragtime.llms.batch import BatchClient
+from ragtime.prompters.answer_prompters import AnsPrompterBase
+
+live_calls = []
+
+
+async def fake(**kw):
+    live_calls.append(kw["messages"][1]["content"])
+    return {"model": kw["model"], "choices": [{"message": {"content": f"live {kw['messages'][1]['content']}"}}]}
+
+
+class _StubBatchAPI(BaseHTTPRequestHandler):
+    files: dict = {}
+    batches: dict = {}
+    bodies: list = []
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, payload, raw: bool = False):
+        data: bytes = payload.encode() if raw else json.dumps(payload).encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        body: bytes = self.rfile.read(int(self.headers["Content-Length"]))
+        if self.path == "/files":
+            # multipart upload: keep the JSONL lines of the file part
+            lines = [l for l in body.decode().splitlines() if l.startswith("{")]
+            file_id = f"file-{len(self.files)}"
+            self.files[file_id] = lines
+            self._send({"id": file_id})
+        elif self.path == "/batches":
+            request = json.loads(body)
+            batch_id = f"batch-{len(self.batches)}"
+            out, err = [], []
+            for line in self.files[request["input_file_id"]]:
+                req = json.loads(line)
+                self.bodies.append(req["body"])
+                user = req["body"]["messages"][1]["content"]
+                if "fail" in user:
+                    err.append(json.dumps({"custom_id": req["custom_id"], "error": {"message": "boom"}}))
+                    continue
+                completion = {"id": "c", "object": "chat.completion", "created": 0, "model": req["body"]["model"],
+                              "choices": [{"index": 0, "finish_reason": "stop",
+                                           "message": {"role": "assistant", "content": f"batch {user}"}}]}
+                out.append(json.dumps({"custom_id": req["custom_id"],
+                                       "response": {"status_code": 200, "body": completion}}))
+            self.files[f"{batch_id}-out"] = out
+            self.files[f"{batch_id}-err"] = err
+            # the batch is completed at the second status check
+            self.batches[batch_id] = {"id": batch_id, "status": "in_progress", "output_file_id": f"{batch_id}-out",
+                                      "error_file_id": f"{batch_id}-err" if err else None}
+            self._send({"id": batch_id, "status": "validating"})
+
+    def do_GET(self):
+        parts = self.path.strip("/").split("/")
+        if parts[0] == "batches":
+            batch = dict(self.batches[parts[1]])
+            self.batches[parts[1]]["status"] = "completed"
+            self._send(batch)
+        elif parts[0] == "files":
+            self._send("\n".join(self.files[parts[1]]), raw=True)
+
+
+def _client() -> BatchClient:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _StubBatchAPI)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return BatchClient(api_base=f"http://127.0.0.1:{server.server_port}", api_key="k", poll_interval=0.01)
+
+
+def _expe(*questions) -> Expe:
+    expe = Expe()
+    for q in questions:
+        expe.append(QA(question=Question(text=q)))
+    return expe
+
+
+def test_answers_come_from_the_batch():
+    llmmod.acompletion = fake
+    llmmod.completion_cost = lambda a: 1.0
+    live_calls.clear()
+    _StubBatchAPI.bodies.clear()
+    expe = _expe("q1", "q2", "q3")
+    gen = AnsGenerator(llms=[LiteLLM(name="openai/gpt-4o-mini", prompter=AnsPrompterBase(),
+                                     extra_params={"api_key": "secret"})])
+    gen.generate(expe, batch=_client())
+    assert live_calls == []
+    assert [qa.answers[0].llm_answer.text for qa in expe] == ["batch q1", "batch q2", "batch q3"]
+    assert all(qa.answers[0].llm_answer.meta["batch"] and qa.answers[0].llm_answer.cost == 0.5 for qa in expe)
+    assert gen.stats.batch_answers == 3
+    # the provider prefix and the LLM's own credentials are not sent in the batch
+    assert {b["model"] for b in _StubBatchAPI.bodies} == {"gpt-4o-mini"}
+    assert all("api_key" not in b for b in _StubBatchAPI.bodies)
+
+
+def test_failed_requests_and_other_llms_are_called_live():
+    llmmod.acompletion = fake
+    llmmod.completion_cost = lambda a: 0.0
+    live_calls.clear()
+    _StubBatchAPI.bodies.clear()
+    expe = _expe("q1", "fail")
+    gen = AnsGenerator(llms=[LiteLLM(name="a", prompter=AnsPrompterBase()),
+                             LiteLLM(name="b", prompter=AnsPrompterBase())])
+    client = _client()
+    client.models = ["a"]
+    gen.generate(expe, batch=client)
+    assert sorted(live_calls) == ["fail", "fail", "q1"]
+    # the failed request is not submitted again in the next rounds
+    assert [b["messages"][1]["content"] for b in _StubBatchAPI.bodies].count("fail") == 1
+    assert [a.llm_answer.text for a in expe[0].answers] == ["batch q1", "live q1"]
+    assert [a.llm_answer.text for a in expe[1].answers] == ["live fail", "live fail"]
@@ -0,0 +1,75 @@
+"""Tests for the local BM25 index and retriever built on the Indexer's nodes.
+
+No network / API keys required.
+"""
+import math
+import os
+import warnings
+
+warnings.filterwarnings("ignore")
+
+from ragtime.expe import QA, Question
+from ragtime.retrievers import BM25Index, BM25Retriever, Indexer
+
+DOCS = {
+    "cats.txt": "Les chats dorment beaucoup. Un chat dort seize heures par jour.",
+    "dogs.txt": "Le chien est le meilleur ami de l'homme. Les chiens aiment courir.",
+    "taxes.txt": "La déclaration d'impôts se fait en ligne avant le mois de juin.",
+}
+
+
+def _dataset(tmp_path) -> str:
+    docs = tmp_path / "corpus" / "documents"
+    docs.mkdir(parents=True)
+    for name, text in DOCS.items():
+        (docs / name).write_text(text, encoding="utf-8")
+    return str(tmp_path)
+
+
+def test_scores_match_the_bm25_formula():
+    texts = ["a b", "chat chat chien", "chien", "souris chat"]
+    index = BM25Index.build(texts, k1=1.2, b=0.75)
+    avg_len = (0 + 3 + 1 + 2) / 4  # single characters are not indexed
+    idf = math.log(1 + (4 - 2 + 0.5) / (2 + 0.5))
+    expected = idf * 2 * 2.2 / (2 + 1.2 * (1 - 0.75 + 0.75 * 3 / avg_len))
+    assert abs(index.scores("chat")[1] - expected) < 1e-5
+    assert [num for num, _ in index.search("chat", k=5)] == [1, 3]
+    assert index.search("inconnu") == []
+
+
+def test_retriever_builds_saves_and_reloads_the_index(tmp_path):
+    base_dir = _dataset(tmp_path)
+    retriever = BM25Retriever(dataset="corpus", base_dir=base_dir, top_k=2)
+    qa = QA(question=Question(text="Combien d'heures dort un chat ?"))
+    retriever.retrieve(qa)
+    assert qa.chunks[0].meta["display_name"] == "cats.txt" and qa.chunks[0].meta["score"] > 0
+    nodes_dir = os.path.join(base_dir, "corpus", "storage", "nodes")
+    assert {"nodes.json", "bm25.npz", "bm25_vocab.json"} <= set(os.listdir(nodes_dir))
+
+    # accents and case are ignored, the saved index is reused
+    mtime = os.path.getmtime(os.path.join(nodes_dir, "bm25.npz"))
+    nodes, index = Indexer("corpus", base_dir=base_dir).create_or_load_bm25()
+    assert os.path.getmtime(os.path.join(nodes_dir, "bm25.npz")) == mtime
+    best, _ = index.search("IMPOTS", k=1)[0]
+    assert nodes[best].metadata["file_name"] == "taxes.txt"
+
+
+def test_cached_chunks_are_not_reused_once_the_documents_change(tmp_path):
+    from ragtime.retrievers import CachedRetriever
+
+    base_dir = _dataset(tmp_path)
+    cache = tmp_path / "retrieval.sqlite"
+    qa = QA(question=Question(text="Combien d'heures dort un chat ?"))
+    CachedRetriever(BM25Retriever(dataset="corpus", base_dir=base_dir, top_k=1), cache=cache).retrieve(qa)
+    assert qa.chunks[0].meta["display_name"] == "cats.txt"
+
+    # same documents: another run reuses the chunks
+    qa = QA(question=Question(text="Combien d'heures dort un chat ?"))
+    CachedRetriever(BM25Retriever(dataset="corpus", base_dir=base_dir, top_k=1), cache=cache).retrieve(qa)
+    assert qa.chunks.meta.get("cached")
+
+    # a document is edited: the chunks are retrieved again from the new index
+    (tmp_path / "corpus" / "documents" / "cats.txt").write_text("Les chiens dorment dehors.", encoding="utf-8")
+    qa = QA(question=Question(text="Combien d'heures dort un chat ?"))
+    CachedRetriever(BM25Retriever(dataset="corpus", base_dir=base_dir, top_k=1), cache=cache).retrieve(qa)
+    assert not qa.chunks.meta.get("cached")
@@ -0,0 +1,116 @@
+"""Tests for the Budget capping the LLM calls of a run.
+
+No network / API keys required (acompletion is monkeypatched).
+"""
+import asyncio
+import json
+import warnings
+
+warnings.filterwarnings("ignore")
+
+import ragtime.llms.llm as llmmod
+from ragtime.budget import Budget, BudgetExceeded
+from ragtime.expe import Expe, QA, Question
+from ragtime.generators import AnsGenerator, Pipeline, Stage
+from ragtime.llms import LiteLLM
+from ragtime.prompters.answer_prompters import AnsPrompterBase
+
+calls = []
+
+
+async def fake(**kw):
+    calls.append(kw["messages"][1]["content"])
+    return {"model": kw["model"], "choices": [{"message": {"content": "ok"}}],
+            "usage": {"prompt_tokens": 7, "completion_tokens": 3, "total_tokens": 10}}
+
+
+def _expe(tmp_path, nb: int) -> Expe:
+    expe = Expe()
+    for i in range(nb):
+        expe.append(QA(question=Question(text=f"q{i}")))
+    expe.save_to_json(tmp_path / "expe.json")
+    return expe
+
+
+def test_no_call_once_the_budget_is_spent(tmp_path):
+    llmmod.acompletion = fake
+    llmmod.completion_cost = lambda a: 0.01
+    expe = _expe(tmp_path, 10)
+    budget = Budget(max_calls=3)
+    calls.clear()
+    gen = AnsGenerator(llms=[LiteLLM(name="m", prompter=AnsPrompterBase())])
+    gen.generate(expe, max_in_flight=1, budget=budget, journal=True)
+    assert calls == ["q0", "q1", "q2"]
+    assert gen.stats.nb_done == 3 and gen.stats.nb_skipped == 7
+    assert expe.meta["budget"]["calls"] == 3 and expe.meta["budget"]["tokens"] == 30
+    assert expe.meta["budget"]["exceeded"] == "max_calls"
+    assert abs(expe.meta["budget"]["usd"] - 0.03) < 1e-9
+    # the partial Expe has been saved, the journal has no done marker for the QA which spent the budget
+    assert list(tmp_path.glob("Budget_spent_*.json"))
+    lines = [json.loads(l) for l in expe.json_path.with_suffix(".journal.jsonl").read_text(encoding="utf-8").splitlines()]
+    assert sorted(l["qa"] for l in lines if l.get("done")) == [0, 1]
+
+
+def test_cost_limit_refuses_the_calls_of_the_qas_in_flight(tmp_path):
+    llmmod.acompletion = fake
+    llmmod.completion_cost = lambda a: 0.5
+    expe = _expe(tmp_path, 4)
+    budget = Budget(max_usd=1.0)
+    calls.clear()
+    gen = AnsGenerator(llms=[LiteLLM(name="a", prompter=AnsPrompterBase()),
+                             LiteLLM(name="b", prompter=AnsPrompterBase()),
+                             LiteLLM(name="c", prompter=AnsPrompterBase())])
+    gen.generate(expe, max_in_flight=1, max_in_flight_per_llm=1, budget=budget)
+    assert budget.exceeded == "max_usd"
+    assert len(calls) < 12 and budget.nb_refused >= 1
+    assert len(expe[-1].answers) == 0
+
+
+def test_calls_in_flight_never_pass_the_budget(tmp_path):
+    async def slow(**kw):
+        await asyncio.sleep(0.05)
+        return await fake(**kw)
+
+    llmmod.acompletion = slow
+    llmmod.completion_cost = lambda a: 0.01
+    expe = _expe(tmp_path, 10)
+    budget = Budget(max_calls=2)
+    calls.clear()
+    gen = AnsGenerator(llms=[LiteLLM(name="m", prompter=AnsPrompterBase())])
+    gen.generate(expe, budget=budget)  # 10 QAs in flight
+    assert len(calls) == 2 and budget.calls == 2 and budget.nb_refused >= 1
+    assert expe.meta["budget"]["exceeded"] == "max_calls" and expe.meta["budget"]["refused_calls"] >= 1
+
+    # a call reserves its prompt and max_tokens: 3 calls of at most 1 + 1 + 100 tokens hold in 310 tokens
+    (tmp_path / "tokens").mkdir()
+    expe = _expe(tmp_path / "tokens", 10)
+    budget = Budget(max_tokens=310)
+    calls.clear()
+    gen = AnsGenerator(llms=[LiteLLM(name="m", prompter=AnsPrompterBase(), max_tokens=100)])
+    gen.generate(expe, budget=budget)
+    assert len(calls) == 3 and budget.tokens == 30 and budget.summary()["exceeded"] == "max_tokens"
+
+
+def test_reservation_is_released_when_the_call_fails():
+    budget = Budget(max_calls=1)
+    reservation = budget.reserve(tokens=10)
+    try:
+        budget.reserve()
+        assert False, "the only call is reserved"
+    except BudgetExceeded:
+        pass
+    budget.record(None, reservation=reservation)
+    assert budget.calls == 0 and budget.tokens == 0
+
+
+def test_pipeline_saves_the_partial_expe_once_the_budget_is_spent(tmp_path):
+    llmmod.acompletion = fake
+    llmmod.completion_cost = lambda a: 0.01
+    expe = _expe(tmp_path, 5)
+    json_path = expe.json_path
+    calls.clear()
+    gen = AnsGenerator(llms=[LiteLLM(name="m", prompter=AnsPrompterBase())])
+    Pipeline([Stage(gen, max_in_flight=1)], budget=Budget(max_calls=2)).run(expe)
+    saved = list(tmp_path.glob("Budget_spent_Pipeline_*.json"))
+    assert len(calls) == 2 and len(saved) == 1 and expe.json_path == json_path
+    assert sum(1 for qa in Expe(json_path=saved[0]) if len(qa.answers)) == 2
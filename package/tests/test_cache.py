@@ -0,0 +1,76 @@
+"""Tests for the persistent LLM response cache.
+
+No network / API keys required (acompletion is monkeypatched).
+"""
+import warnings
+
+warnings.filterwarnings("ignore")
+
+import ragtime.llms.llm as llmmod
+from ragtime.cache import CacheMode, DiskCache, hash_key
+from ragtime.expe import Expe, QA, Question, Prompt
+from ragtime.generators import AnsGenerator
+from ragtime.llms import LiteLLM
+from ragtime.prompters.answer_prompters import AnsPrompterBase
+
+llmmod.completion_cost = lambda a: 0.0
+calls = []
+
+
+async def fake(**kw):
+    calls.append(kw["messages"][1]["content"])
+    return {"model": kw["model"], "choices": [{"message": {"content": f"answer to {kw['messages'][1]['content']}"}}]}
+
+
+def _expe() -> Expe:
+    expe = Expe()
+    for q in ("q1", "q2", "q3"):
+        expe.append(QA(question=Question(text=q)))
+    return expe
+
+
+def _gen(**kw) -> AnsGenerator:
+    return AnsGenerator(llms=[LiteLLM(name="m", prompter=AnsPrompterBase(), **kw)])
+
+
+def test_hash_key_ignores_key_order():
+    assert hash_key({"a": 1, "b": [1, 2]}) == hash_key({"b": [1, 2], "a": 1})
+    assert hash_key({"a": 1}) != hash_key({"a": 2})
+
+
+def test_lru_eviction(tmp_path):
+    cache = DiskCache(tmp_path / "c.sqlite", max_entries=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1  # "b" is now the least recently used
+    cache.set("c", 3)
+    cache.evict()
+    assert len(cache) == 2 and cache.get("b") is None and cache.get("a") == 1
+
+
+def test_second_run_is_served_from_cache(tmp_path):
+    llmmod.acompletion = fake
+    calls.clear()
+    path = tmp_path / "llm.sqlite"
+    _gen().generate(_expe(), cache=path)
+    assert len(calls) == 3
+
+    expe = _expe()
+    gen = _gen()
+    gen.generate(expe, cache=path)
+    assert len(calls) == 3 and gen.stats.cache_hits == 3
+    assert expe[0].answers[0].text == "<p>answer to q1</p>"
+    assert expe[0].answers[0].llm_answer.meta["cached"]
+
+    # another temperature is another key
+    _gen(temperature=0.2).generate(_expe(), cache=path, cache_mode=CacheMode.read_only)
+    assert len(calls) == 6
+    _gen(temperature=0.2).generate(_expe(), cache=path, cache_mode=CacheMode.bypass)
+    assert len(calls) == 9
+
+
+def test_api_key_is_not_part_of_the_key():
+    p = Prompt(user="u", system="s")
+    a = LiteLLM(name="m", prompter=AnsPrompterBase(), extra_params={"api_key": "k1"})
+    b = LiteLLM(name="m", prompter=AnsPrompterBase(), extra_params={"api_key": "k2"})
+    assert a.cache_key(p) == b.cache_key(p)
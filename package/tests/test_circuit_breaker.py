@@ -0,0 +1,131 @@
+"""Tests for the circuit breakers per model endpoint.
+
+No network / API keys required (acompletion is monkeypatched).
+"""
+import asyncio
+import threading
+import time
+import warnings
+
+warnings.filterwarnings("ignore")
+
+import ragtime.llms.llm as llmmod
+from ragtime.expe import Prompt
+from ragtime.llms import LiteLLM
+from ragtime.llms.circuit_breaker import (CircuitBreaker, CircuitOpenError, CircuitState, add_circuit_listener,
+                                          circuit_states, get_circuit_breaker, remove_circuit_listener)
+from ragtime.prompters.answer_prompters import AnsPrompterBase
+
+calls = []
+
+
+def _run(coro):
+    return asyncio.new_event_loop().run_until_complete(coro)
+
+
+def test_circuit_opens_then_lets_a_single_probe_through():
+    breaker = CircuitBreaker("k", failure_threshold=2, reset_timeout=0.05)
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == CircuitState.closed
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == CircuitState.open
+    try:
+        breaker.before_call()
+        assert False, "the call must not be made"
+    except CircuitOpenError:
+        pass
+
+    time.sleep(0.06)
+    assert breaker.state == CircuitState.half_open
+    probe = breaker.before_call()
+    assert probe is not None
+    try:
+        breaker.before_call()
+        assert False, "a single probe at a time"
+    except CircuitOpenError:
+        pass
+    breaker.record_failure(probe)
+    assert breaker.state == CircuitState.open
+
+    time.sleep(0.06)
+    probe = breaker.before_call()
+    breaker.record_success(probe)
+    assert breaker.state == CircuitState.closed and breaker.nb_failures == 0
+
+
+def test_only_the_probe_ends_the_half_open_state():
+    breaker = CircuitBreaker("stale", failure_threshold=1, reset_timeout=0.05)
+    stale = breaker.before_call()  # started while closed, still running when the circuit opens
+    assert stale is None
+    breaker.record_failure(breaker.before_call())
+    time.sleep(0.06)
+    probe = breaker.before_call()
+    breaker.record_success(stale)
+    assert breaker.state == CircuitState.half_open, "a call started before the opening does not close the circuit"
+    breaker.record_cancel(stale)
+    try:
+        breaker.before_call()
+        assert False, "the probe is still in flight"
+    except CircuitOpenError:
+        pass
+    breaker.record_cancel(probe)
+    probe = breaker.before_call()
+    breaker.record_success(probe)
+    breaker.record_cancel(probe)
+    assert breaker.state == CircuitState.closed
+
+
+def test_listeners_are_called_without_the_lock():
+    breaker = get_circuit_breaker("cb-listener")
+    breaker.failure_threshold = 1
+    seen = []
+
+    def listener(key, state):
+        # reading the state from another thread would block for ever if the lock were still held
+        reader = threading.Thread(target=lambda: seen.append(breaker.state))
+        reader.start()
+        reader.join(timeout=1)
+
+    add_circuit_listener(listener)
+    try:
+        breaker.record_failure(breaker.before_call())
+    finally:
+        remove_circuit_listener(listener)
+    assert seen == [CircuitState.open]
+
+
+def test_open_circuit_fails_fast_and_falls_back():
+    async def fake(**kw):
+        calls.append(kw.get("api_base"))
+        if kw.get("api_base") == "http://cb-down":
+            raise ConnectionError("down")
+        return {"model": "m", "choices": [{"message": {"content": "ok"}}]}
+
+    llmmod.acompletion = fake
+    llmmod.completion_cost = lambda a: 0.0
+    changes = []
+    listener = lambda key, state: changes.append((key, state, circuit_states()[key]["state"]))
+    add_circuit_listener(listener)
+    try:
+        breaker = get_circuit_breaker("cb", "http://cb-down")
+        breaker.failure_threshold = 2
+        alone = LiteLLM(name="cb", prompter=AnsPrompterBase(), extra_params={"api_base": "http://cb-down"})
+        calls.clear()
+        nb_fast_fails: int = 0
+        for _ in range(5):
+            try:
+                _run(alone.complete(Prompt(user="q")))
+            except CircuitOpenError:
+                nb_fast_fails += 1
+        assert len(calls) == 2 and nb_fast_fails == 3
+        assert changes == [("cb@http://cb-down", CircuitState.open, "open")]
+
+        with_fallback = LiteLLM(name="cb", prompter=AnsPrompterBase(), extra_params={"api_base": "http://cb-down"},
+                                fallbacks=[{"api_base": "http://cb-up"}])
+        calls.clear()
+        answer = _run(with_fallback.complete(Prompt(user="q")))
+        assert answer.text == "ok" and calls == ["http://cb-up"]
+    finally:
+        remove_circuit_listener(listener)
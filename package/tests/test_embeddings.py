@@ -0,0 +1,85 @@
+"""Tests for the local embedding matrix, its vectorized top-k search and the DenseRetriever.
+
+No network / API keys required (HashEmbedder).
+"""
+import asyncio
+import os
+import warnings
+
+warnings.filterwarnings("ignore")
+
+import numpy as np
+from llama_index.core.schema import Document
+
+import ragtime.retrievers.embeddings as embmod
+from ragtime.expe import QA, Question
+from ragtime.retrievers import DenseRetriever, EmbeddingStore, HashEmbedder, Indexer
+
+embedded = []
+
+
+class CountingEmbedder(HashEmbedder):
+    def embed(self, texts: list[str]) -> np.ndarray:
+        embedded.append(len(texts))
+        return super().embed(texts)
+
+
+def _write(tmp_path, name: str, text: str):
+    docs = tmp_path / "corpus" / "documents"
+    docs.mkdir(parents=True, exist_ok=True)
+    (docs / name).write_text(text, encoding="utf-8")
+
+
+def test_blockwise_top_k_matches_a_full_sort(tmp_path, monkeypatch):
+    monkeypatch.setattr(embmod, "SEARCH_BLOCK_ROWS", 7)
+    rng = np.random.default_rng(0)
+    matrix = rng.normal(size=(50, 16)).astype(np.float32)
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+    queries = rng.normal(size=(4, 16)).astype(np.float32)
+    for dtype in ["float32", "float16"]:
+        store = EmbeddingStore(matrix.astype(dtype), [str(i) for i in range(50)], "test")
+        rows, scores = store.search(queries, k=5)
+        exact = (queries / np.linalg.norm(queries, axis=1, keepdims=True)) @ matrix.T
+        assert (rows == np.argsort(-exact, axis=1)[:, :5]).all()
+        assert np.allclose(scores, np.sort(exact, axis=1)[:, ::-1][:, :5], atol=1e-2)
+
+
+def test_dense_retriever_embeds_only_new_nodes_and_batches_questions(tmp_path):
+    base_dir = str(tmp_path)
+    _write(tmp_path, "cats.txt", "Les chats dorment beaucoup, un chat dort seize heures.")
+    _write(tmp_path, "taxes.txt", "La déclaration d'impôts se fait en ligne.")
+    embedded.clear()
+    nodes, store = Indexer("corpus", base_dir=base_dir).create_or_load_embeddings(CountingEmbedder(), dtype="float16")
+    assert embedded == [2] and store.matrix.dtype == np.float16 and isinstance(store.matrix, np.memmap)
+    assert os.path.exists(os.path.join(base_dir, "corpus", "storage", "nodes", "embeddings.npy"))
+
+    _write(tmp_path, "dogs.txt", "Les chiens aiment courir.")
+    embedded.clear()
+    nodes, store = Indexer("corpus", base_dir=base_dir).create_or_load_embeddings(CountingEmbedder(), dtype="float16")
+    assert embedded == [1] and len(store) == 3
+
+    retriever = DenseRetriever(dataset="corpus", base_dir=base_dir, embedder=CountingEmbedder(), dtype="float16", top_k=1)
+    qas = [QA(question=Question(text=text)) for text in ["Combien d'heures dort un chat ?", "Les impôts en ligne", "chiens"]]
+    embedded.clear()
+    asyncio.new_event_loop().run_until_complete(retriever.retrieve_many(qas))
+    assert embedded == [3]  # the questions are embedded at once, the nodes are not embedded again
+    assert [qa.chunks[0].meta["display_name"] for qa in qas] == ["cats.txt", "taxes.txt", "dogs.txt"]
+
+
+def test_rebuild_drops_the_memory_map_of_the_previous_store_before_replacing_it(tmp_path, monkeypatch):
+    folder = str(tmp_path)
+    texts = ["un", "deux", "trois"]
+    embedder = HashEmbedder()
+    EmbeddingStore.build(folder, [Document(text=t) for t in texts], ["a", "b", "c"], embedder)
+    previous = EmbeddingStore.load(folder)
+    expected = np.array(previous.matrix[1])
+    mapped_at_replace = []
+    replace = embmod.os.replace
+    monkeypatch.setattr(embmod.os, "replace",
+                        lambda src, dst: (mapped_at_replace.append(isinstance(previous.matrix, np.memmap)), replace(src, dst)))
+    embedded.clear()
+    store = EmbeddingStore.build(folder, [Document(text=t) for t in texts + ["quatre"]], ["a", "b", "c", "d"],
+                                 CountingEmbedder(), previous=previous)
+    # Windows cannot replace a memory-mapped file, and POSIX readers would be left on the unlinked one
+    assert mapped_at_replace == [False] and len(previous) == 0
+    assert embedded == [1] and len(store) == 4 and np.array_equal(store.matrix[1], expected)
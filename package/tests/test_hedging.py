@@ -0,0 +1,135 @@
+"""Tests for hedged requests and fallback deployments in LiteLLM.
+
+No network / API keys required (acompletion is monkeypatched).
+"""
+import asyncio
+import time
+import warnings
+
+warnings.filterwarnings("ignore")
+
+import ragtime.llms.llm as llmmod
+from ragtime.budget import Budget
+from ragtime.expe import Expe, Prompt, QA, Question
+from ragtime.generators import AnsGenerator
+from ragtime.llms import LiteLLM
+from ragtime.llms.latency import LatencyTracker, get_latency_tracker
+from ragtime.prompters.answer_prompters import AnsPrompterBase
+
+calls = []
+
+
+def _run(coro):
+    return asyncio.new_event_loop().run_until_complete(coro)
+
+
+def _answer(text: str) -> dict:
+    return {"model": "m", "choices": [{"message": {"content": text}}]}
+
+
+def test_fallback_to_next_deployment_on_failure():
+    async def fake(**kw):
+        calls.append((kw["model"], kw.get("api_base")))
+        if kw.get("api_base") == "http://down":
+            raise ConnectionError("down")
+        return _answer(f"from {kw.get('api_base')}")
+
+    llmmod.acompletion = fake
+    llmmod.completion_cost = lambda a: 0.0
+    calls.clear()
+    llm = LiteLLM(name="m", prompter=AnsPrompterBase(), extra_params={"api_base": "http://down"},
+                  fallbacks=[{"api_base": "http://down"}, {"api_base": "http://up"}, {"model": "never/called"}])
+    answer = _run(llm.complete(Prompt(user="q")))
+    assert answer.text == "from http://up"
+    assert calls == [("m", "http://down"), ("m", "http://down"), ("m", "http://up")]
+
+
+def test_slow_call_is_hedged_and_the_first_answer_wins(monkeypatch):
+    cancelled = []
+
+    async def fake(**kw):
+        calls.append(kw.get("api_base"))
+        if len(calls) == 1:  # the first request hangs
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+        return _answer(f"from {kw.get('api_base')}")
+
+    llmmod.acompletion = fake
+    llmmod.completion_cost = lambda a: 0.01
+    monkeypatch.setattr(LiteLLM, "_estimate_cost", lambda self, prompt_tokens, completion_tokens: 0.001)
+    calls.clear()
+    tracker = get_latency_tracker("hedged", "http://a")
+    for _ in range(20):
+        tracker.add(0.05)
+    llm = LiteLLM(name="hedged", prompter=AnsPrompterBase(), extra_params={"api_base": "http://a"},
+                  fallbacks=[{"api_base": "http://b"}], hedge=True)
+    start = time.perf_counter()
+    answer = _run(llm.complete(Prompt(user="q")))
+    assert time.perf_counter() - start < 1
+    assert answer.text == "from http://b"
+    assert calls == ["http://a", "http://b"] and cancelled == [True]
+    # the cancelled request is paid for its prompt, and its latency so far is learnt as a lower bound
+    assert answer.meta["calls"] == 2 and abs(answer.cost - 0.011) < 1e-9
+    assert len(tracker) == 21 and tracker.quantile(1.0) >= 0.05
+
+
+def test_rate_limit_wait_does_not_trigger_the_hedge(monkeypatch):
+    class SlowLimiter:
+        async def acquire(self, nb_tokens):
+            await asyncio.sleep(0.2)  # far longer than the hedge delay
+
+        def record_usage(self, estimated, actual):
+            pass
+
+    async def fake(**kw):
+        calls.append(kw.get("api_base"))
+        return _answer("ok")
+
+    llmmod.acompletion = fake
+    llmmod.completion_cost = lambda a: 0.0
+    monkeypatch.setattr(llmmod, "get_rate_limiter", lambda model, api_base=None: SlowLimiter())
+    calls.clear()
+    tracker = get_latency_tracker("throttled", "http://a")
+    for _ in range(20):
+        tracker.add(0.01)
+    llm = LiteLLM(name="throttled", prompter=AnsPrompterBase(), extra_params={"api_base": "http://a"}, hedge=True)
+    answer = _run(llm.complete(Prompt(user="q")))
+    assert answer.text == "ok" and calls == ["http://a"] and "calls" not in answer.meta
+
+
+def test_hedged_request_is_a_call_for_the_scheduler_and_the_budget(tmp_path):
+    async def fake(**kw):
+        calls.append(kw["model"])
+        if len(calls) == 1:
+            await asyncio.sleep(0.3)
+        return _answer("ok")
+
+    llmmod.acompletion = fake
+    llmmod.completion_cost = lambda a: 0.0
+    for name in ("hedged-slot", "hedged-one-slot"):
+        tracker = get_latency_tracker(name)
+        for _ in range(20):
+            tracker.add(0.01)
+    for name, per_llm, nb_calls in [("hedged-slot", 2, 2), ("hedged-one-slot", 1, 1)]:
+        expe = Expe()
+        expe.append(QA(question=Question(text="q")))
+        expe.save_to_json(tmp_path / f"{name}.json")
+        budget = Budget(max_calls=5)
+        calls.clear()
+        gen = AnsGenerator(llms=[LiteLLM(name=name, prompter=AnsPrompterBase(), hedge=True)])
+        gen.generate(expe, max_in_flight_per_llm=per_llm, budget=budget)
+        # with a single slot for the LLM, the duplicate waits for it and is never sent
+        assert len(calls) == nb_calls and budget.calls == nb_calls
+        assert gen.stats.llm_calls[name] == nb_calls
+
+
+def test_no_hedge_threshold_before_min_samples():
+    tracker = LatencyTracker(window=3)
+    assert tracker.quantile(0.95, min_samples=2) is None
+    for latency in (1.0, 2.0, 3.0, 4.0):
+        tracker.add(latency)
+    assert len(tracker) == 3
+    assert tracker.quantile(0.5, min_samples=2) == 3.0
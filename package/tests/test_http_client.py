@@ -0,0 +1,118 @@
+"""Tests for the pooled HTTP clients and `acall_api`, against a local HTTP server.
+
+No network required.
+"""
+import asyncio
+import json
+import threading
+import warnings
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+warnings.filterwarnings("ignore")
+
+from ragtime.base import REQ_GET, REQ_POST, acall_api, call_api
+from ragtime.http_client import configure_http_client, get_async_client
+
+client_ports = []
+
+
+class _Echo(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status: int, payload: dict):
+        data: bytes = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        client_ports.append(self.client_address[1])
+        self._send(404 if self.path == "/missing" else 200, {"path": self.path})
+
+    def do_POST(self):
+        client_ports.append(self.client_address[1])
+        body: dict = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self._send(200, {"echo": body})
+
+
+def _serve() -> tuple[ThreadingHTTPServer, str]:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Echo)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def test_async_calls_reuse_one_connection():
+    server, url = _serve()
+    client_ports.clear()
+
+    async def _calls():
+        first = await acall_api(REQ_POST, f"{url}/x", json={"a": 1})
+        answers = [first.json()]
+        for _ in range(4):
+            answers.append((await acall_api(REQ_GET, f"{url}/y")).json())
+        same_client: bool = get_async_client() is get_async_client()
+        try:
+            await acall_api(REQ_GET, f"{url}/missing")
+            raised = False
+        except Exception as e:
+            raised = "returned error" in str(e)
+        return answers, same_client, raised
+
+    try:
+        answers, same_client, raised = asyncio.new_event_loop().run_until_complete(_calls())
+    finally:
+        server.shutdown()
+    assert answers[0] == {"echo": {"a": 1}} and answers[1] == {"path": "/y"}
+    assert same_client and raised
+    assert len(set(client_ports)) == 1  # a single TCP connection for the 6 calls
+
+
+def test_sync_calls_reuse_one_connection_and_new_settings_apply():
+    server, url = _serve()
+    client_ports.clear()
+    try:
+        for _ in range(3):
+            assert call_api(REQ_GET, f"{url}/z").json() == {"path": "/z"}
+        assert len(set(client_ports)) == 1
+        configure_http_client(timeout=30.0)  # the session is replaced, hence a new connection
+        call_api(REQ_GET, f"{url}/z")
+        assert len(set(client_ports)) == 2
+    finally:
+        server.shutdown()
+
+
+def test_sync_calls_have_no_read_timeout_unless_configured():
+    from ragtime.http_client import session_timeout
+
+    connect, read = session_timeout()
+    assert read is None and connect
+    configure_http_client(sync_timeout=120.0)
+    try:
+        assert session_timeout()[1] == 120.0
+    finally:
+        configure_http_client(sync_timeout=None)
+
+
+def test_error_messages_do_not_contain_the_api_key():
+    server, url = _serve()
+    headers = {"Authorization": "Bearer secret-key", "accept": "application/json"}
+
+    async def _call():
+        await acall_api(REQ_GET, f"{url}/missing", headers=headers)
+
+    messages = []
+    try:
+        for call in (lambda: call_api(REQ_GET, f"{url}/missing", headers=headers),
+                     lambda: asyncio.new_event_loop().run_until_complete(_call())):
+            try:
+                call()
+            except Exception as e:
+                messages.append(str(e))
+    finally:
+        server.shutdown()
+    assert len(messages) == 2
+    assert all("secret-key" not in m and "'Authorization': '***'" in m and "application/json" in m for m in messages)
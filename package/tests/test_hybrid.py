@@ -0,0 +1,58 @@
+"""Tests for the fusion of the BM25 and dense rankings in the HybridRetriever.
+
+No network / API keys required (HashEmbedder).
+"""
+import asyncio
+import warnings
+
+warnings.filterwarnings("ignore")
+
+from ragtime.expe import QA, Chunk, Question
+from ragtime.prompters.answer_prompters import AnsPrompterWithRetrieverFR
+from ragtime.retrievers import HybridRetriever, HashEmbedder, reciprocal_rank_fusion, weighted_fusion
+
+
+def _ranking(*scored: tuple[str, float]) -> list[Chunk]:
+    return [Chunk(text=node_id, meta={"node_id": node_id, "score": score}) for node_id, score in scored]
+
+
+def test_fusions_favour_nodes_found_by_both_searches():
+    rankings = {"bm25": _ranking(("a", 12.0), ("b", 8.0), ("c", 1.0)), "dense": _ranking(("b", 0.9), ("d", 0.8))}
+    rrf = reciprocal_rank_fusion(rankings, {"bm25": 1.0, "dense": 1.0}, rrf_k=60)
+    assert max(rrf, key=rrf.get) == "b" and rrf["b"] == 1 / 62 + 1 / 61 and rrf["a"] > rrf["d"] > rrf["c"]
+    weighted = weighted_fusion(rankings, {"bm25": 1.0, "dense": 2.0})
+    assert weighted == {"a": 1.0, "b": (8 - 1) / 11 + 2.0, "c": 0.0, "d": 0.0}
+    only_dense = reciprocal_rank_fusion(rankings, {"bm25": 0.0, "dense": 1.0})
+    assert max(only_dense, key=only_dense.get) == "b" and only_dense["a"] == 0
+
+
+def test_hybrid_retriever_batches_dedups_and_feeds_the_prompter(tmp_path):
+    docs = tmp_path / "corpus" / "documents"
+    docs.mkdir(parents=True)
+    for name, text in [("cats.txt", "Les chats dorment beaucoup, un chat dort seize heures par jour."),
+                       ("taxes.txt", "La déclaration d'impôts se fait en ligne avant le mois de juin."),
+                       ("dogs.txt", "Les chiens aiment courir dans le parc."),
+                       ("trains.txt", "Le train pour Lyon part à midi.")]:
+        (docs / name).write_text(text, encoding="utf-8")
+    retriever = HybridRetriever(dataset="corpus", base_dir=str(tmp_path), embedder=HashEmbedder(), top_k=3)
+    qas = [QA(question=Question(text=text)) for text in ["Combien d'heures dort un chat ?", "impôts en ligne"]]
+    asyncio.new_event_loop().run_until_complete(retriever.retrieve_many(qas))
+
+    for qa, expected in zip(qas, ["cats.txt", "taxes.txt"]):
+        assert qa.chunks[0].meta["display_name"] == expected
+        assert qa.chunks[0].meta["bm25_rank"] == 1 and qa.chunks[0].meta["dense_rank"] == 1
+        node_ids = [chunk.meta["node_id"] for chunk in qa.chunks]
+        assert len(node_ids) == len(set(node_ids)) <= 3
+        scores = [chunk.meta["score"] for chunk in qa.chunks]
+        assert scores == sorted(scores, reverse=True)
+        assert set(qa.chunks.meta["timing"]) == {"bm25", "dense", "fusion", "batch"}
+        assert qa.chunks.meta["timing"]["batch"] == 2
+
+    prompt = AnsPrompterWithRetrieverFR().get_prompt(question=qas[0].question, chunks=qas[0].chunks)
+    assert "- cats.txt (p. )" in prompt.user
+
+    weighted = HybridRetriever(dataset="corpus", base_dir=str(tmp_path), embedder=HashEmbedder(), top_k=1,
+                               fusion="weighted")
+    qa = QA(question=Question(text="Quand part le train pour Lyon ?"))
+    weighted.retrieve(qa)
+    assert [chunk.meta["display_name"] for chunk in qa.chunks] == ["trains.txt"]
@@ -0,0 +1,154 @@
+"""Tests for the incremental, content-hash-based indexing of the Indexer.
+
+No network / API keys required (the vector index uses a MockEmbedding).
+"""
+import os
+import warnings
+
+warnings.filterwarnings("ignore")
+
+from ragtime.retrievers import Indexer, NodeStore, NodeStoreWriter
+
+
+def _write(tmp_path, name: str, text: str):
+    docs = tmp_path / "corpus" / "documents"
+    docs.mkdir(parents=True, exist_ok=True)
+    (docs / name).write_text(text, encoding="utf-8")
+
+
+def _indexer(tmp_path, split_calls: list) -> Indexer:
+    indexer = Indexer("corpus", base_dir=str(tmp_path))
+    split_file = indexer.split_file
+
+    def _counted(file_path, recursive=True):
+        split_calls.append(os.path.basename(file_path))
+        return split_file(file_path, recursive=recursive)
+
+    indexer.split_file = _counted
+    return indexer
+
+
+def test_only_added_changed_and_removed_files_are_processed(tmp_path):
+    for name in ["a.txt", "b.txt", "c.txt"]:
+        _write(tmp_path, name, f"Le document {name} parle de sujets variés.")
+    calls = []
+    nodes, index = _indexer(tmp_path, calls).create_or_load_nodes(create_index=False)
+    assert index is None and len(nodes) == 3 and sorted(calls) == ["a.txt", "b.txt", "c.txt"]
+    ids = {n.metadata["file_name"]: n.id_ for n in nodes}
+    first_hash = Indexer("corpus", base_dir=str(tmp_path)).generate_hash()
+
+    # nothing changed: no file is read again
+    calls = []
+    nodes, _ = _indexer(tmp_path, calls).create_or_load_nodes(create_index=False)
+    assert calls == [] and {n.id_ for n in nodes} == set(ids.values())
+
+    # same file names, new content: the hash changes, only this file is split again
+    _write(tmp_path, "b.txt", "Un tout autre contenu, plus long que le précédent.")
+    _write(tmp_path, "d.txt", "Un nouveau document.")
+    os.remove(tmp_path / "corpus" / "documents" / "c.txt")
+    assert Indexer("corpus", base_dir=str(tmp_path)).generate_hash() != first_hash
+    calls = []
+    nodes, _ = _indexer(tmp_path, calls).create_or_load_nodes(create_index=False)
+    assert sorted(calls) == ["b.txt", "d.txt"]
+    by_file = {n.metadata["file_name"]: n for n in nodes}
+    assert sorted(by_file) == ["a.txt", "b.txt", "d.txt"]
+    assert by_file["a.txt"].id_ == ids["a.txt"] and by_file["b.txt"].id_ != ids["b.txt"]
+    assert "autre contenu" in by_file["b.txt"].text
+
+    # the BM25 index follows the nodes
+    nodes, bm25 = Indexer("corpus", base_dir=str(tmp_path)).create_or_load_bm25()
+    assert bm25.node_ids == [n.id_ for n in nodes]
+    assert nodes[bm25.search("nouveau", k=1)[0][0]].metadata["file_name"] == "d.txt"
+
+
+def test_many_files_are_split_in_worker_processes(tmp_path, monkeypatch):
+    import ragtime.retrievers.indexer as indexermod
+
+    monkeypatch.setattr(indexermod, "MIN_FILES_PER_PROCESS", 2)
+    for i in range(60):  # above the former limit of 50 files
+        _write(tmp_path, f"doc{i:02d}.txt", f"Document numéro {i}.")
+    calls = []
+    indexer = _indexer(tmp_path, calls)
+    indexer.max_workers = 3
+    nodes, _ = indexer.create_or_load_nodes(create_index=False)
+    assert calls == []  # not split in this process
+    assert sorted(n.metadata["file_name"] for n in nodes) == [f"doc{i:02d}.txt" for i in range(60)]
+    # the store is read back in the same order
+    stored = NodeStore(os.path.join(tmp_path, "corpus", "storage", "nodes"))
+    assert stored.ids == [n.id_ for n in nodes]
+
+
+def test_node_store_random_access_and_sampling(tmp_path):
+    for name in ["a.txt", "b.txt", "c.txt"]:
+        _write(tmp_path, name, f"Le document {name} est accentué : é à ç.")
+    nodes, _ = Indexer("corpus", base_dir=str(tmp_path)).create_or_load_nodes(create_index=False)
+    nodes_dir = os.path.join(tmp_path, "corpus", "storage", "nodes")
+    assert isinstance(nodes, NodeStore) and not os.path.exists(os.path.join(nodes_dir, "nodes.pkl"))
+    last = nodes[-1]
+    assert nodes.get(last.id_).text == last.text and "é à ç" in last.text
+    assert nodes.get("unknown") is None
+    sample = nodes.sample(2)
+    assert len(sample) == 2 and len({n.id_ for n in sample}) == 2
+    assert len(nodes.sample(10)) == 3
+
+    # written node by node, without keeping the nodes in memory
+    with NodeStoreWriter(str(tmp_path / "copy")) as writer:
+        writer.append(node for node in nodes)
+    copy = NodeStore(str(tmp_path / "copy"))
+    assert [n.text for n in copy] == [n.text for n in nodes] and copy[1:][0].id_ == nodes[1].id_
+
+
+def test_store_is_published_by_a_single_rename_after_closing_the_previous_one(tmp_path, monkeypatch):
+    import ragtime.retrievers.node_store as storemod
+
+    _write(tmp_path, "a.txt", "Le premier document.")
+    Indexer("corpus", base_dir=str(tmp_path)).create_or_load_nodes(create_index=False)
+    nodes_dir = tmp_path / "corpus" / "storage" / "nodes"
+    previous_files = {f for f in os.listdir(nodes_dir) if f.startswith("nodes-")}
+    events = []
+    close, replace, remove = NodeStore.close, storemod.os.replace, storemod.os.remove
+    monkeypatch.setattr(NodeStore, "close", lambda self: (events.append("close"), close(self)))
+    monkeypatch.setattr(storemod.os, "replace", lambda src, dst: (events.append("replace"), replace(src, dst)))
+    monkeypatch.setattr(storemod.os, "remove", lambda path: (events.append("remove"), remove(path)))
+    _write(tmp_path, "b.txt", "Un second document.")
+    nodes, _ = Indexer("corpus", base_dir=str(tmp_path)).create_or_load_nodes(create_index=False)
+    # a reader sees either the old or the new files, and Windows cannot remove a memory-mapped file
+    assert events[:5] == ["replace", "close", "remove", "remove", "remove"]
+    assert not previous_files & set(os.listdir(nodes_dir))
+    assert sorted(n.metadata["file_name"] for n in nodes) == ["a.txt", "b.txt"]
+
+
+def test_failed_write_leaves_the_current_store_readable(tmp_path):
+    folder = str(tmp_path)
+    with NodeStoreWriter(folder) as writer:
+        writer.append_record("a", b'{"x": 1}')
+    files = set(os.listdir(folder))
+    try:
+        with NodeStoreWriter(folder, replaces=NodeStore(folder)) as writer:
+            writer.append_record("b", b'{"x": 2}')
+            raise RuntimeError("crash while writing")
+    except RuntimeError:
+        pass
+    assert set(os.listdir(folder)) == files and NodeStore(folder).ids == ["a"]
+
+
+def test_vector_index_is_filled_by_batches_then_updated_file_by_file(tmp_path, monkeypatch):
+    from llama_index.core import MockEmbedding, Settings
+
+    import ragtime.retrievers.indexer as indexermod
+
+    monkeypatch.setattr(Settings, "_embed_model", MockEmbedding(embed_dim=8))
+    monkeypatch.setattr(indexermod, "INDEX_BATCH_SIZE", 2)
+    batches = []
+    add_to_index = Indexer.add_to_index
+    monkeypatch.setattr(Indexer, "add_to_index", staticmethod(lambda index, nodes: (batches.append(len(nodes)),
+                                                                                    add_to_index(index, nodes))))
+    for name in ["a.txt", "b.txt", "c.txt"]:
+        _write(tmp_path, name, f"Le document {name}.")
+    nodes, index = Indexer("corpus", base_dir=str(tmp_path)).create_or_load_nodes()
+    assert batches == [2, 1] and set(index.index_struct.nodes_dict) == set(nodes.ids)
+
+    batches.clear()
+    _write(tmp_path, "b.txt", "Le document b.txt, modifié.")
+    nodes, index = Indexer("corpus", base_dir=str(tmp_path)).create_or_load_nodes()
+    assert batches == [1] and set(index.index_struct.nodes_dict) == set(nodes.ids)
@@ -0,0 +1,94 @@
+"""Tests for the append-only checkpoint journal and `generate(resume=True)`.
+
+No network / API keys required (acompletion is monkeypatched).
+"""
+import json
+import warnings
+
+warnings.filterwarnings("ignore")
+
+import ragtime.llms.llm as llmmod
+from ragtime.expe import Answer, Eval, Expe, LLMAnswer, QA, Question
+from ragtime.generators import AnsGenerator
+from ragtime.journal import Journal
+from ragtime.llms import LiteLLM
+from ragtime.prompters.answer_prompters import AnsPrompterBase
+
+calls = []
+
+
+async def fake(**kw):
+    calls.append((kw["model"], kw["messages"][1]["content"]))
+    return {"model": kw["model"], "choices": [{"message": {"content": f"{kw['model']} {kw['messages'][1]['content']}"}}]}
+
+
+def _gen() -> AnsGenerator:
+    return AnsGenerator(llms=[LiteLLM(name="a", prompter=AnsPrompterBase()),
+                              LiteLLM(name="b", prompter=AnsPrompterBase())])
+
+
+def test_resume_replays_the_journal_and_skips_done_work(tmp_path):
+    llmmod.acompletion = fake
+    llmmod.completion_cost = lambda a: 0.0
+    expe = Expe()
+    for q in ("q1", "q2", "q3"):
+        expe.append(QA(question=Question(text=q)))
+    path = expe.save_to_json(tmp_path / "expe.json")
+
+    calls.clear()
+    _gen().generate(expe, journal=True)
+    assert len(calls) == 6
+    journal_path = path.with_suffix(".journal.jsonl")
+    lines = [json.loads(l) for l in journal_path.read_text(encoding="utf-8").splitlines()]
+    assert sum(1 for l in lines if l.get("done")) == 3
+
+    # simulate a run killed while processing q3: its "b" answer and its done marker are missing
+    # and the last line has been cut
+    kept = [l for l in lines if l["qa"] != 2 or l.get("llm") == "a"]
+    journal_path.write_text("".join(json.dumps(l) + "\n" for l in kept) + '{"qa": 2, "sta', encoding="utf-8")
+
+    calls.clear()
+    resumed = Expe(path)
+    _gen().generate(resumed, resume=True)
+    assert calls == [("b", "q3")]
+    assert [[a.text for a in qa.answers] for qa in resumed] == [[f"<p>a {q}</p>", f"<p>b {q}</p>"] for q in ("q1", "q2", "q3")]
+
+
+def test_replay_applies_the_results_in_order(tmp_path):
+    expe = Expe()
+    expe.append(QA(question=Question(text="q")))
+    with Journal(tmp_path / "j.jsonl") as journal:
+        journal.record(0, "AnsGenerator", "answer", "a", Answer(text="v1", llm_answer=LLMAnswer(name="a")))
+        journal.record(0, "AnsGenerator", "answer", "a", Answer(text="v2", llm_answer=LLMAnswer(name="a")))
+        journal.record(0, "EvalGenerator", "eval", "a", Eval(auto=0.5))
+        journal.mark_done(0, "EvalGenerator")
+        journal.record(5, "AnsGenerator", "answer", "a", Answer(text="not in the Expe"))
+    done = Journal(tmp_path / "j.jsonl").replay(expe)
+    assert done == {"EvalGenerator": {0}}
+    assert [a.text for a in expe[0].answers] == ["v2"]
+    assert expe[0].answers[0].eval.auto == 0.5
+
+
+def test_qa_with_a_failed_call_is_not_done_and_is_retried_on_resume(tmp_path):
+    async def flaky(**kw):
+        if kw["model"] == "b" and kw["messages"][1]["content"] == "q2":
+            raise ConnectionError("provider down")
+        return await fake(**kw)
+
+    llmmod.acompletion = flaky
+    llmmod.completion_cost = lambda a: 0.0
+    expe = Expe()
+    for q in ("q1", "q2"):
+        expe.append(QA(question=Question(text=q)))
+    path = expe.save_to_json(tmp_path / "expe.json")
+    _gen().generate(expe, journal=True)
+    lines = [json.loads(l) for l in path.with_suffix(".journal.jsonl").read_text(encoding="utf-8").splitlines()]
+    assert [l["qa"] for l in lines if l.get("done")] == [0]
+    assert [a.text for a in expe[1].answers] == ["<p>a q2</p>"]
+
+    llmmod.acompletion = fake
+    calls.clear()
+    resumed = Expe(path)
+    _gen().generate(resumed, resume=True)
+    assert calls == [("b", "q2")]
+    assert [a.text for a in resumed[1].answers] == ["<p>a q2</p>", "<p>b q2</p>"]
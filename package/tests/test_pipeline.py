@@ -0,0 +1,65 @@
+"""Tests for the streaming Pipeline chaining generators without stage barriers.
+
+No network / API keys required: fake LLMs sleep instead of calling a provider.
+"""
+import asyncio
+import warnings
+
+warnings.filterwarnings("ignore")
+
+from ragtime.expe import Expe, QA, Question, Prompt, LLMAnswer, Fact, Facts
+from ragtime.generators import AnsGenerator, EvalGenerator, Pipeline, Stage
+from ragtime.llms import LLM
+from ragtime.prompters.answer_prompters import AnsPrompterBase
+from ragtime.prompters.eval_prompters import EvalPrompterFR
+
+_events = []
+
+
+class TimedLLM(LLM):
+    async def complete(self, prompt: Prompt) -> LLMAnswer:
+        # the question "slow", and its answer, take longer to process than the others
+        delay: float = 0.3 if "slow" in prompt.user else 0.01
+        await asyncio.sleep(delay)
+        _events.append((self.name, prompt.user, asyncio.get_event_loop().time()))
+        return LLMAnswer(name=self.name, full_name=self.name, text=f"{prompt.user} (1)")
+
+
+def _expe() -> Expe:
+    expe = Expe()
+    for text in ["slow", "fast"]:
+        expe.append(QA(question=Question(text=text), facts=Facts(items=[Fact(text="1. f")])))
+    return expe
+
+
+def test_qa_moves_to_next_stage_without_waiting_for_the_others():
+    _events.clear()
+    expe = _expe()
+    ans_gen = AnsGenerator(llms=[TimedLLM(name="m", prompter=AnsPrompterBase())])
+    eval_gen = EvalGenerator(llms=[TimedLLM(name="judge", prompter=EvalPrompterFR())])
+    pipeline = Pipeline([Stage(ans_gen, max_in_flight=2), Stage(eval_gen, max_in_flight=1)], max_in_flight=0)
+    stats = pipeline.run(expe)
+
+    ends = {(name, "slow" in user): ts for name, user, ts in _events}
+    # the fast QA has been evaluated before the slow one has been answered
+    assert ends[("judge", False)] < ends[("m", True)]
+    assert stats.nb_done == 2 and stats.nb_failed == 0
+    assert stats.llm_calls == {"m": 2, "judge": 2}
+    assert all(qa.answers[0].eval.llm_answer.name == "judge" for qa in expe)
+    assert ans_gen.stats.nb_done == 2 and eval_gen.stats.peak_in_flight == 1
+
+
+def test_failed_qa_goes_through_next_stages_and_is_counted():
+    expe = _expe()
+    seen = []
+
+    def prepare(qa: QA):
+        if qa.question.text == "fast":
+            raise ValueError("boom")
+
+    ans_gen = AnsGenerator(llms=[TimedLLM(name="m", prompter=AnsPrompterBase())])
+    eval_gen = EvalGenerator(llms=[TimedLLM(name="judge", prompter=EvalPrompterFR())])
+    stats = Pipeline([Stage(ans_gen, prepare=prepare),
+                      Stage(eval_gen, prepare=lambda qa: seen.append(qa.question.text))]).run(expe)
+    assert sorted(seen) == ["fast", "slow"]
+    assert stats.nb_done == 1 and stats.nb_failed == 1
@@ -0,0 +1,82 @@
+"""Tests for the per-provider rate limits shared by LiteLLM instances.
+
+No network / API keys required (acompletion is monkeypatched).
+"""
+import asyncio
+import time
+import warnings
+
+warnings.filterwarnings("ignore")
+
+import ragtime.llms.llm as llmmod
+from ragtime.expe import Prompt
+from ragtime.llms import LiteLLM
+from ragtime.llms.rate_limiter import TokenBucket, get_rate_limiter, register_rate_limits, rate_limit_key
+from ragtime.prompters.answer_prompters import AnsPrompterBase
+
+llmmod.completion_cost = lambda a: 0.0
+
+
+def _run(coro):
+    return asyncio.new_event_loop().run_until_complete(coro)
+
+
+def test_token_bucket_reserves_in_debt():
+    bucket = TokenBucket(capacity=60, period=60.0)  # 1 unit per second
+    assert bucket.reserve(60) == 0.0
+    wait = bucket.reserve(2)
+    assert 1.9 < wait <= 2.0
+    bucket.adjust(-2)  # give back the 2 units
+    assert bucket.reserve(1) < 1.1
+
+
+def test_key_is_api_base_then_provider():
+    register_rate_limits("https://ovh.example/v1/", rpm=100)
+    register_rate_limits("mistral", rpm=100)
+    assert rate_limit_key("openai/Qwen3-32B", "https://ovh.example/v1/") == "https://ovh.example/v1"
+    assert rate_limit_key("mistral/mistral-large-latest") == "mistral"
+
+
+def test_catalog_limits_apply_to_their_model_only(monkeypatch):
+    import litellm
+
+    monkeypatch.setitem(litellm.model_cost, "catalog-fast", {"litellm_provider": "catalogprov", "rpm": 1000})
+    monkeypatch.setitem(litellm.model_cost, "catalog-slow", {"litellm_provider": "catalogprov", "rpm": 10})
+    # whichever model is called first, each one keeps the limits of its own catalog entry
+    assert get_rate_limiter("catalog-slow").rpm == 10
+    assert get_rate_limiter("catalog-fast").rpm == 1000
+    assert rate_limit_key("catalog-fast") == "catalogprov::catalog-fast"
+
+
+def test_limits_registered_per_model_are_not_shared():
+    api_base = "https://per-model.example/v1"
+    register_rate_limits(api_base, rpm=400, model="openai/a")
+    register_rate_limits(api_base, rpm=400, model="openai/b")
+    assert rate_limit_key("openai/a", api_base) == "https://per-model.example/v1::openai/a"
+    assert get_rate_limiter("openai/a", api_base) is not get_rate_limiter("openai/b", api_base)
+    assert get_rate_limiter("openai/a", api_base).rpm == 400
+    assert get_rate_limiter("openai/c", api_base) is None  # no limit registered for the key itself
+
+
+def test_limiter_is_shared_across_llms():
+    api_base = "https://stub.example/v1"
+    register_rate_limits(api_base, rpm=600)  # 10 requests per second, burst of 600
+    calls = []
+
+    async def fake(**kw):
+        calls.append(time.monotonic())
+        return {"model": kw["model"], "choices": [{"message": {"content": "ok"}}]}
+
+    llmmod.acompletion = fake
+    limiter = get_rate_limiter("openai/a", api_base)
+    assert limiter is get_rate_limiter("openai/b", api_base)
+    limiter.requests.reserve(600)  # empty the bucket: next calls are paced at 10 per second
+    llms = [LiteLLM(name=n, prompter=AnsPrompterBase(), extra_params={"api_base": api_base}) for n in ("openai/a", "openai/b")]
+
+    async def both():
+        return await asyncio.gather(*(llm.complete(Prompt(user="u", system="s")) for llm in llms))
+
+    start = time.monotonic()
+    answers = _run(both())
+    assert [a.text for a in answers] == ["ok", "ok"]
+    assert time.monotonic() - start >= 0.19  # 2 requests at 10 per second
@@ -0,0 +1,120 @@
+"""Tests for the async Retriever interface (thread pool fallback, micro-batching) and the CachedRetriever.
+
+No network / API keys required (acompletion is monkeypatched).
+"""
+import asyncio
+import time
+import warnings
+
+warnings.filterwarnings("ignore")
+
+import ragtime.llms.llm as llmmod
+from ragtime.expe import Chunk, Expe, QA, Question
+from ragtime.generators import AnsGenerator
+from ragtime.llms import LiteLLM
+from ragtime.prompters.answer_prompters import AnsPrompterBase
+from ragtime.retrievers import CachedRetriever, Retriever
+
+
+async def fake(**kw):
+    return {"model": kw["model"], "choices": [{"message": {"content": "ok"}}]}
+
+
+retrieved = []
+
+
+class SlowRetriever(Retriever):
+    k: int = 5
+
+    def retrieve(self, qa: QA):
+        retrieved.append(qa.question.text)
+        time.sleep(0.2)
+        qa.chunks.append(Chunk(text=f"chunk of {qa.question.text}"))
+
+
+batches = []
+
+
+class BatchRetriever(Retriever):
+    batch_size: int = 4
+
+    def retrieve(self, qa: QA):
+        raise AssertionError("retrieve_many must be used")
+
+    async def retrieve_many(self, qas: list[QA]):
+        batches.append([qa.question.text for qa in qas])
+        await asyncio.sleep(0.01)
+        for qa in qas:
+            qa.chunks.append(Chunk(text=f"chunk of {qa.question.text}"))
+
+
+def _expe(nb: int) -> Expe:
+    expe = Expe()
+    for i in range(nb):
+        expe.append(QA(question=Question(text=f"q{i}")))
+    return expe
+
+
+def test_sync_retrievers_do_not_block_the_other_qas():
+    llmmod.acompletion = fake
+    llmmod.completion_cost = lambda a: 0.0
+    expe = _expe(5)
+    gen = AnsGenerator(llms=[LiteLLM(name="m", prompter=AnsPrompterBase())], retriever=SlowRetriever())
+    start: float = time.perf_counter()
+    gen.generate(expe, max_in_flight=5)
+    assert time.perf_counter() - start < 0.8  # 5 x 0.2s if the retrievals were run one after the other
+    assert [qa.chunks[0].text for qa in expe] == [f"chunk of q{i}" for i in range(5)]
+
+
+def test_concurrent_retrievals_are_grouped():
+    llmmod.acompletion = fake
+    llmmod.completion_cost = lambda a: 0.0
+    expe = _expe(10)
+    batches.clear()
+    gen = AnsGenerator(llms=[LiteLLM(name="m", prompter=AnsPrompterBase())], retriever=BatchRetriever())
+    gen.generate(expe, max_in_flight=10)
+    assert sorted(q for b in batches for q in b) == sorted(f"q{i}" for i in range(10))
+    assert max(len(b) for b in batches) == 4 and len(batches) == 3
+    assert all(len(qa.chunks) == 1 and len(qa.answers) == 1 for qa in expe)
+
+
+def test_retrieve_many_default_gathers_aretrieve():
+    expe = _expe(3)
+    asyncio.new_event_loop().run_until_complete(SlowRetriever().retrieve_many(list(expe)))
+    assert all(len(qa.chunks) == 1 for qa in expe)
+
+
+def test_cached_retriever_reuses_chunks_across_instances(tmp_path):
+    path = tmp_path / "retrieval.sqlite"
+    retrieved.clear()
+    expe = _expe(3)
+    cached = CachedRetriever(SlowRetriever(), cache=path)
+    for qa in expe:
+        cached.retrieve(qa)
+    assert len(retrieved) == 3 and len(cached.cache) == 3
+
+    # another run, another process: same file, same config -> no call
+    other_expe = _expe(3)
+    asyncio.new_event_loop().run_until_complete(CachedRetriever(SlowRetriever(), cache=path).retrieve_many(list(other_expe)))
+    assert len(retrieved) == 3
+    assert [qa.chunks[0].text for qa in other_expe] == ["chunk of q0", "chunk of q1", "chunk of q2"]
+    assert all(qa.chunks.meta["cached"] for qa in other_expe)
+
+    # the config of the retriever and the meta of the question are part of the key
+    other_k = SlowRetriever(k=10)
+    CachedRetriever(other_k, cache=path).retrieve(_expe(1)[0])
+    qa = _expe(1)[0]
+    qa.question.meta["folder_id"] = 3
+    CachedRetriever(other_k, cache=path).retrieve(qa)
+    assert len(retrieved) == 5
+
+
+def test_cached_chunks_expire(tmp_path):
+    retrieved.clear()
+    cached = CachedRetriever(SlowRetriever(), cache=tmp_path / "retrieval.sqlite", ttl=0.1)
+    cached.retrieve(_expe(1)[0])
+    cached.retrieve(_expe(1)[0])
+    assert len(retrieved) == 1
+    time.sleep(0.15)
+    cached.retrieve(_expe(1)[0])
+    assert len(retrieved) == 2
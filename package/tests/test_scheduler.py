@@ -0,0 +1,115 @@
+"""Tests for the bounded-concurrency Scheduler driving TextGenerator.generate.
+
+No network / API keys required: a fake LLM sleeps instead of calling a provider
+and records how many calls are in flight at the same time.
+"""
+import asyncio
+import warnings
+
+warnings.filterwarnings("ignore")
+
+from ragtime.expe import Expe, QA, Question, Prompt, LLMAnswer, Answer, Answers, Eval, Fact, Facts
+from ragtime.generators import AnsGenerator, EvalGenerator
+from ragtime.llms import LLM
+from ragtime.prompters.answer_prompters import AnsPrompterBase
+from ragtime.prompters.eval_prompters import EvalPrompterFR
+from ragtime.scheduler import Scheduler, percentile
+
+_in_flight = {"now": 0, "peak": 0}
+
+
+class SleepyLLM(LLM):
+    delay: float = 0.01
+
+    async def complete(self, prompt: Prompt) -> LLMAnswer:
+        _in_flight["now"] += 1
+        _in_flight["peak"] = max(_in_flight["peak"], _in_flight["now"])
+        await asyncio.sleep(self.delay)
+        _in_flight["now"] -= 1
+        return LLMAnswer(name=self.name, full_name=self.name, text=f"{self.name}: {prompt.user}")
+
+
+def _expe(nb_q: int) -> Expe:
+    expe = Expe()
+    for i in range(nb_q):
+        expe.append(QA(question=Question(text=f"q{i}")))
+    return expe
+
+
+def test_generate_respects_max_in_flight():
+    _in_flight.update(now=0, peak=0)
+    expe = _expe(30)
+    gen = AnsGenerator(llms=[SleepyLLM(name="m", prompter=AnsPrompterBase())])
+    gen.generate(expe, max_in_flight=4)
+    assert _in_flight["peak"] <= 4
+    assert gen.stats.nb_done == 30 and gen.stats.nb_failed == 0
+    assert gen.stats.peak_in_flight == 4
+    assert gen.stats.llm_calls == {"m": 30}
+    assert all(len(qa.answers) == 1 for qa in expe)
+
+
+def test_per_llm_limit():
+    _in_flight.update(now=0, peak=0)
+    gen = AnsGenerator(llms=[SleepyLLM(name="m", prompter=AnsPrompterBase())])
+    gen.generate(_expe(10), max_in_flight=0, max_in_flight_per_llm={"m": 2})
+    assert _in_flight["peak"] <= 2
+    assert gen.stats.nb_done == 10
+
+
+def test_failures_are_counted_and_do_not_stop_the_run():
+    async def worker(num, item):
+        if num % 2:
+            raise ValueError("boom")
+
+    stats = asyncio.new_event_loop().run_until_complete(Scheduler(max_in_flight=3).run(range(10), worker))
+    assert stats.nb_done == 5 and stats.nb_failed == 5
+    assert len(stats.item_latencies) == 10
+
+
+def test_percentile():
+    assert percentile([], 0.5) == 0.0
+    assert percentile([3.0, 1.0, 2.0], 0.5) == 2.0
+    assert percentile([1.0, 2.0], 1.0) == 2.0
+
+
+def test_pacer_spaces_calls_without_blocking_the_loop():
+    starts = []
+
+    class StampLLM(SleepyLLM):
+        async def complete(self, prompt: Prompt) -> LLMAnswer:
+            starts.append(asyncio.get_event_loop().time())
+            return await super().complete(prompt)
+
+    _in_flight.update(now=0, peak=0)
+    gen = AnsGenerator(llms=[StampLLM(name="m", prompter=AnsPrompterBase(), delay=0.1)])
+    gen.wait_between_calls = 0.05
+    gen.generate(_expe(4), max_in_flight=4)
+    # 4 calls spaced by 0.05s span at least 0.15s - some slack as the first call may be stamped late
+    assert starts[-1] - starts[0] >= 0.13
+    # calls overlap: pacing only delays the start of the next call, it does not wait for the previous one
+    assert _in_flight["peak"] > 1
+
+
+def test_llms_of_a_qa_run_concurrently_and_keep_their_order():
+    _in_flight.update(now=0, peak=0)
+    expe = _expe(1)
+    gen = AnsGenerator(llms=[SleepyLLM(name="slow", prompter=AnsPrompterBase(), delay=0.2),
+                             SleepyLLM(name="fast", prompter=AnsPrompterBase(), delay=0.01)])
+    gen.generate(expe, max_in_flight=0)
+    assert _in_flight["peak"] == 2
+    assert [a.llm_answer.name for a in expe[0].answers] == ["slow", "fast"]
+    assert gen.stats.duration < 0.3
+
+
+def test_answers_of_a_qa_are_evaluated_concurrently():
+    _in_flight.update(now=0, peak=0)
+    qa = QA(question=Question(text="q"), facts=Facts(items=[Fact(text="1. f")]))
+    qa.answers = Answers(items=[Answer(text=f"a{i} (1)", llm_answer=LLMAnswer(name=f"m{i}"), eval=Eval(human=i + 1))
+                                for i in range(3)])
+    expe = Expe()
+    expe.append(qa)
+    gen = EvalGenerator(llms=[SleepyLLM(name="judge", prompter=EvalPrompterFR(), delay=0.05)])
+    gen.generate(expe, max_in_flight=0)
+    assert _in_flight["peak"] == 3
+    assert [a.eval.human for a in qa.answers] == [1, 2, 3]
+    assert all(a.eval.llm_answer.name == "judge" for a in qa.answers)
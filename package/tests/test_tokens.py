@@ -0,0 +1,93 @@
+"""Tests for token counting and the prompt budget of AnsPrompterWithRetrieverFR.
+
+No network / API keys required.
+"""
+import warnings
+
+warnings.filterwarnings("ignore")
+
+from ragtime.expe import Chunk, Chunks, Question
+from ragtime.prompters.answer_prompters import AnsPrompterWithRetrieverFR, AnsPrompterWithRetrieverFR_2024_06_04
+from ragtime.tokens import (context_window, count_tokens, prompt_target, prompt_token_budget,
+                            register_context_window, truncate_to_tokens)
+
+
+def _chunks(*scores) -> Chunks:
+    result = Chunks()
+    for num, score in enumerate(scores):
+        result.append(Chunk(text=f"chunk{num} " + "mot " * 100, meta={"score": score}))
+    return result
+
+
+def test_budget_from_the_catalog_or_registered_window():
+    assert context_window("gpt-4o-mini") == 128000
+    assert context_window("openai/Mistral-7B-Instruct-v0.3") == context_window("ovhcloud/Mistral-7B-Instruct-v0.3")
+    register_context_window("my-private-model", 1000)
+    assert prompt_token_budget("my-private-model", max_output_tokens=200) == 800
+    assert prompt_token_budget("my-private-model", max_output_tokens=200, max_prompt_tokens=500) == 500
+    assert prompt_token_budget("unknown-model") is None
+    text = "un texte assez long " * 50
+    assert count_tokens(truncate_to_tokens(text, 20, "gpt-4o"), "gpt-4o") <= 20
+
+
+def test_chunks_fit_the_budget_by_score():
+    prompter = AnsPrompterWithRetrieverFR()
+    question = Question(text="Quelle est la question ?")
+    chunks = _chunks(0.1, 0.9, None, 0.5)
+
+    # no known limit: every chunk is kept and the prompt is not annotated
+    full = prompter.get_prompt(question=question, chunks=chunks)
+    assert "token_budget" not in full.meta and all(f"chunk{i}" in full.user for i in range(4))
+
+    chunk_tokens = count_tokens(full.user, "gpt-4o") // 4
+    prompter.max_prompt_tokens = count_tokens(prompter.system, "gpt-4o") + 2 * chunk_tokens + 100
+    token = prompt_target.set(("gpt-4o", 2000))
+    try:
+        prompt = prompter.get_prompt(question=question, chunks=chunks)
+    finally:
+        prompt_target.reset(token)
+    decisions = prompt.meta["token_budget"]
+    # the 2 best chunks, then the next best one truncated to the remaining tokens
+    assert decisions["kept"] == [0, 1, 3] and decisions["truncated"] == [0] and decisions["dropped"] == [2]
+    assert decisions["budget"] == prompter.max_prompt_tokens
+    assert count_tokens(prompt.system, "gpt-4o") + count_tokens(prompt.user, "gpt-4o") <= decisions["budget"]
+    assert prompt.user.index("chunk1") < prompt.user.index("chunk3")  # the original order is kept
+
+
+def test_old_prompter_with_retriever_is_budgeted_too():
+    prompter = AnsPrompterWithRetrieverFR_2024_06_04()
+    question = Question(text="Quelle est la question ?")
+    chunks = _chunks(0.1, 0.9)
+    for chunk in chunks:
+        chunk.meta.update({"display_name": "doc", "page_number": 1})
+    prompter.max_prompt_tokens = count_tokens(prompter.system, "gpt-4o") + 200
+    token = prompt_target.set(("gpt-4o", 2000))
+    try:
+        prompt = prompter.get_prompt(question=question, chunks=chunks)
+    finally:
+        prompt_target.reset(token)
+    decisions = prompt.meta["token_budget"]
+    # the best chunk whole, then the other one truncated to the remaining tokens
+    assert decisions["kept"] == [0, 1] and decisions["truncated"] == [0] and decisions["budget"] == prompter.max_prompt_tokens
+
+
+def test_reasoning_llm_reserves_its_effective_max_tokens():
+    import asyncio
+
+    import ragtime.llms.llm as llmmod
+    from ragtime.expe import QA, Answer, StartFrom
+    from ragtime.llms import ReasoningLLM
+
+    async def fake(**kw):
+        return {"model": kw["model"], "choices": [{"message": {"content": "ok"}}]}
+
+    llmmod.acompletion = fake
+    llmmod.completion_cost = lambda a: 0.0
+    register_context_window("my-reasoning-model", 20000)
+    llm = ReasoningLLM(name="my-reasoning-model", prompter=AnsPrompterWithRetrieverFR())
+    qa = QA(question=Question(text="Quelle est la question ?"), chunks=_chunks(0.5))
+    answer = asyncio.new_event_loop().run_until_complete(llm.generate(
+        cur_obj=Answer(), prev_obj=None, qa=qa, start_from=StartFrom.beginning, b_missing_only=False,
+        question=qa.question, chunks=qa.chunks))
+    # the 16000 tokens of reasoning and answer are kept out of the prompt, not just max_tokens
+    assert answer.llm_answer.prompt.meta["token_budget"]["budget"] == 20000 - llm._effective_max_tokens() == 4000